@@ -0,0 +1,201 @@
+"""
+Asyncio engine for Telegram I/O
+
+The handlers registered by register_*_handlers stay ordinary functions
+running on the dispatcher's worker shards. What changes in this engine is
+how the bot talks to Telegram: updates are long-polled by an AsyncTeleBot
+and every Bot API call made by a handler is performed by a shared aiohttp
+client on a single event loop, instead of one blocking requests
+connection per thread.
+
+A handler still waits for the calls whose result it uses (a sent
+message's id, say). Calls whose result nobody reads (DETACHED_METHODS:
+callback answers, chat actions) are only scheduled: the handler gets an
+ok response at once and the loop sends them, so an answer to a slow Bot
+API never holds a worker. Other slow I/O (Stripe sessions, Mailgun) can
+run on the same loop through submit(), which hands back a future instead
+of blocking the caller.
+"""
+import asyncio
+import concurrent.futures
+import json
+import threading
+
+import aiohttp
+from telebot import apihelper
+from telebot.async_telebot import AsyncTeleBot
+
+
+class _Response:
+    """Minimal stand-in for requests.Response used by telebot's result checks"""
+    __slots__ = ('status_code', 'reason', 'text')
+
+    def __init__(self, status_code, reason, text):
+        self.status_code = status_code
+        self.reason = reason
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+# Bot API methods whose results handlers never use
+DETACHED_METHODS = frozenset({'answerCallbackQuery', 'sendChatAction'})
+MAX_DETACHED_ATTEMPTS = 3
+MAX_DETACHED_RETRY_AFTER = 5  # Seconds; longer 429s drop the call
+
+_DETACHED_RESPONSE = _Response(200, 'OK', '{"ok":true,"result":true}')
+
+FULL_SHARD_BACKOFF = 0.05  # Seconds between retries while a shard is full
+POLL_ERROR_BACKOFF = 3  # Seconds before polling again after getUpdates failed
+
+
+class AsyncEngine:
+    """Runs polling and outbound Bot API requests on an asyncio event loop"""
+
+    def __init__(self, bot, dispatcher, connection_limit=100):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.connection_limit = connection_limit
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever,
+            name="async-engine",
+            daemon=True
+        )
+        self._session = None
+        self._polling = None
+        # Metrics
+        self.detached = 0
+        self.detached_failed = 0
+
+    @property
+    def session(self):
+        """The shared aiohttp session, for coroutines run with submit()"""
+        return self._session
+
+    def start(self):
+        """Start the event loop and route the bot's API calls through it"""
+        self._thread.start()
+        self.run(self._open_session())
+        apihelper.CUSTOM_REQUEST_SENDER = self.send_request
+
+    def stop(self):
+        """Close the HTTP client and stop the event loop"""
+        if apihelper.CUSTOM_REQUEST_SENDER == self.send_request:
+            apihelper.CUSTOM_REQUEST_SENDER = None
+        self.run(self._session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def submit(self, coro):
+        """Schedule a coroutine on the engine loop from any thread; returns a concurrent future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the engine loop from any thread and wait for it"""
+        return self.submit(coro).result(timeout)
+
+    async def _open_session(self):
+        connector = aiohttp.TCPConnector(limit=self.connection_limit)
+        self._session = aiohttp.ClientSession(connector=connector)
+
+    def send_request(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        """telebot request sender that performs the HTTP call on the event loop"""
+        if url.rsplit('/', 1)[-1] in DETACHED_METHODS and not files:
+            self.submit(self._detached(method, url, params, timeout))
+            return _DETACHED_RESPONSE
+        return self.run(self._request(method, url, params, files, timeout))
+
+    async def _detached(self, method, url, params, timeout):
+        api_method = url.rsplit('/', 1)[-1]
+        self.detached += 1
+        for attempt in range(1, MAX_DETACHED_ATTEMPTS + 1):
+            try:
+                response = await self._request(method, url, params, None, timeout)
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            else:
+                if response.status_code == 200:
+                    return
+                error = f"{response.status_code} {response.text}"
+                if response.status_code == 429 and attempt < MAX_DETACHED_ATTEMPTS:
+                    try:
+                        retry_after = response.json().get('parameters', {}).get('retry_after', 1)
+                    except ValueError:
+                        retry_after = 1
+                    if retry_after <= MAX_DETACHED_RETRY_AFTER:
+                        await asyncio.sleep(retry_after)
+                        continue
+                break
+        self.detached_failed += 1
+        print(f"[async-engine] {api_method} failed: {error}")
+
+    async def _request(self, method, url, params, files, timeout):
+        # Like telebot's requests sender: parameters go in the query string
+        # (None dropped, everything else as str) and files in a multipart body
+        query = {key: str(value) for key, value in (params or {}).items() if value is not None}
+        data = None
+        if files:
+            data = aiohttp.FormData()
+            for key, value in files.items():
+                if isinstance(value, tuple):
+                    data.add_field(key, value[1], filename=value[0])
+                else:
+                    data.add_field(key, value, filename=key)
+
+        connect_timeout, read_timeout = timeout or (None, None)
+        client_timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout,
+            sock_read=read_timeout
+        )
+
+        async with self._session.request(
+            method.upper(), url, params=query, data=data, timeout=client_timeout
+        ) as response:
+            text = await response.text()
+            return _Response(response.status, response.reason, text)
+
+    def stats(self):
+        """Get counters for monitoring"""
+        return {
+            'detached': self.detached,
+            'detached_failed': self.detached_failed
+        }
+
+    def run_polling(self, timeout=20):
+        """Long-poll Telegram on the event loop, feeding the dispatcher, until stop_polling()"""
+        self._polling = self.submit(self._poll(timeout))
+        try:
+            self._polling.result()
+        except concurrent.futures.CancelledError:
+            pass
+
+    def stop_polling(self):
+        """Stop run_polling (from any thread)"""
+        if self._polling is not None:
+            self._polling.cancel()
+
+    async def _poll(self, timeout):
+        # One loop fetches a batch, hands it to the dispatcher in order and
+        # only then asks for the next: a user's updates reach their shard in
+        # the order Telegram sent them, and while a shard is full nothing
+        # more is fetched, so Telegram holds the backlog instead of us
+        async_bot = AsyncTeleBot(self.bot.token)
+        try:
+            await async_bot.delete_webhook()
+            offset = None
+            while True:
+                try:
+                    updates = await async_bot.get_updates(
+                        offset=offset, timeout=timeout, request_timeout=timeout + 10
+                    )
+                except Exception as e:
+                    print(f"[async-engine] getUpdates failed: {e}")
+                    await asyncio.sleep(POLL_ERROR_BACKOFF)
+                    continue
+                for update in updates:
+                    while not self.dispatcher.submit(update, block=False):
+                        await asyncio.sleep(FULL_SHARD_BACKOFF)
+                    offset = update.update_id + 1
+        finally:
+            await async_bot.close_session()
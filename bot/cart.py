@@ -0,0 +1,114 @@
+"""
+Shopping cart with running aggregates
+
+A cart maps product names to quantities, like the plain dict it replaces,
+but keeps its item count and total price up to date as lines change so
+the bot can answer "N items, £X" on every click without walking the cart.
+
+The total is priced against a specific catalog. Changes while the total is
+valid adjust it by the line's unit price; reading the total with a
+different catalog version (after a hot reload) or after the cart was
+loaded from storage re-prices every line once. Carts are stored and
+snapshotted as plain dicts via to_dict()/from_dict().
+"""
+
+
+class Cart:
+    """Product name -> quantity mapping with O(1) count and total"""
+    __slots__ = ('_lines', 'count', '_total_minor', '_priced_catalog', 'dirty')
+
+    def __init__(self, lines=None):
+        self._lines = {}
+        self.count = 0
+        self._total_minor = 0
+        self._priced_catalog = None
+        # True while the running total has to be re-priced before use
+        self.dirty = True
+        for name, quantity in (lines or {}).items():
+            self.set_quantity(name, quantity)
+
+    def _adjust_total(self, name, delta):
+        """Apply a quantity change to the running total"""
+        if not self.dirty:
+            self._total_minor += self._priced_catalog.price_minor(name) * delta
+
+    def add(self, name, quantity=1):
+        """Add quantity of a product"""
+        self.set_quantity(name, self._lines.get(name, 0) + quantity)
+
+    def set_quantity(self, name, quantity):
+        """Set a product's quantity, removing the line if it drops to 0 or below"""
+        old = self._lines.get(name, 0)
+        if quantity <= 0:
+            quantity = 0
+            self._lines.pop(name, None)
+        else:
+            self._lines[name] = quantity
+        self.count += quantity - old
+        self._adjust_total(name, quantity - old)
+
+    def remove(self, name):
+        """Remove a product's line"""
+        self.set_quantity(name, 0)
+
+    def clear(self):
+        """Remove every line"""
+        self._lines.clear()
+        self.count = 0
+        self._total_minor = 0
+
+    def total_minor(self, catalog):
+        """Get the cart total in minor units, priced with catalog
+
+        Items missing from the catalog count as 0, as in Catalog.split_cart.
+        """
+        if self.dirty or self._priced_catalog is None or self._priced_catalog.version != catalog.version:
+            self._total_minor = sum(
+                catalog.price_minor(name) * quantity for name, quantity in self._lines.items()
+            )
+            self._priced_catalog = catalog
+            self.dirty = False
+        return self._total_minor
+
+    def items(self):
+        return self._lines.items()
+
+    def keys(self):
+        return self._lines.keys()
+
+    def values(self):
+        return self._lines.values()
+
+    def get(self, name, default=None):
+        return self._lines.get(name, default)
+
+    def __getitem__(self, name):
+        return self._lines[name]
+
+    def __contains__(self, name):
+        return name in self._lines
+
+    def __iter__(self):
+        return iter(self._lines)
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __eq__(self, other):
+        if isinstance(other, Cart):
+            return self._lines == other._lines
+        return self._lines == other
+
+    def __repr__(self):
+        return f"Cart({self._lines!r})"
+
+    def to_dict(self):
+        """Get the cart lines as a plain dict"""
+        return dict(self._lines)
+
+    @classmethod
+    def from_dict(cls, lines):
+        """Rebuild a cart from to_dict() output (or a legacy plain dict)"""
+        if isinstance(lines, Cart):
+            return lines
+        return cls(lines)
@@ -0,0 +1,157 @@
+"""
+Compiled, immutable product catalog
+
+config.json lists prices as strings grouped by category. The catalog parses
+them once into integer minor units (pence/cents), preformats every price
+label and indexes products by name and by category, so handlers and
+services never rebuild dicts or parse floats per request.
+
+Inline buttons refer to products and categories by compact ids rather than
+names: callback_data is "<kind>:<catalog version>:<base-36 id>", e.g.
+"p:1x2k9qz:3f". Category buttons can add a page number ("c:1x2k9qz:2:1").
+Ids are positions in the catalog, so decoding a click is a
+version comparison plus a tuple index, and buttons rendered from an older
+catalog are rejected instead of resolving to the wrong product.
+"""
+import json
+import zlib
+from collections import namedtuple
+from types import MappingProxyType
+
+from bot.utils.formatting import format_minor, to_minor_units
+
+Product = namedtuple('Product', ['id', 'name', 'category', 'price_minor', 'price_label'])
+
+BASE36_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+PRODUCT_CALLBACK_PREFIX = 'p:'
+CATEGORY_CALLBACK_PREFIX = 'c:'
+
+
+def _to_base36(number):
+    """Encode a non-negative integer in base 36"""
+    digits = []
+    while True:
+        number, remainder = divmod(number, 36)
+        digits.append(BASE36_DIGITS[remainder])
+        if number == 0:
+            return ''.join(reversed(digits))
+
+
+class Catalog:
+    """Read-only product index built once from the products config"""
+
+    def __init__(self, products_config, currency='GBP'):
+        products = {}
+        category_products = {}
+        category_items = {}
+
+        for category, items in products_config.items():
+            names = []
+            for name, price in items.items():
+                if name in products:
+                    raise ValueError(f"Product {name!r} is listed in more than one category")
+                price_minor = to_minor_units(price)
+                products[name] = Product(
+                    len(products), name, category, price_minor,
+                    format_minor(price_minor, currency)
+                )
+                names.append(name)
+            category_products[category] = tuple(names)
+            category_items[category] = tuple(products[name] for name in names)
+
+        self.currency = currency
+        # Content hash: identical configs get the same version in every process
+        canonical = json.dumps([currency, products_config], ensure_ascii=False)
+        self.version = _to_base36(zlib.crc32(canonical.encode('utf-8')))
+        self.products = MappingProxyType(products)
+        self.categories = tuple(category_products)
+        self.category_products = MappingProxyType(category_products)
+        # Ids are positions in these tuples
+        self._products_by_id = tuple(products.values())
+        self._category_ids = {category: i for i, category in enumerate(self.categories)}
+        self._category_items = category_items
+
+    def get(self, name):
+        """Get a product by name, or None"""
+        return self.products.get(name)
+
+    def price_minor(self, name):
+        """Get a product's unit price in minor units (0 if unknown)"""
+        product = self.products.get(name)
+        return product.price_minor if product is not None else 0
+
+    def split_cart(self, cart):
+        """Split cart lines into (available, unavailable) by this catalog
+
+        available is a list of (product, quantity); unavailable lists the
+        names of items that were removed from the catalog since they were
+        added, in cart order.
+        """
+        available = []
+        unavailable = []
+        for name, quantity in cart.items():
+            product = self.products.get(name)
+            if product is None:
+                unavailable.append(name)
+            else:
+                available.append((product, quantity))
+        return available, unavailable
+
+    def product_callback(self, product):
+        """Get the callback_data for a product button"""
+        return f"{PRODUCT_CALLBACK_PREFIX}{self.version}:{_to_base36(product.id)}"
+
+    def category_callback(self, category, page=0):
+        """Get the callback_data for a category button, optionally for a later page"""
+        data = f"{CATEGORY_CALLBACK_PREFIX}{self.version}:{_to_base36(self._category_ids[category])}"
+        if page:
+            data = f"{data}:{_to_base36(page)}"
+        return data
+
+    def _decode_ids(self, data, prefix):
+        """Get the ids encoded in callback_data, None if malformed or stale"""
+        if not data.startswith(prefix):
+            return None
+        version, sep, encoded = data[len(prefix):].partition(':')
+        if not sep or version != self.version:
+            return None
+        try:
+            return [int(part, 36) for part in encoded.split(':')]
+        except ValueError:
+            return None
+
+    def decode_product(self, data):
+        """Resolve product callback_data to a Product, None if malformed or stale"""
+        ids = self._decode_ids(data, PRODUCT_CALLBACK_PREFIX)
+        if ids is None or len(ids) != 1 or not 0 <= ids[0] < len(self._products_by_id):
+            return None
+        return self._products_by_id[ids[0]]
+
+    def decode_category(self, data):
+        """Resolve category callback_data to (category name, page), None if malformed or stale"""
+        ids = self._decode_ids(data, CATEGORY_CALLBACK_PREFIX)
+        if ids is None or len(ids) > 2 or not 0 <= ids[0] < len(self.categories):
+            return None
+        page = ids[1] if len(ids) == 2 else 0
+        return self.categories[ids[0]], page
+
+    def products_in_category(self, category):
+        """Get the products of a category in config order"""
+        return list(self._category_items.get(category, ()))
+
+    def page_count(self, category, page_size):
+        """Get the number of pages a category needs (at least 1)"""
+        return max(1, -(-len(self._category_items.get(category, ())) // page_size))
+
+    def category_page(self, category, page, page_size):
+        """Get (products on page, page, page count) for a category
+
+        The page is clamped to the valid range; slicing the precomputed
+        category order keeps this O(page_size).
+        """
+        items = self._category_items.get(category, ())
+        page_count = self.page_count(category, page_size)
+        page = min(max(page, 0), page_count - 1)
+        start = page * page_size
+        return items[start:start + page_size], page, page_count
@@ -3,22 +3,40 @@ Configuration management for the bot
 """
 import os
 import json
+import threading
+import time
+from bot.catalog import Catalog
 
 class Config:
     """Bot configuration loader"""
     
-    def __init__(self):
+    def __init__(self, path='config.json'):
         # Load config.json
-        with open('config.json', 'r', encoding='utf-8') as f:
+        self.path = path
+        self._config_stat = self._stat_config()
+        with open(path, 'r', encoding='utf-8') as f:
             self.config_data = json.load(f)
         
         # Bot configuration
         self.shop_name = self.config_data.get('shop_name', 'Shop')
         self.currency = self.config_data.get('currency', 'GBP')
         self.products = self.config_data.get('products', {})
+        # Handlers should read config.catalog once per update: reloads swap
+        # in a whole new Catalog, never modify the current one
+        self.catalog = Catalog(self.products, self.currency)
+        self.config_reload_interval = float(os.getenv('CONFIG_RELOAD_INTERVAL', 5))
+        # Products shown per page of a category
+        self.products_page_size = int(os.getenv('PRODUCTS_PAGE_SIZE', 10))
+        # Minimum seconds between edits of a chat's live cart message
+        self.live_cart_edit_window = float(os.getenv('LIVE_CART_EDIT_WINDOW', 1.0))
+        # Seconds a chat's tidy-up deletions wait to be batched into one call
+        self.delete_batch_delay = float(os.getenv('DELETE_BATCH_DELAY', 1.0))
         
         # Environment variables
         self.telegram_token = os.getenv('TELEGRAM_BOT_TOKEN', '')
+        # 'polling' (default) or 'webhook'
+        self.telegram_mode = os.getenv('TELEGRAM_MODE', 'polling').lower()
+        self.telegram_webhook_secret = os.getenv('TELEGRAM_WEBHOOK_SECRET', '')
         self.stripe_secret_key = os.getenv('STRIPE_SECRET_KEY', '')
         self.stripe_webhook_secret = os.getenv('STRIPE_WEBHOOK_SECRET', '')
         
@@ -27,24 +45,117 @@ class Config:
         self.mailgun_domain = os.getenv('MAILGUN_DOMAIN', '')
         self.mailgun_from = os.getenv('MAILGUN_FROM_EMAIL', '')
         self.mailgun_to = os.getenv('MAILGUN_TO_EMAIL', '')
+        # https://api.eu.mailgun.net for EU domains
+        self.mailgun_api_base = os.getenv('MAILGUN_API_BASE', 'https://api.mailgun.net')
+        
+        # Pooled HTTP clients for Telegram, Stripe and Mailgun
+        self.http_pool_size = int(os.getenv('HTTP_POOL_SIZE', 16))
+        self.http_connect_timeout = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+        self.http_read_timeout = float(os.getenv('HTTP_READ_TIMEOUT', 30))
         
         # Flask
         self.flask_host = os.getenv('FLASK_HOST', '0.0.0.0')
         self.flask_port = int(os.getenv('FLASK_PORT', 5000))
+        # /stats answers localhost, or requests carrying this token in X-Stats-Token
+        self.stats_token = os.getenv('STATS_TOKEN', '')
         
         self.public_url = os.getenv('PUBLIC_URL', '')
+        
+        # Engine: 'sync' (requests) or 'async' (aiohttp event loop)
+        self.bot_engine = os.getenv('BOT_ENGINE', 'sync').lower()
+        self.async_connection_limit = int(os.getenv('ASYNC_CONNECTION_LIMIT', 100))
+        
+        # Session storage: 'memory' (single process) or 'sqlite' (shared)
+        self.session_store = os.getenv('SESSION_STORE', 'memory').lower()
+        self.session_db_path = os.getenv('SESSION_DB_PATH', 'sessions.db')
+        # Warm-restart snapshots of in-memory sessions ('' disables)
+        self.session_snapshot_path = os.getenv('SESSION_SNAPSHOT_PATH', 'sessions.snapshot')
+        self.session_snapshot_interval = float(os.getenv('SESSION_SNAPSHOT_INTERVAL', 5))
+        
+        # Outbound Bot API rate limits (OUTBOX_GLOBAL_RATE=0 disables the outbox)
+        self.outbox_global_rate = float(os.getenv('OUTBOX_GLOBAL_RATE', 30))
+        self.outbox_chat_rate = float(os.getenv('OUTBOX_CHAT_RATE', 1))
+        self.outbox_chat_burst = int(os.getenv('OUTBOX_CHAT_BURST', 3))
+        # Longest a call is held for a chat Telegram has rate limited
+        self.outbox_max_wait = float(os.getenv('OUTBOX_MAX_WAIT', 5))
+        if self.outbox_global_rate < 0 or (
+            self.outbox_global_rate > 0 and (self.outbox_chat_rate <= 0 or self.outbox_chat_burst < 1)
+        ):
+            raise ValueError(
+                "OUTBOX_GLOBAL_RATE must be 0 (no outbox) or more, OUTBOX_CHAT_RATE more than 0 "
+                "and OUTBOX_CHAT_BURST at least 1"
+            )
+        
+        # Order journal: group-committed JSON lines; checkouts wait for the
+        # fsync unless ORDER_JOURNAL_DURABLE is off
+        self.order_journal_path = os.getenv('ORDER_JOURNAL_PATH', 'orders.jsonl')
+        self.order_commit_window = float(os.getenv('ORDER_COMMIT_WINDOW', 0))
+        self.order_journal_durable = os.getenv('ORDER_JOURNAL_DURABLE', 'true').lower() in ('1', 'true', 'yes')
+        # Indexed order store fed by the journal ('' disables /myorders and
+        # payment status updates)
+        self.order_db_path = os.getenv('ORDER_DB_PATH', 'orders.db')
+        # Stripe checkout sessions are created in the background; after
+        # PAYMENT_SESSION_TIMEOUT seconds the customer is offered a retry
+        self.payment_workers = int(os.getenv('PAYMENT_WORKERS', 4))
+        self.payment_session_timeout = float(os.getenv('PAYMENT_SESSION_TIMEOUT', 15))
+        self.payment_session_retries = int(os.getenv('PAYMENT_SESSION_RETRIES', 2))
+        # Telegram user ids allowed to use admin commands (/report)
+        self.admin_user_ids = {
+            int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()
+        }
+        
+        # Update dispatcher
+        self.dispatch_workers = int(os.getenv('DISPATCH_WORKERS', 8))
+        self.dispatch_queue_size = int(os.getenv('DISPATCH_QUEUE_SIZE', 1000))
     
-    def get_categories(self):
-        """Get list of product categories"""
-        return list(self.products.keys())
+    def _stat_config(self):
+        """Get the (inode, mtime, size) of config.json used to detect edits
+
+        The inode catches a file replaced within the filesystem's mtime
+        granularity by one of the same size (e.g. a changed price).
+        """
+        stat = os.stat(self.path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    
+    def reload_catalog(self):
+        """Reload products from config.json; returns True if a new catalog was swapped in
+
+        The new catalog is parsed and validated before the swap, so a broken
+        edit leaves the current catalog in place.
+        """
+        config_stat = self._stat_config()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config_data = json.load(f)
+            products = config_data.get('products', {})
+            catalog = Catalog(products, self.currency)
+        except (OSError, ValueError) as e:
+            print(f"[config] Not reloading catalog, {self.path} is invalid: {e}")
+            self._config_stat = config_stat
+            return False
+        
+        self._config_stat = config_stat
+        if catalog.version == self.catalog.version:
+            return False
+        
+        self.config_data = config_data
+        self.products = products
+        self.catalog = catalog
+        print(f"[config] Catalog reloaded (version {catalog.version}, {len(catalog.products)} products)")
+        return True
     
-    def get_products_in_category(self, category):
-        """Get products in a specific category"""
-        return self.products.get(category, {})
+    def watch_catalog(self):
+        """Poll config.json for changes and hot-reload the catalog"""
+        while True:
+            time.sleep(self.config_reload_interval)
+            try:
+                if self._stat_config() != self._config_stat:
+                    self.reload_catalog()
+            except OSError as e:
+                print(f"[config] Cannot check {self.path}: {e}")
     
-    def get_all_products_flat(self):
-        """Get all products as a flat dictionary"""
-        all_products = {}
-        for category, items in self.products.items():
-            all_products.update(items)
-        return all_products
+    def start_catalog_watcher(self):
+        """Start watching config.json in a daemon thread"""
+        thread = threading.Thread(target=self.watch_catalog, name="config-watcher", daemon=True)
+        thread.start()
+        return thread
@@ -1,52 +1,124 @@
 """
 Cart management callback handlers
 """
-from telebot import types
+from telebot.apihelper import ApiTelegramException
 from bot.utils.session import (
     update_session_activity, get_user_state, set_user_state, 
     clear_user_state, get_cart_message, set_cart_message, clear_cart_message
 )
 from bot.services.cart_service import (
-    get_cart, add_to_cart, clear_cart, get_cart_items_count
+    get_cart, get_cart_snapshot, add_to_cart, clear_cart, get_cart_items_count
 )
-from bot.utils.formatting import format_cart_message, format_price
+from bot.utils.formatting import format_cart_message, split_message, send_long_message
+from bot.utils.edits import edit_message_text, remember_message
+from bot.utils.keyboards import (
+    CART_ACTIONS, PAGE_INDICATOR_CALLBACK, categories_keyboard, products_keyboard
+)
+from bot.utils.coalescer import EditCoalescer
+from bot.catalog import PRODUCT_CALLBACK_PREFIX, CATEGORY_CALLBACK_PREFIX
+
+STALE_MENU_TEXT = "This menu is out of date, here are the current products"
+
+# Refreshes of the live cart message, coalesced per chat
+live_cart_edits = EditCoalescer(name="live-cart")
 
-def register_cart_handlers(bot, config):
+def register_cart_handlers(bot, config, router):
     """Register all cart-related callback handlers"""
+    live_cart_edits.window = config.live_cart_edit_window
+    live_cart_edits.start()
+    
+    def show_categories_in(call, catalog):
+        """Replace a menu message with the category list"""
+        user_id = call.from_user.id
+        edit_message_text(
+            bot, user_id,
+            "Select a category:",
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=categories_keyboard(catalog)
+        )
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('cat_'))
+    def refresh_live_cart(chat_id, user_id):
+        """Edit the live cart message to show the current cart
+
+        Runs on the coalescer's thread, outside the user's dispatcher
+        shard, so it renders a copy of the cart taken under its lock.
+        """
+        cart_message_id = get_cart_message(user_id)
+        if not cart_message_id:
+            # Checkout started (or the cart was cleared) since the click
+            return
+        cart = get_cart_snapshot(user_id)
+        if not cart:
+            # Cleared since the click; handle_clear_cart already updated the message
+            return
+        catalog = config.catalog
+        cart_text = format_cart_message(cart, catalog, config.currency, cart.total_minor(catalog))
+        
+        if len(split_message(cart_text)) > 1:
+            sent_msg = send_long_message(bot, chat_id, cart_text, reply_markup=CART_ACTIONS)
+            set_cart_message(user_id, sent_msg.message_id)
+            remember_message(user_id, sent_msg, cart_text, CART_ACTIONS)
+            return
+        
+        try:
+            edit_message_text(
+                bot, user_id,
+                cart_text,
+                chat_id,
+                cart_message_id,
+                reply_markup=CART_ACTIONS
+            )
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                # Rate limited: try again once Telegram allows, never duplicate
+                retry_after = e.result_json.get('parameters', {}).get('retry_after', 1)
+                live_cart_edits.retry(chat_id, lambda: refresh_live_cart(chat_id, user_id), retry_after)
+            else:
+                # If message doesn't exist anymore, create new one
+                sent_msg = bot.send_message(chat_id, cart_text, reply_markup=CART_ACTIONS)
+                set_cart_message(user_id, sent_msg.message_id)
+                remember_message(user_id, sent_msg, cart_text, CART_ACTIONS)
+    
+    @router.callback_prefix(CATEGORY_CALLBACK_PREFIX)
     def handle_category_selection(call):
         user_id = call.from_user.id
         update_session_activity(user_id)
         
-        category = call.data[4:]  # Remove 'cat_' prefix
-        products = config.get_products_in_category(category)
-        
-        markup = types.InlineKeyboardMarkup()
-        for product_name, price in products.items():
-            markup.row(
-                types.InlineKeyboardButton(
-                    f"{product_name} - {format_price(price, config.currency)}",
-                    callback_data=f"prod_{product_name}"
-                )
-            )
-        markup.row(
-            types.InlineKeyboardButton("⬅️ Back to Categories", callback_data="back_to_categories")
-        )
-        
-        bot.edit_message_text(
+        catalog = config.catalog
+        decoded = catalog.decode_category(call.data)
+        if decoded is None:
+            # Button from before a catalog reload
+            bot.answer_callback_query(call.id, STALE_MENU_TEXT)
+            show_categories_in(call, catalog)
+            return
+        category, page = decoded
+        
+        edit_message_text(
+            bot, user_id,
             f"Select a product from {category}:",
             call.message.chat.id,
             call.message.message_id,
-            reply_markup=markup
+            reply_markup=products_keyboard(catalog, category, page, config.products_page_size)
         )
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('prod_'))
+    @router.callback(PAGE_INDICATOR_CALLBACK)
+    def handle_page_indicator(call):
+        bot.answer_callback_query(call.id)
+    
+    @router.callback_prefix(PRODUCT_CALLBACK_PREFIX)
     def handle_product_selection(call):
         user_id = call.from_user.id
         update_session_activity(user_id)
         
-        product_name = call.data[5:]  # Remove 'prod_' prefix
+        catalog = config.catalog
+        product = catalog.decode_product(call.data)
+        if product is None:
+            # Button from before a catalog reload
+            bot.answer_callback_query(call.id, STALE_MENU_TEXT)
+            show_categories_in(call, catalog)
+            return
+        product_name = product.name
         
         # Add 1 to cart
         add_to_cart(user_id, product_name, 1)
@@ -59,61 +131,26 @@ def register_cart_handlers(bot, config):
         )
         
         # Check if live cart message exists
-        cart_message_id = get_cart_message(user_id)
-        cart = get_cart(user_id)
-        products_flat = config.get_all_products_flat()
-        cart_text = format_cart_message(cart, products_flat, config.currency)
-        
-        markup = types.InlineKeyboardMarkup()
-        markup.row(
-            types.InlineKeyboardButton("🪓 Clear Cart", callback_data="clear_cart")
-        )
-        markup.row(
-            types.InlineKeyboardButton("🏁 Checkout", callback_data="checkout")
-        )
-        
-        if cart_message_id:
-            # Update existing cart message
-            try:
-                bot.edit_message_text(
-                    cart_text,
-                    call.message.chat.id,
-                    cart_message_id,
-                    reply_markup=markup
-                )
-            except:
-                # If message doesn't exist anymore, create new one
-                sent_msg = bot.send_message(call.message.chat.id, cart_text, reply_markup=markup)
-                set_cart_message(user_id, sent_msg.message_id)
+        chat_id = call.message.chat.id
+        if get_cart_message(user_id):
+            # Bursts of clicks collapse into one edit showing the latest cart
+            live_cart_edits.submit(chat_id, lambda: refresh_live_cart(chat_id, user_id))
         else:
-            # Create new live cart message
-            sent_msg = bot.send_message(call.message.chat.id, cart_text, reply_markup=markup)
+            # Create new live cart message (split if the cart outgrew one message)
+            cart = get_cart(user_id)
+            cart_text = format_cart_message(cart, catalog, config.currency, cart.total_minor(catalog))
+            sent_msg = send_long_message(bot, chat_id, cart_text, reply_markup=CART_ACTIONS)
             set_cart_message(user_id, sent_msg.message_id)
+            remember_message(user_id, sent_msg, cart_text, CART_ACTIONS)
     
-    @bot.callback_query_handler(func=lambda call: call.data == 'back_to_categories')
+    @router.callback('back_to_categories')
     def handle_back_to_categories(call):
         user_id = call.from_user.id
         update_session_activity(user_id)
         
-        categories = config.get_categories()
-        
-        markup = types.InlineKeyboardMarkup()
-        for category in categories:
-            markup.row(
-                types.InlineKeyboardButton(
-                    f"📦 {category}",
-                    callback_data=f"cat_{category}"
-                )
-            )
-        
-        bot.edit_message_text(
-            "Select a category:",
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=markup
-        )
+        show_categories_in(call, config.catalog)
     
-    @bot.callback_query_handler(func=lambda call: call.data == 'clear_cart')
+    @router.callback('clear_cart')
     def handle_clear_cart(call):
         user_id = call.from_user.id
         update_session_activity(user_id)
@@ -123,7 +160,8 @@ def register_cart_handlers(bot, config):
         bot.answer_callback_query(call.id, "Cart cleared")
         
         # Update the cart message to show empty cart
-        bot.edit_message_text(
+        edit_message_text(
+            bot, user_id,
             "Your cart is empty.",
             call.message.chat.id,
             call.message.message_id
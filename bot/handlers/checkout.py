@@ -1,42 +1,66 @@
 """
 Checkout and delivery address flow handlers
 """
-from telebot import types
+import secrets
+import threading
+from collections import OrderedDict
+from functools import partial
+
 from bot.utils.session import (
-    update_session_activity, get_user_state, 
+    update_session_activity,
     set_user_state, clear_user_state, clear_cart_message,
-    get_checkout_message, set_checkout_message, get_order_message
+    get_checkout_message, set_checkout_message, get_order_message,
+    start_checkout, set_checkout_field, get_checkout_data, clear_checkout_data,
+    take_checkout_data, restore_checkout_data
+)
+from bot.services.cart_service import get_cart, clear_cart, get_cart_total, remove_unavailable_items
+from bot.services.order_service import create_order, get_order_store
+from bot.services.order_store import STATUS_PAID
+from bot.services.payment_service import create_payment_session, create_payment_session_async, payment_sessions
+from bot.utils.formatting import format_cart_message, format_order_summary_individual, split_message, send_long_message
+from bot.utils.edits import edit_message_text, remember_message
+from bot.utils.deletions import message_deletions
+from bot.utils.keyboards import (
+    CONTINUE_SHOPPING, BACK_TO_NAME, BACK_TO_ADDRESS, BACK_TO_CITY, ORDER_CONFIRMATION,
+    RETRY_PAYMENT_CALLBACK_PREFIX, pay_now_keyboard, retry_payment_keyboard
 )
-from bot.services.cart_service import get_cart, clear_cart, get_cart_total
-from bot.services.order_service import create_order
-from bot.services.payment_service import create_payment_session
-from bot.utils.formatting import format_cart_message, format_order_summary_individual
 
-# Temporary storage for customer info during checkout
-checkout_data = {}
+# Orders remembered for the "Try Again" button (the order store has the rest)
+MAX_UNPAID_ORDERS = 1000
 
-def register_checkout_handlers(bot, config):
+def register_checkout_handlers(bot, config, router):
     """Register all checkout-related handlers"""
+    payment_sessions.workers = config.payment_workers
+    payment_sessions.timeout = config.payment_session_timeout
+    payment_sessions.retries = config.payment_session_retries
+    payment_sessions.start()
+    
+    # Shared by the handlers and the payment workers
+    unpaid_orders = OrderedDict()
+    unpaid_lock = threading.Lock()
     
-    @bot.callback_query_handler(func=lambda call: call.data == 'checkout')
+    @router.callback('checkout')
     def handle_checkout_start(call):
         user_id = call.from_user.id
         update_session_activity(user_id)
         
+        # Items dropped from the catalog by a reload can't be ordered
+        removed = remove_unavailable_items(user_id, config.catalog)
         cart = get_cart(user_id)
         if not cart:
             bot.answer_callback_query(call.id, "Your cart is empty")
             return
+        if removed:
+            bot.answer_callback_query(call.id, f"No longer available, removed: {', '.join(removed)}")
         
         clear_cart_message(user_id)
         
         # Initialize checkout data
-        checkout_data[user_id] = {}
+        start_checkout(user_id)
         
         set_user_state(user_id, 'awaiting_name')
         
-        markup = types.InlineKeyboardMarkup()
-        markup.row(types.InlineKeyboardButton("📦 Continue Shopping", callback_data="continue_shopping"))
+        markup = CONTINUE_SHOPPING
         
         sent_msg = bot.send_message(
             call.message.chat.id,
@@ -45,49 +69,43 @@ def register_checkout_handlers(bot, config):
         )
         
         set_checkout_message(user_id, sent_msg.message_id)
+        remember_message(user_id, sent_msg, "Enter a name for delivery:", markup)
     
-    @bot.callback_query_handler(func=lambda call: call.data == 'continue_shopping')
+    @router.callback('continue_shopping')
     def handle_continue_shopping(call):
         user_id = call.from_user.id
         clear_user_state(user_id)
-        if user_id in checkout_data:
-            del checkout_data[user_id]
+        clear_checkout_data(user_id)
         
         bot.answer_callback_query(call.id, "Returning to products...")
         
         # Delete old order message if exists
         old_message_id = get_order_message(user_id)
         if old_message_id:
-            try:
-                bot.delete_message(call.message.chat.id, old_message_id)
-            except:
-                pass
+            message_deletions.delete(bot, call.message.chat.id, old_message_id)
         
         # Show categories in new message
         from bot.handlers.commands import show_categories
         show_categories(call.message, bot, config, user_id)
     
-    @bot.message_handler(func=lambda m: get_user_state(m.from_user.id) == 'awaiting_name')
+    @router.state('awaiting_name')
     def handle_name_input(message):
         user_id = message.from_user.id
         update_session_activity(user_id)
         
-        # Delete the user's message to keep chat tidy
-        try:
-            bot.delete_message(message.chat.id, message.message_id)
-        except:
-            pass
+        # Delete the user's message to keep chat tidy (in the background)
+        message_deletions.delete(bot, message.chat.id, message.message_id)
         
         name = message.text.strip()
-        checkout_data[user_id]['name'] = name
+        set_checkout_field(user_id, 'name', name)
         set_user_state(user_id, 'awaiting_address_line1')
         
         checkout_msg_id = get_checkout_message(user_id)
-        markup = types.InlineKeyboardMarkup()
-        markup.row(types.InlineKeyboardButton("⬅️ Back", callback_data="back_to_name"))
+        markup = BACK_TO_NAME
         
         try:
-            bot.edit_message_text(
+            edit_message_text(
+                bot, user_id,
                 "Enter house number + street name:",
                 message.chat.id,
                 checkout_msg_id,
@@ -100,28 +118,26 @@ def register_checkout_handlers(bot, config):
                 reply_markup=markup
             )
             set_checkout_message(user_id, sent_msg.message_id)
+            remember_message(user_id, sent_msg, "Enter house number + street name:", markup)
     
-    @bot.message_handler(func=lambda m: get_user_state(m.from_user.id) == 'awaiting_address_line1')
+    @router.state('awaiting_address_line1')
     def handle_address_line1_input(message):
         user_id = message.from_user.id
         update_session_activity(user_id)
         
-        # Delete the user's message to keep chat tidy
-        try:
-            bot.delete_message(message.chat.id, message.message_id)
-        except:
-            pass
+        # Delete the user's message to keep chat tidy (in the background)
+        message_deletions.delete(bot, message.chat.id, message.message_id)
         
         address = message.text.strip()
-        checkout_data[user_id]['address_line1'] = address
+        set_checkout_field(user_id, 'address_line1', address)
         set_user_state(user_id, 'awaiting_city')
         
         checkout_msg_id = get_checkout_message(user_id)
-        markup = types.InlineKeyboardMarkup()
-        markup.row(types.InlineKeyboardButton("⬅️ Back", callback_data="back_to_address"))
+        markup = BACK_TO_ADDRESS
         
         try:
-            bot.edit_message_text(
+            edit_message_text(
+                bot, user_id,
                 "Enter your city:",
                 message.chat.id,
                 checkout_msg_id,
@@ -130,28 +146,26 @@ def register_checkout_handlers(bot, config):
         except:
             sent_msg = bot.send_message(message.chat.id, "Enter your city:", reply_markup=markup)
             set_checkout_message(user_id, sent_msg.message_id)
+            remember_message(user_id, sent_msg, "Enter your city:", markup)
     
-    @bot.message_handler(func=lambda m: get_user_state(m.from_user.id) == 'awaiting_city')
+    @router.state('awaiting_city')
     def handle_city_input(message):
         user_id = message.from_user.id
         update_session_activity(user_id)
         
-        # Delete the user's message to keep chat tidy
-        try:
-            bot.delete_message(message.chat.id, message.message_id)
-        except:
-            pass
+        # Delete the user's message to keep chat tidy (in the background)
+        message_deletions.delete(bot, message.chat.id, message.message_id)
         
         city = message.text.strip()
-        checkout_data[user_id]['city'] = city
+        set_checkout_field(user_id, 'city', city)
         set_user_state(user_id, 'awaiting_postcode')
         
         checkout_msg_id = get_checkout_message(user_id)
-        markup = types.InlineKeyboardMarkup()
-        markup.row(types.InlineKeyboardButton("⬅️ Back", callback_data="back_to_city"))
+        markup = BACK_TO_CITY
         
         try:
-            bot.edit_message_text(
+            edit_message_text(
+                bot, user_id,
                 "Postcode:",
                 message.chat.id,
                 checkout_msg_id,
@@ -160,170 +174,249 @@ def register_checkout_handlers(bot, config):
         except:
             bot.send_message(message.chat.id, "Postcode:", reply_markup=markup)
     
-    @bot.message_handler(func=lambda m: get_user_state(m.from_user.id) == 'awaiting_postcode')
+    @router.state('awaiting_postcode')
     def handle_postcode_input(message):
         user_id = message.from_user.id
         update_session_activity(user_id)
         
-        # Delete the user's message to keep chat tidy
-        try:
-            bot.delete_message(message.chat.id, message.message_id)
-        except:
-            pass
+        # Delete the user's message to keep chat tidy (in the background)
+        message_deletions.delete(bot, message.chat.id, message.message_id)
         
         postcode = message.text.strip()
-        checkout_data[user_id]['postcode'] = postcode.upper()
+        set_checkout_field(user_id, 'postcode', postcode.upper())
         
         # Clear state
         clear_user_state(user_id)
         
         cart = get_cart(user_id)
-        products_flat = config.get_all_products_flat()
+        catalog = config.catalog
         
         summary = format_order_summary_individual(
             cart, 
-            products_flat, 
-            checkout_data[user_id], 
-            config.currency
+            catalog, 
+            get_checkout_data(user_id), 
+            config.currency,
+            get_cart_total(user_id, catalog)
         )
         
-        markup = types.InlineKeyboardMarkup()
-        markup.row(
-            types.InlineKeyboardButton("✏️ Edit Address", callback_data="edit_address")
-        )
-        markup.row(
-            types.InlineKeyboardButton("🏁 Confirm & Pay", callback_data="confirm_order")
-        )
+        markup = ORDER_CONFIRMATION
         
         checkout_msg_id = get_checkout_message(user_id)
         try:
-            bot.edit_message_text(
+            if len(split_message(summary)) > 1:
+                raise ValueError("Summary doesn't fit in one message")
+            edit_message_text(
+                bot, user_id,
                 summary,
                 message.chat.id,
                 checkout_msg_id,
                 reply_markup=markup
             )
         except:
-            bot.send_message(
+            send_long_message(
+                bot,
                 message.chat.id,
                 summary,
                 reply_markup=markup
             )
     
-    @bot.callback_query_handler(func=lambda call: call.data == 'back_to_name')
+    @router.callback('back_to_name')
     def handle_back_to_name(call):
         user_id = call.from_user.id
         set_user_state(user_id, 'awaiting_name')
         
-        markup = types.InlineKeyboardMarkup()
-        markup.row(types.InlineKeyboardButton("📦 Continue Shopping", callback_data="continue_shopping"))
+        markup = CONTINUE_SHOPPING
         
-        bot.edit_message_text(
+        edit_message_text(
+            bot, user_id,
             "Enter a name for delivery:",
             call.message.chat.id,
             call.message.message_id,
             reply_markup=markup
         )
     
-    @bot.callback_query_handler(func=lambda call: call.data == 'back_to_address')
+    @router.callback('back_to_address')
     def handle_back_to_address(call):
         user_id = call.from_user.id
         set_user_state(user_id, 'awaiting_address_line1')
         
-        markup = types.InlineKeyboardMarkup()
-        markup.row(types.InlineKeyboardButton("⬅️ Back", callback_data="back_to_name"))
+        markup = BACK_TO_NAME
         
-        bot.edit_message_text(
+        edit_message_text(
+            bot, user_id,
             "Enter house number + street name:",
             call.message.chat.id,
             call.message.message_id,
             reply_markup=markup
         )
     
-    @bot.callback_query_handler(func=lambda call: call.data == 'back_to_city')
+    @router.callback('back_to_city')
     def handle_back_to_city(call):
         user_id = call.from_user.id
         set_user_state(user_id, 'awaiting_city')
         
-        markup = types.InlineKeyboardMarkup()
-        markup.row(types.InlineKeyboardButton("⬅️ Back", callback_data="back_to_address"))
+        markup = BACK_TO_ADDRESS
         
-        bot.edit_message_text(
+        edit_message_text(
+            bot, user_id,
             "Enter your city:",
             call.message.chat.id,
             call.message.message_id,
             reply_markup=markup
         )
     
-    @bot.callback_query_handler(func=lambda call: call.data == 'edit_address')
+    @router.callback('edit_address')
     def handle_edit_address(call):
         user_id = call.from_user.id
         
         set_user_state(user_id, 'awaiting_name')
         
-        markup = types.InlineKeyboardMarkup()
-        markup.row(types.InlineKeyboardButton("📦 Continue Shopping", callback_data="continue_shopping"))
+        markup = CONTINUE_SHOPPING
         
-        bot.edit_message_text(
+        edit_message_text(
+            bot, user_id,
             "Enter a name for delivery:",
             call.message.chat.id,
             call.message.message_id,
             reply_markup=markup
         )
     
-    @bot.callback_query_handler(func=lambda call: call.data == 'confirm_order')
+    @router.callback('confirm_order')
     def handle_confirm_order(call):
         user_id = call.from_user.id
         update_session_activity(user_id)
         
-        username = call.from_user.username or "Unknown"
-        checkout_data[user_id]['username'] = username
+        # Taking the delivery details marks the checkout as submitted, so a
+        # second tap on Confirm can't create a second order
+        checkout_data = take_checkout_data(user_id)
+        if checkout_data is None:
+            bot.answer_callback_query(call.id, "Your order is already being prepared")
+            return
         
-        # Create order
+        # A catalog reload can leave nothing in the cart to order; check
+        # before the order is created so no empty order is recorded
         cart = get_cart(user_id)
-        products_flat = config.get_all_products_flat()
-        
-        order_data = create_order(
-            user_id,
-            checkout_data[user_id],
-            cart,
-            products_flat,
-            config.currency
-        )
+        catalog = config.catalog
+        available, _ = catalog.split_cart(cart)
+        if not available:
+            restore_checkout_data(user_id, checkout_data)
+            bot.answer_callback_query(call.id, "Items in your cart are no longer available")
+            return
+        checkout_data['username'] = call.from_user.username or "Unknown"
         
-        # Create Stripe payment session
+        # Create order
         try:
-            success_url = f"{config.public_url}/success?session_id={{CHECKOUT_SESSION_ID}}"
-            cancel_url = f"{config.public_url}/cancel"
-            
-            session = create_payment_session(
-                order_data,
-                config.stripe_secret_key,
-                success_url,
-                cancel_url
-            )
-            
-            markup = types.InlineKeyboardMarkup()
-            markup.row(
-                types.InlineKeyboardButton(
-                    "💳 Pay Now",
-                    url=session.url
-                )
+            order_data = create_order(
+                user_id,
+                checkout_data,
+                cart,
+                catalog,
+                config.currency
             )
-            
-            bot.send_message(
-                call.message.chat.id,
-                f"🏁 Order Created\n\nOrder ID: {order_data['order_id']}\n\nClick below to complete payment:",
-                reply_markup=markup
-            )
-            
-            # Clear cart after successful order creation
-            clear_cart(user_id)
-            
-                
         except Exception as e:
-            bot.send_message(
-                call.message.chat.id,
-                f"There was an error creating your payment session. Try again or contact us directly."
+            # Not recorded: give the details back so Confirm works again
+            print(f"[checkout] ERROR creating order for {user_id}: {e}")
+            restore_checkout_data(user_id, checkout_data)
+            bot.answer_callback_query(call.id, "Sorry, your order couldn't be placed. Please try again.")
+            return
+        bot.answer_callback_query(call.id)
+        
+        # The order holds its own copy of the items
+        clear_cart(user_id)
+        
+        # The Stripe call happens in the background; the customer sees
+        # progress straight away and the Pay Now button when it's ready
+        edit_message_text(
+            bot, user_id,
+            order_created_text(order_data, "⏳ Preparing payment…"),
+            call.message.chat.id,
+            call.message.message_id
+        )
+        start_payment(call, order_data)
+    
+    @router.callback_prefix(RETRY_PAYMENT_CALLBACK_PREFIX)
+    def handle_retry_payment(call):
+        user_id = call.from_user.id
+        update_session_activity(user_id)
+        
+        order_id = call.data[len(RETRY_PAYMENT_CALLBACK_PREFIX):]
+        with unpaid_lock:
+            order_data = unpaid_orders.get(order_id)
+        store = get_order_store()
+        if order_data is None and store is not None:
+            order_data = store.get(order_id)
+        if order_data is None or order_data['user_id'] != user_id:
+            bot.answer_callback_query(call.id, "This order can't be paid any more, please order again")
+            return
+        if order_data.get('payment_status') == STATUS_PAID:
+            bot.answer_callback_query(call.id, "This order has already been paid")
+            return
+        
+        edit_message_text(
+            bot, user_id,
+            order_created_text(order_data, "⏳ Preparing payment…"),
+            call.message.chat.id,
+            call.message.message_id
+        )
+        if start_payment(call, order_data):
+            bot.answer_callback_query(call.id)
+        else:
+            bot.answer_callback_query(call.id, "Still preparing your payment…")
+    
+    def order_created_text(order_data, status):
+        return f"🏁 Order Created\n\nOrder ID: {order_data['order_id']}\n\n{status}"
+    
+    def start_payment(call, order_data):
+        """Create an order's payment session in the background, updating call's message with the outcome"""
+        user_id = call.from_user.id
+        chat_id = call.message.chat.id
+        message_id = call.message.message_id
+        order_id = order_data['order_id']
+        session_args = (
+            order_data,
+            config.stripe_secret_key,
+            f"{config.public_url}/success?session_id={{CHECKOUT_SESSION_ID}}",
+            f"{config.public_url}/cancel"
+        )
+        # Stripe replays a key's outcome, failures included, for 24 hours:
+        # every attempt the customer starts gets its own key, and only the
+        # client's retries within this attempt reuse it
+        attempt = secrets.token_hex(4)
+        
+        def on_ready(session):
+            with unpaid_lock:
+                unpaid_orders.pop(order_id, None)
+            edit_message_text(
+                bot, user_id,
+                order_created_text(order_data, "Click below to complete payment:"),
+                chat_id,
+                message_id,
+                reply_markup=pay_now_keyboard(session.url)
+            )
+        
+        def offer_retry(status):
+            edit_message_text(
+                bot, user_id,
+                order_created_text(order_data, status),
+                chat_id,
+                message_id,
+                reply_markup=retry_payment_keyboard(order_id)
             )
-            print(f"Stripe error: {e}")
+        
+        # Kept so "Try Again" works until the session is created
+        with unpaid_lock:
+            unpaid_orders[order_id] = order_data
+            unpaid_orders.move_to_end(order_id)
+            while len(unpaid_orders) > MAX_UNPAID_ORDERS:
+                unpaid_orders.popitem(last=False)
+        
+        return payment_sessions.submit(
+            order_id,
+            partial(create_payment_session, *session_args, attempt=attempt),
+            on_ready,
+            lambda error: offer_retry(
+                "There was an error creating your payment session. Try again or contact us directly."
+            ),
+            on_slow=lambda: offer_retry("Payment is taking longer than usual. Try again in a moment."),
+            create_async=partial(create_payment_session_async, *session_args, attempt=attempt)
+        )
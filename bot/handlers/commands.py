@@ -1,15 +1,21 @@
 """
-Bot command handlers (/start, /order, /cart, /restart)
+Bot command handlers (/start, /order, /cart, /myorders, /restart, /report)
 """
-from telebot import types
+from datetime import datetime, timedelta
 from bot.utils.session import (
     get_or_create_session, clear_user_session, is_session_expired,
     get_user_state, set_user_state, get_order_message, set_order_message
 )
 from bot.services.cart_service import get_cart, get_cart_items_count
-from bot.utils.formatting import format_cart_message
+from bot.services.order_service import get_order_store, UK_TZ
+from bot.utils.formatting import (
+    format_cart_message, format_order_history, format_sales_report, send_long_message
+)
+from bot.utils.edits import remember_message
+from bot.utils.deletions import message_deletions
+from bot.utils.keyboards import MAIN_MENU, CART_ACTIONS, categories_keyboard
 
-def register_command_handlers(bot, config):
+def register_command_handlers(bot, config, router):
     """Register all command handlers"""
     
     @bot.message_handler(commands=['start'])
@@ -25,17 +31,14 @@ First Class Shipping Included ✉️
 Commands:
 /order
 /cart 
+/myorders
 /restart
 """
         
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        markup.row(types.KeyboardButton("🛍️ Browse Products"))
-        markup.row(types.KeyboardButton("📦 View Cart"))
-        
-        bot.send_message(message.chat.id, welcome_text, reply_markup=markup)
+        bot.send_message(message.chat.id, welcome_text, reply_markup=MAIN_MENU)
     
     @bot.message_handler(commands=['order'])
-    @bot.message_handler(func=lambda m: m.text == "🛍️ Browse Products")
+    @router.text("🛍️ Browse Products")
     def handle_order(message):
         user_id = message.from_user.id
         
@@ -50,15 +53,12 @@ Commands:
         
         old_message_id = get_order_message(user_id)
         if old_message_id:
-            try:
-                bot.delete_message(message.chat.id, old_message_id)
-            except:
-                pass
+            message_deletions.delete(bot, message.chat.id, old_message_id)
         
         show_categories(message, bot, config, user_id)
     
     @bot.message_handler(commands=['cart'])
-    @bot.message_handler(func=lambda m: m.text == "📦 View Cart")
+    @router.text("📦 View Cart")
     def handle_cart(message):
         user_id = message.from_user.id
         
@@ -70,23 +70,54 @@ Commands:
             return
         
         cart = get_cart(user_id)
-        products_flat = config.get_all_products_flat()
-        cart_message = format_cart_message(cart, products_flat, config.currency)
+        catalog = config.catalog
+        cart_message = format_cart_message(cart, catalog, config.currency, cart.total_minor(catalog))
         
         if not cart:
             bot.send_message(message.chat.id, cart_message)
             return
         
-        markup = types.InlineKeyboardMarkup()
-        markup.row(
-            types.InlineKeyboardButton("🪓 Clear Cart", callback_data="clear_cart")
-        )
-        markup.row(
-            types.InlineKeyboardButton("🏁 Checkout", callback_data="checkout")
-        )
+        send_long_message(bot, message.chat.id, cart_message, reply_markup=CART_ACTIONS)
+    
+    
+    @bot.message_handler(commands=['myorders'])
+    def handle_my_orders(message):
+        user_id = message.from_user.id
+        store = get_order_store()
+        if store is None:
+            bot.send_message(message.chat.id, "Order history isn't available right now.")
+            return
         
-        bot.send_message(message.chat.id, cart_message, reply_markup=markup)
+        orders = store.orders_for_user(user_id, limit=10)
+        send_long_message(bot, message.chat.id, format_order_history(orders, config.currency))
     
+    @bot.message_handler(commands=['report'])
+    def handle_report(message):
+        # Sales report for admins: /report [days] or /report <from> <to>
+        if message.from_user.id not in config.admin_user_ids:
+            return
+        store = get_order_store()
+        if store is None:
+            bot.send_message(message.chat.id, "The order store is disabled.")
+            return
+        
+        args = message.text.split()[1:]
+        try:
+            if len(args) == 2:
+                since, until = (datetime.strptime(arg, '%Y-%m-%d').date() for arg in args)
+            else:
+                days = int(args[0]) if args else 30
+                if days < 1:
+                    raise ValueError(days)
+                until = datetime.now(UK_TZ).date()
+                since = until - timedelta(days=days - 1)
+        except ValueError:
+            bot.send_message(message.chat.id, "Usage: /report [days] or /report YYYY-MM-DD YYYY-MM-DD")
+            return
+        
+        report = store.sales_report(since.isoformat(), until.isoformat())
+        title = f"Sales {since.isoformat()} to {until.isoformat()}"
+        send_long_message(bot, message.chat.id, format_sales_report(report, title, config.currency))
     
     @bot.message_handler(commands=['restart'])
     def handle_restart(message):
@@ -99,17 +130,7 @@ Commands:
 
 def show_categories(message, bot, config, user_id):
     """Display product categories"""
-    categories = config.get_categories()
-    
-    markup = types.InlineKeyboardMarkup()
-    for category in categories:
-        markup.row(
-            types.InlineKeyboardButton(
-                f"📦 {category}",
-                callback_data=f"cat_{category}"
-            )
-        )
-    
+    markup = categories_keyboard(config.catalog)
     sent_msg = bot.send_message(
         message.chat.id,
         "Select a category:",
@@ -117,3 +138,4 @@ def show_categories(message, bot, config, user_id):
     )
     
     set_order_message(user_id, sent_msg.message_id)
+    remember_message(user_id, sent_msg, "Select a category:", markup)
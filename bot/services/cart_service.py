@@ -1,57 +1,83 @@
 """
 Shopping cart management service
 """
-from bot.utils.session import user_carts, update_session_activity
+import time
+from bot.cart import Cart
+from bot.utils.session import get_session_store
 
 def get_cart(user_id):
     """Get user's cart"""
-    if user_id not in user_carts:
-        user_carts[user_id] = {}
-    return user_carts[user_id]
+    return get_session_store().get_or_create(user_id).cart
+
+def get_cart_snapshot(user_id):
+    """Get a copy of user's cart taken under its lock
+
+    For code running outside the user's dispatcher shard (e.g. coalesced
+    edits), which must not iterate the live cart while a handler changes it.
+    """
+    store = get_session_store()
+    with store.lock(user_id):
+        return Cart.from_dict(store.get_or_create(user_id).cart.to_dict())
+
+def _save_cart(store, session):
+    """Save a session after its cart changed"""
+    session.last_activity = time.time()
+    store.save(session)
+    return session.cart
 
 def add_to_cart(user_id, item, quantity=1):
     """Add item to user's cart"""
-    cart = get_cart(user_id)
-    if item in cart:
-        cart[item] += quantity
-    else:
-        cart[item] = quantity
-    update_session_activity(user_id)
-    return cart
+    store = get_session_store()
+    with store.lock(user_id):
+        session = store.get_or_create(user_id)
+        session.cart.add(item, quantity)
+        return _save_cart(store, session)
 
 def remove_from_cart(user_id, item):
     """Remove item from user's cart"""
-    cart = get_cart(user_id)
-    if item in cart:
-        del cart[item]
-    update_session_activity(user_id)
-    return cart
+    store = get_session_store()
+    with store.lock(user_id):
+        session = store.get_or_create(user_id)
+        session.cart.remove(item)
+        return _save_cart(store, session)
 
 def update_cart_quantity(user_id, item, quantity):
     """Update quantity of item in cart"""
-    cart = get_cart(user_id)
     if quantity <= 0:
         return remove_from_cart(user_id, item)
-    cart[item] = quantity
-    update_session_activity(user_id)
-    return cart
+    store = get_session_store()
+    with store.lock(user_id):
+        session = store.get_or_create(user_id)
+        session.cart.set_quantity(item, quantity)
+        return _save_cart(store, session)
 
 def clear_cart(user_id):
     """Clear user's cart"""
-    if user_id in user_carts:
-        user_carts[user_id] = {}
-    update_session_activity(user_id)
-
-def get_cart_total(user_id, products_flat):
-    """Calculate total price of items in cart"""
-    cart = get_cart(user_id)
-    total = 0.0
-    for item, quantity in cart.items():
-        price = float(products_flat.get(item, 0))
-        total += price * quantity
-    return total
+    store = get_session_store()
+    with store.lock(user_id):
+        session = store.get(user_id)
+        if session is not None:
+            session.cart.clear()
+            _save_cart(store, session)
+
+def remove_unavailable_items(user_id, catalog):
+    """Drop cart items no longer in the catalog; returns their names"""
+    store = get_session_store()
+    with store.lock(user_id):
+        session = store.get(user_id)
+        if session is None:
+            return []
+        _, unavailable = catalog.split_cart(session.cart)
+        if unavailable:
+            for item in unavailable:
+                session.cart.remove(item)
+            _save_cart(store, session)
+        return unavailable
+
+def get_cart_total(user_id, catalog):
+    """Calculate total price of items in cart, in minor units"""
+    return get_cart(user_id).total_minor(catalog)
 
 def get_cart_items_count(user_id):
     """Get total number of items in cart"""
-    cart = get_cart(user_id)
-    return sum(cart.values())
+    return get_cart(user_id).count
@@ -1,49 +1,90 @@
 """
 Email notification service using Mailgun
 """
-import requests
+import aiohttp
 
+from bot.services.http_client import get_session, get_timeout
 
-def send_payment_confirmation_email(order_data, config):
-    """Send payment confirmation email to shop owner after successful payment"""
+
+def _payment_confirmation_email(order_data, config):
+    """Mailgun URL and form for an order's confirmation email, None if Mailgun isn't configured"""
     from bot.utils.formatting import format_receipt
-    
-    print(f"[v0] send_payment_confirmation_email called")
+
     print(f"[v0] Mailgun API key present: {bool(config.mailgun_api_key)}")
     print(f"[v0] Mailgun domain: {config.mailgun_domain}")
-    
+
     if not config.mailgun_api_key or not config.mailgun_domain:
         print("[v0] ERROR: Mailgun not configured, skipping email")
-        return False
-    
+        return None
+
     subject = f"New Order Payment Confirmed - {order_data['order_id']}"
     text_body = format_receipt(order_data, config.currency)
-    
+
     print(f"[v0] Sending email to: {config.mailgun_to}")
     print(f"[v0] From: {config.mailgun_from}")
     print(f"[v0] Subject: {subject}")
-    
+
+    url = f"{config.mailgun_api_base}/v3/{config.mailgun_domain}/messages"
+    data = {
+        "from": config.mailgun_from,
+        "to": config.mailgun_to,
+        "subject": subject,
+        "text": text_body
+    }
+    return url, data
+
+
+def _report_email(order_data, status_code, text):
+    print(f"[v0] Mailgun API response: {status_code}")
+
+    if status_code == 200:
+        print(f"[v0] SUCCESS: Payment confirmation email sent for {order_data['order_id']}")
+        return True
+    print(f"[v0] ERROR: Failed to send email: {status_code} - {text}")
+    return False
+
+
+def send_payment_confirmation_email(order_data, config):
+    """Send payment confirmation email to shop owner after successful payment"""
+    print(f"[v0] send_payment_confirmation_email called")
+    email = _payment_confirmation_email(order_data, config)
+    if email is None:
+        return False
+    url, data = email
+
     try:
-        response = requests.post(
-            f"https://api.mailgun.net/v3/{config.mailgun_domain}/messages",
+        response = get_session('mailgun').post(
+            url,
             auth=("api", config.mailgun_api_key),
-            data={
-                "from": config.mailgun_from,
-                "to": config.mailgun_to,
-                "subject": subject,
-                "text": text_body
-            }
+            data=data,
+            timeout=get_timeout()
         )
-        
-        print(f"[v0] Mailgun API response: {response.status_code}")
-        
-        if response.status_code == 200:
-            print(f"[v0] SUCCESS: Payment confirmation email sent for {order_data['order_id']}")
-            return True
-        else:
-            print(f"[v0] ERROR: Failed to send email: {response.status_code} - {response.text}")
-            return False
-            
+        return _report_email(order_data, response.status_code, response.text)
+
+    except Exception as e:
+        print(f"[v0] ERROR sending email: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+async def send_payment_confirmation_email_async(order_data, config, session):
+    """send_payment_confirmation_email on an event loop, through an aiohttp session"""
+    email = _payment_confirmation_email(order_data, config)
+    if email is None:
+        return False
+    url, data = email
+
+    connect_timeout, read_timeout = get_timeout()
+    try:
+        async with session.post(
+            url,
+            auth=aiohttp.BasicAuth("api", config.mailgun_api_key),
+            data=data,
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        ) as response:
+            return _report_email(order_data, response.status, await response.text())
+
     except Exception as e:
         print(f"[v0] ERROR sending email: {e}")
         import traceback
@@ -0,0 +1,70 @@
+"""
+Shared, pooled HTTP clients for Telegram, Stripe and Mailgun
+
+Each integration gets one requests.Session with a bounded keep-alive
+connection pool, so calls reuse open TCP/TLS connections instead of
+setting up a new one per request, and no integration can open more than
+HTTP_POOL_SIZE connections per host. configure_http_clients() installs
+the sessions into telebot's API helper and Stripe's default HTTP client
+and sets the timeouts all three use. Stripe's async calls (made on the
+async engine's loop) go through an aiohttp client with the same timeouts.
+"""
+import aiohttp
+import requests
+import stripe
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_TIMEOUT = (5, 30)  # (connect, read) seconds
+
+_sessions = {}
+_timeout = DEFAULT_TIMEOUT
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE):
+    """Create a session keeping up to pool_size connections alive per host
+
+    When all pooled connections are busy, further requests wait for one
+    to be released rather than opening extra connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def configure_http_clients(config):
+    """Create the pooled sessions and install them into telebot and Stripe"""
+    global _timeout
+    _timeout = (config.http_connect_timeout, config.http_read_timeout)
+    for name in ('telegram', 'stripe', 'mailgun'):
+        _sessions[name] = create_session(config.http_pool_size)
+
+    # telebot hands this session to every thread; long polling still
+    # extends the read timeout past its poll interval
+    apihelper.session = _sessions['telegram']
+    apihelper.CONNECT_TIMEOUT, apihelper.READ_TIMEOUT = _timeout
+
+    connect_timeout, read_timeout = _timeout
+    stripe.default_http_client = stripe.RequestsClient(
+        session=_sessions['stripe'],
+        timeout=_timeout,
+        async_fallback_client=stripe.AIOHTTPClient(
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        )
+    )
+
+
+def get_session(name):
+    """Get the pooled session for an integration, creating a default one if needed"""
+    session = _sessions.get(name)
+    if session is None:
+        session = _sessions.setdefault(name, create_session())
+    return session
+
+
+def get_timeout():
+    """Get the (connect, read) timeout for outbound HTTP calls"""
+    return _timeout
@@ -0,0 +1,245 @@
+"""
+Group-commit journal of created orders
+
+Orders are appended to a JSON-lines file by one writer thread. Callers
+hand over a serialized record and return; the writer takes every record
+that arrived since its last commit, writes them in one buffered write and
+makes them durable with one fsync. Under load many checkouts share each
+fsync instead of each opening, appending to and closing the file, and
+rows from concurrent checkouts can never interleave.
+
+With durable=True (the default) append() blocks until the commit holding
+the record has been fsynced; otherwise it returns as soon as the record
+is queued and a crash can lose the last commit window of orders. A
+commit that fails raises in its (waiting) appenders only: the file is cut
+back to the end of the last good commit and the writer carries on.
+
+Listeners (e.g. the order store) are called on the writer thread after
+each commit, before its appenders are released, with its records and
+the journal byte range they occupy.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+
+class _Batch:
+    __slots__ = ('lines', 'records', 'done', 'error')
+
+    def __init__(self):
+        self.lines = []
+        self.records = []
+        self.done = threading.Event()
+        self.error = None
+
+
+class OrderJournal:
+    """Appends order records to a JSON-lines file in group commits"""
+
+    def __init__(self, path, commit_window=0.0, durable=True):
+        self.path = path
+        self.commit_window = commit_window
+        self.durable = durable
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._open = _Batch()
+        self._writing = None
+        self._file = None
+        self._end = 0
+        self._thread = None
+        self._listeners = []
+        # Metrics
+        self.appended = 0
+        self.commits = 0
+        self.largest_commit = 0
+
+    def start(self):
+        """Start the writer thread"""
+        with self._lock:
+            if self._thread is None:
+                trimmed = _trim_torn_line(self.path)
+                if trimmed:
+                    print(f"[order-journal] Cut {trimmed} bytes of a torn write off the end of {self.path}")
+                # Opened here so a bad path fails the caller, not the writer
+                self._file = open(self.path, 'ab')
+                self._end = self._file.tell()
+                self._thread = threading.Thread(target=self._loop, name="order-journal", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        return self._thread
+
+    def add_listener(self, listener):
+        """Call listener(records, start, end) after every commit"""
+        self._listeners.append(listener)
+
+    def append(self, record, wait=None):
+        """Queue an order record; waits for it to be fsynced if durable (or wait=True)
+
+        The record is handed to listeners as is, so it must not be modified
+        afterwards.
+        """
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            batch = self._open
+            batch.lines.append(line)
+            batch.records.append(record)
+            self.appended += 1
+            self._wakeup.notify()
+        if self.durable if wait is None else wait:
+            batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                while not self._open.lines:
+                    self._wakeup.wait()
+            if self.commit_window:
+                # Let more checkouts join this commit
+                time.sleep(self.commit_window)
+            with self._lock:
+                batch, self._open = self._open, _Batch()
+                self._writing = batch
+            start = self._end
+            try:
+                if self._file is None:
+                    self._reopen()
+                data = ''.join(batch.lines).encode('utf-8')
+                self._file.write(data)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except Exception as e:
+                # Any failure only fails this commit's appenders; the writer
+                # keeps running for the next one
+                print(f"[order-journal] ERROR writing {len(batch.lines)} orders to {self.path}: {e}")
+                batch.error = e
+                self._discard_partial_write()
+            else:
+                self._end = start + len(data)
+                # Listeners run first, so a durable append returns with the
+                # order already indexed
+                self._notify(batch.records, start, self._end)
+            with self._lock:
+                self._writing = None
+                self.commits += 1
+                self.largest_commit = max(self.largest_commit, len(batch.lines))
+            batch.done.set()
+
+    def _reopen(self):
+        """Open the file cut back to the end of the last good commit"""
+        f = open(self.path, 'ab')
+        try:
+            f.truncate(self._end)
+        except BaseException:
+            f.close()
+            raise
+        self._file = f
+
+    def _discard_partial_write(self):
+        """Drop whatever a failed commit left in the file (or its buffer)
+
+        Part of the commit may have reached the file, so its end is no
+        longer where the next commit's offsets would be counted from.
+        Closing pushes out anything still buffered; reopening cuts it off.
+        If the file can't be reopened the next commit tries again.
+        """
+        f, self._file = self._file, None
+        if f is not None:
+            try:
+                f.close()
+            except Exception:
+                pass
+        try:
+            self._reopen()
+        except Exception as e:
+            print(f"[order-journal] ERROR reopening {self.path}: {e}")
+
+    def _notify(self, records, start, end):
+        for listener in self._listeners:
+            try:
+                listener(records, start, end)
+            except Exception as e:
+                print(f"[order-journal] ERROR in commit listener {listener}: {e}")
+
+    def flush(self, timeout=None):
+        """Wait until every queued record has been written; returns False on timeout"""
+        with self._lock:
+            batch = self._open if self._open.lines else self._writing
+        if batch is None:
+            return True
+        return batch.done.wait(timeout)
+
+    def stats(self):
+        """Get counters for monitoring"""
+        with self._lock:
+            return {
+                'appended': self.appended,
+                'commits': self.commits,
+                'avg_commit': round(self.appended / self.commits, 1) if self.commits else 0.0,
+                'largest_commit': self.largest_commit,
+                'waiting': len(self._open.lines)
+            }
+
+
+def _complete_end(f, chunk_size=4096):
+    """Get (offset just past the last newline, file size) of an open journal"""
+    size = f.seek(0, os.SEEK_END)
+    position = size
+    while position > 0:
+        step = min(chunk_size, position)
+        position -= step
+        f.seek(position)
+        newline = f.read(step).rfind(b'\n')
+        if newline != -1:
+            return position + newline + 1, size
+    return 0, size
+
+
+def journal_end(path):
+    """Get the end of a journal's last complete line (0 if there is no journal)"""
+    try:
+        with open(path, 'rb') as f:
+            return _complete_end(f)[0]
+    except FileNotFoundError:
+        return 0
+
+
+def _trim_torn_line(path):
+    """Truncate a journal after its last newline; returns the bytes cut off
+
+    A crash mid-commit can leave a half-written last line. Appending after
+    it would merge it with the next order into one unreadable line.
+    """
+    try:
+        f = open(path, 'r+b')
+    except FileNotFoundError:
+        return 0
+    with f:
+        valid_end, size = _complete_end(f)
+        if valid_end < size:
+            f.truncate(valid_end)
+        return size - valid_end
+
+
+def read_journal(path, start=0, end=None):
+    """Yield the order records in a journal file (or a byte range of it), oldest first"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Torn final write from a crash
+                print(f"[order-journal] Skipping unreadable line at byte {f.tell() - len(line)} of {path}")
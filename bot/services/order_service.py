@@ -2,66 +2,154 @@
 Order management and ID generation service
 """
 import csv
+import itertools
 import os
+import secrets
+import time
 from datetime import datetime
 import pytz
 
+from bot.services.order_journal import OrderJournal
+from bot.services.order_store import OrderStore
+
 ORDERS_FILE = 'orders.csv'
+ORDERS_JOURNAL_FILE = 'orders.jsonl'
 UK_TZ = pytz.timezone('Europe/London')
 
+# Order ids: ORD<UTC yyyymmddHHMMSS>-<node>-<sequence>, e.g.
+# ORD20240501123000-K3Z9QW07-00002S. The node is random per process and
+# the sequence counts up within it, so ids are unique across threads,
+# processes and restarts without any coordination, and sort by creation
+# second. Every process starts its sequence at 0, so two processes only
+# stay apart by their nodes: 41 random bits make a clash between any two
+# processes a one in two trillion chance.
+_BASE36 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+NODE_WIDTH = 8
+NODE_BITS = 41  # 2**41 < 36**8, so every node fits without wrapping
+SEQUENCE_WIDTH = 6  # wraps after 36**6 (~2.2 billion) ids per process
+
+def _base36(value, width):
+    digits = []
+    for _ in range(width):
+        value, digit = divmod(value, 36)
+        digits.append(_BASE36[digit])
+    return ''.join(reversed(digits))
+
+def _reset_order_id_state():
+    """Pick a new node id and restart the sequence (at import and in forked children)"""
+    global _node, _sequence, _clock_offset, _stamp
+    _node = _base36(secrets.randbits(NODE_BITS), NODE_WIDTH)
+    _sequence = itertools.count()
+    # Wall clock anchored to the monotonic clock: ids never go back in
+    # time within a process, even if the system clock is stepped back
+    _clock_offset = time.time() - time.monotonic()
+    _stamp = (None, '')
+
+_reset_order_id_state()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_order_id_state)
+
 def generate_order_id():
-    """Generate unique order ID based on timestamp"""
-    now = datetime.now(UK_TZ)
-    return f"ORD{now.strftime('%Y%m%d%H%M%S')}"
+    """Generate a unique, time-sortable order ID"""
+    global _stamp
+    # next() on itertools.count is atomic, so threads never share a number
+    sequence = next(_sequence) % (36 ** SEQUENCE_WIDTH)
+    second = int(_clock_offset + time.monotonic())
+    stamp = _stamp
+    if stamp[0] != second:
+        stamp = (second, time.strftime('%Y%m%d%H%M%S', time.gmtime(second)))
+        _stamp = stamp
+    return f"ORD{stamp[1]}-{_node}-{_base36(sequence, SEQUENCE_WIDTH)}"
+
+# Columns of the orders CSV export
+CSV_FIELDS = [
+    'order_id', 'timestamp', 'name',
+    'address_line1', 'city', 'postcode',
+    'items', 'total', 'payment_status'
+]
+
+_journal = OrderJournal(ORDERS_JOURNAL_FILE)
+_store = None
+
+def create_order_journal(config):
+    """Build the order journal described by the config"""
+    return OrderJournal(
+        config.order_journal_path,
+        commit_window=config.order_commit_window,
+        durable=config.order_journal_durable
+    )
 
-def save_order_to_csv(order_data):
-    """Save order to CSV file"""
-    file_exists = os.path.isfile(ORDERS_FILE)
+def configure_order_journal(journal):
+    """Replace the global order journal"""
+    global _journal
+    _journal = journal
+
+def get_order_journal():
+    """Get the global order journal"""
+    return _journal
+
+def create_order_store(config):
+    """Build the order store described by the config, None if disabled"""
+    if not config.order_db_path:
+        return None
+    return OrderStore(config.order_db_path, journal_path=config.order_journal_path)
+
+def configure_order_store(store):
+    """Replace the global order store"""
+    global _store
+    _store = store
+
+def get_order_store():
+    """Get the global order store (None if there is none)"""
+    return _store
+
+def order_csv_row(order_data):
+    """Format an order as a row of the orders CSV"""
+    # Format items as string
+    items_str = "; ".join([
+        f"{item} x{details['quantity']}"
+        for item, details in order_data['items'].items()
+    ])
     
-    with open(ORDERS_FILE, 'a', newline='', encoding='utf-8') as f:
-        fieldnames = [
-            'order_id', 'timestamp', 'name',
-            'address_line1', 'city', 'postcode',
-            'items', 'total', 'payment_status'
-        ]
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        
-        if not file_exists:
-            writer.writeheader()
-        
-        # Format items as string
-        items_str = "; ".join([
-            f"{item} x{details['quantity']}"
-            for item, details in order_data['items'].items()
-        ])
-        
-        writer.writerow({
-            'order_id': order_data['order_id'],
-            'timestamp': order_data['timestamp'],
-            'name': order_data['name'],
-            'address_line1': order_data['address_line1'],
-            'city': order_data['city'],
-            'postcode': order_data['postcode'],
-            'items': items_str,
-            'total': order_data['total'],
-            'payment_status': order_data.get('payment_status', 'pending')
-        })
-
-def create_order(user_id, customer_info, cart, products_flat, currency='GBP'):
+    return {
+        'order_id': order_data['order_id'],
+        'timestamp': order_data['timestamp'],
+        'name': order_data['name'],
+        'address_line1': order_data['address_line1'],
+        'city': order_data['city'],
+        'postcode': order_data['postcode'],
+        'items': items_str,
+        'total': order_data['total'],
+        'payment_status': order_data.get('payment_status', 'pending')
+    }
+
+def export_orders_csv(orders, f):
+    """Write orders (an iterable of order records) to an open file as CSV; returns the count"""
+    writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    count = 0
+    for order_data in orders:
+        writer.writerow(order_csv_row(order_data))
+        count += 1
+    return count
+
+def create_order(user_id, customer_info, cart, catalog, currency='GBP'):
     """Create a new order from cart and customer info"""
     order_id = generate_order_id()
     timestamp = datetime.now(UK_TZ).strftime('%Y-%m-%d %H:%M:%S')
     
-    # Build items dictionary with prices
+    # Build items dictionary with unit prices in minor units. Items removed
+    # from the catalog since they were added to the cart are left out.
     items = {}
-    total = 0.0
-    for item, quantity in cart.items():
-        price = float(products_flat.get(item, 0))
-        items[item] = {
+    total = 0
+    available, _ = catalog.split_cart(cart)
+    for product, quantity in available:
+        items[product.name] = {
             'quantity': quantity,
-            'price': price
+            'unit_amount': product.price_minor,
+            'category': product.category
         }
-        total += price * quantity
+        total += product.price_minor * quantity
     
     order_data = {
         'order_id': order_id,
@@ -72,12 +160,15 @@ def create_order(user_id, customer_info, cart, products_flat, currency='GBP'):
         'city': customer_info['city'],
         'postcode': customer_info['postcode'],
         'items': items,
-        'total': round(total, 2),
+        'total': total / 100,
+        'total_minor': total,
         'currency': currency,
         'payment_status': 'pending'
     }
     
-    # Save to CSV
-    save_order_to_csv(order_data)
+    # Record it in the order journal; orders left with no items are not
+    # placed, so they aren't recorded
+    if items:
+        _journal.append(order_data)
     
     return order_data
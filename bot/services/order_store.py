@@ -0,0 +1,282 @@
+"""
+Indexed order store
+
+Orders live in a SQLite database (WAL mode) keyed by order_id, with
+secondary indexes on (user_id, timestamp), timestamp and (status,
+timestamp), so the Stripe webhook finds and updates an order, and a
+customer's recent orders are read, in O(log n) at any number of orders.
+
+The store is fed by the order journal: each journal commit is inserted in
+one transaction together with the journal offset it ends at, and on
+startup catch_up() replays whatever part of the journal the store has
+not seen (after a crash between the journal's fsync and the insert).
+Payment status changes are made in the store only.
+
+Sales rollups (see sales_rollups) are updated in the same transactions
+as the orders they count, so reports never need to rescan orders.
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import date, timedelta
+
+from bot.services.order_journal import journal_end, read_journal
+from bot.services.sales_rollups import FIELDS as ROLLUP_FIELDS, new_rollups, add_order
+
+STATUS_PENDING = 'pending'
+STATUS_PAID = 'paid'
+
+
+class OrderStore:
+    """Orders in a SQLite database with lookups by id, user, time and status"""
+
+    def __init__(self, path='orders.db', journal_path=None):
+        self.path = path
+        self.journal_path = journal_path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS orders ("
+            " order_id TEXT PRIMARY KEY,"
+            " user_id INTEGER,"
+            " timestamp TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " total_minor INTEGER,"
+            " data TEXT NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS orders_user ON orders (user_id, timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS orders_timestamp ON orders (timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS orders_status ON orders (status, timestamp)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rollups ("
+            " kind TEXT NOT NULL, day TEXT NOT NULL, key TEXT NOT NULL,"
+            + "".join(f" {field} INTEGER NOT NULL DEFAULT 0," for field in ROLLUP_FIELDS) +
+            " PRIMARY KEY (kind, day, key)"
+            ") WITHOUT ROWID"
+        )
+        # Databases from before rollups existed get theirs built once
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'rollups'").fetchone() is None:
+            self.rebuild_rollups()
+
+    def _conn(self):
+        """Get this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(order_data):
+        return (
+            order_data['order_id'],
+            order_data.get('user_id'),
+            order_data['timestamp'],
+            order_data.get('payment_status') or STATUS_PENDING,
+            order_data.get('total_minor'),
+            json.dumps(order_data, ensure_ascii=False, separators=(',', ':'))
+        )
+
+    @staticmethod
+    def _order(data, status):
+        order_data = json.loads(data)
+        order_data['payment_status'] = status
+        return order_data
+
+    def _insert(self, conn, orders):
+        # Orders already stored keep their status and aren't counted again
+        rollups = new_rollups()
+        inserted = 0
+        for order_data in orders:
+            row = self._row(order_data)
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO orders (order_id, user_id, timestamp, status, total_minor, data)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                row
+            )
+            if cursor.rowcount:
+                inserted += 1
+                add_order(rollups, order_data, paid=int(row[3] == STATUS_PAID))
+        self._apply_rollups(conn, rollups)
+        return inserted
+
+    @staticmethod
+    def _apply_rollups(conn, rollups):
+        columns = ", ".join(ROLLUP_FIELDS)
+        updates = ", ".join(f"{field} = {field} + excluded.{field}" for field in ROLLUP_FIELDS)
+        conn.executemany(
+            f"INSERT INTO rollups (kind, day, key, {columns})"
+            f" VALUES (?, ?, ?{', ?' * len(ROLLUP_FIELDS)})"
+            f" ON CONFLICT (kind, day, key) DO UPDATE SET {updates}",
+            (key + tuple(values) for key, values in rollups.items())
+        )
+
+    def add_many(self, orders):
+        """Insert orders in one transaction; returns the number inserted"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            inserted = self._insert(conn, orders)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return inserted
+
+    def journal_offset(self):
+        """Get the journal byte offset the store has caught up to"""
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'journal_offset'").fetchone()
+        return row[0] if row else 0
+
+    def apply_commit(self, orders, start, end):
+        """Insert one journal commit (the journal's listener)
+
+        If the store has not seen the journal up to start (a commit was
+        missed, or the journal was replaced), the journal is replayed from
+        the store's offset instead.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            offset = self.journal_offset()
+            if offset != start and self.journal_path is not None:
+                orders = read_journal(self.journal_path, offset if offset <= end else 0, end)
+            inserted = self._insert(conn, orders)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('journal_offset', ?)", (end,))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return inserted
+
+    def catch_up(self):
+        """Insert journal records the store has not seen; returns the number inserted"""
+        if self.journal_path is None or not os.path.exists(self.journal_path):
+            return 0
+        # Up to the last complete line: the journal cuts off a torn write
+        # when it starts, and commits continue from there
+        end = journal_end(self.journal_path)
+        if self.journal_offset() == end:
+            return 0
+        return self.apply_commit((), None, end)
+
+    def get(self, order_id):
+        """Get an order by id, None if unknown"""
+        row = self._conn().execute(
+            "SELECT data, status FROM orders WHERE order_id = ?", (order_id,)
+        ).fetchone()
+        return self._order(*row) if row else None
+
+    def set_status(self, order_id, status):
+        """Set an order's payment status; returns its previous status, None if unknown"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT status, data FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+            if row is not None and row[0] != status:
+                conn.execute("UPDATE orders SET status = ? WHERE order_id = ?", (status, order_id))
+                paid = int(status == STATUS_PAID) - int(row[0] == STATUS_PAID)
+                if paid:
+                    rollups = new_rollups()
+                    add_order(rollups, json.loads(row[1]), created=0, paid=paid)
+                    self._apply_rollups(conn, rollups)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return row[0] if row else None
+
+    def orders_for_user(self, user_id, limit=10):
+        """Get a user's most recent orders, newest first"""
+        rows = self._conn().execute(
+            "SELECT data, status FROM orders WHERE user_id = ?"
+            " ORDER BY timestamp DESC LIMIT ?",
+            (user_id, limit)
+        ).fetchall()
+        return [self._order(data, status) for data, status in rows]
+
+    def count(self, status=None):
+        """Count orders, optionally only those with a status"""
+        if status is None:
+            return self._conn().execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM orders WHERE status = ?", (status,)
+        ).fetchone()[0]
+
+    def iter_orders(self, since=None, until=None, status=None, batch_size=1000):
+        """Yield orders in time order, optionally between two days and with a status
+
+        Rows are fetched in batches, so memory use doesn't grow with the
+        number of orders.
+        """
+        clauses, params = [], []
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            # Days are inclusive: everything before the next day starts
+            clauses.append("timestamp < ?")
+            params.append((date.fromisoformat(until) + timedelta(days=1)).isoformat())
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        # A connection of its own, so the store stays usable while streaming
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            cursor = conn.execute(f"SELECT data, status FROM orders{where} ORDER BY timestamp", params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for data, order_status in rows:
+                    yield self._order(data, order_status)
+        finally:
+            conn.close()
+
+    def rebuild_rollups(self):
+        """Recompute all sales rollups from the stored orders"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rollups = new_rollups()
+            for data, status in conn.execute("SELECT data, status FROM orders"):
+                add_order(rollups, json.loads(data), paid=int(status == STATUS_PAID))
+            conn.execute("DELETE FROM rollups")
+            self._apply_rollups(conn, rollups)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rollups', 1)")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def sales_report(self, since=None, until=None):
+        """Sum the rollups between two days (inclusive, 'YYYY-MM-DD')
+
+        Returns {'days': [...], 'products': [...], 'categories': [...]}
+        with one dict per key holding the rollup fields; days are in date
+        order, products and categories by revenue.
+        """
+        params = (since or '', until or '9999-12-31')
+        sums = ", ".join(f"SUM({field})" for field in ROLLUP_FIELDS)
+        rows = self._conn().execute(
+            f"SELECT kind, key, {sums} FROM rollups"
+            " WHERE day >= ? AND day <= ? GROUP BY kind, key",
+            params
+        ).fetchall()
+
+        report = {'days': [], 'products': [], 'categories': []}
+        sections = {'day': 'days', 'product': 'products', 'category': 'categories'}
+        for kind, key, *values in rows:
+            entry = dict(zip(ROLLUP_FIELDS, values))
+            entry['key'] = key
+            report[sections[kind]].append(entry)
+        report['days'].sort(key=lambda entry: entry['key'])
+        for section in ('products', 'categories'):
+            report[section].sort(key=lambda entry: (-entry['revenue_minor'], entry['key']))
+        return report
@@ -0,0 +1,335 @@
+"""
+Rate-limited outbound queue for Bot API calls
+
+Telegram allows about 30 messages per second per bot and roughly one per
+second per chat, answering anything faster with 429 and a retry_after.
+The outbox sits in telebot's request path (apihelper.CUSTOM_REQUEST_SENDER),
+so every call a handler makes waits for a grant from its scheduler before
+it is sent:
+
+- a global token bucket and one token bucket per chat bound the rate;
+- waiting calls are granted by priority lane, so callback answers go
+  before receipts, receipts before ordinary messages and edits, and
+  cosmetic deletes last;
+- a 429 blocks the chat (or, for calls without a chat, that method) for
+  retry_after seconds and the call is queued again instead of failing.
+
+Calls keep their synchronous semantics: the calling thread blocks until
+the request has been sent and returns its response. So that one rate
+limited chat can't park a dispatcher worker (and every user queued behind
+it on that shard), a call is never held longer than max_wait: if its chat
+or method is blocked for longer, it gets a 429 straight away, as Telegram
+would have answered. Methods not listed in LIMITED_METHODS (getUpdates,
+setWebhook, ...) pass straight through.
+"""
+import heapq
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from telebot import apihelper
+
+# Priority lanes, lowest first
+LANE_CALLBACK = 0
+LANE_RECEIPT = 1
+LANE_DEFAULT = 2
+LANE_COSMETIC = 3
+LANE_NAMES = ('callback', 'receipt', 'default', 'cosmetic')
+
+# Bot API methods that are rate limited, with their default lane
+LIMITED_METHODS = {
+    'answerCallbackQuery': LANE_CALLBACK,
+    'sendMessage': LANE_DEFAULT,
+    'editMessageText': LANE_DEFAULT,
+    'editMessageReplyMarkup': LANE_DEFAULT,
+    'sendPhoto': LANE_DEFAULT,
+    'sendDocument': LANE_DEFAULT,
+    'deleteMessage': LANE_COSMETIC,
+    'deleteMessages': LANE_COSMETIC,
+}
+
+MAX_RATE_LIMIT_RETRIES = 5
+# Longest a call may be held for a blocked chat or method, in seconds
+DEFAULT_MAX_WAIT = 5.0
+
+# Per-thread lane override set by outbound_lane()
+_local = threading.local()
+
+
+@contextmanager
+def outbound_lane(lane):
+    """Send this thread's Bot API calls in another lane (e.g. receipts)"""
+    previous = getattr(_local, 'lane', None)
+    _local.lane = lane
+    try:
+        yield
+    finally:
+        _local.lane = previous
+
+
+class TokenBucket:
+    """Allows rate events per second with bursts of up to capacity"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_at(self, now):
+        """Get the time a token will be available (now if one is)"""
+        self.refill(now)
+        at = now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+        return max(at, self.blocked_until)
+
+
+class _Waiter:
+    __slots__ = ('lane', 'chat_id', 'method', 'event', 'queued_at', 'refused')
+
+    def __init__(self, lane, chat_id, method, now):
+        self.lane = lane
+        self.chat_id = chat_id
+        self.method = method
+        self.event = threading.Event()
+        self.queued_at = now
+        # Seconds left on a block longer than max_wait, set instead of a grant
+        self.refused = 0
+
+
+class _RateLimited:
+    """A 429 answered by the outbox itself, shaped like requests.Response for telebot"""
+    status_code = 429
+    reason = 'Too Many Requests'
+
+    def __init__(self, retry_after):
+        self.text = json.dumps({
+            'ok': False,
+            'error_code': 429,
+            'description': f"Too Many Requests: retry after {retry_after}",
+            'parameters': {'retry_after': retry_after}
+        })
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class Outbox:
+    """Schedules outbound Bot API calls under global and per-chat limits"""
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, chat_idle=60, max_wait=DEFAULT_MAX_WAIT):
+        if global_rate <= 0 or chat_rate <= 0 or chat_burst < 1:
+            raise ValueError("Outbox rates must be > 0 and the chat burst at least 1")
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_idle = chat_idle
+        self.max_wait = max_wait
+        self._global = TokenBucket(global_rate, global_rate, time.monotonic())
+        self._chats = {}
+        self._method_blocks = {}  # method -> blocked until, for 429s without a chat
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._waiting = []  # heap of (lane, seq, waiter)
+        self._seq = itertools.count()
+        self._sender = None
+        self._thread = None
+        # Metrics
+        self.sent = [0] * len(LANE_NAMES)
+        self.wait_total = [0.0] * len(LANE_NAMES)
+        self.wait_max = [0.0] * len(LANE_NAMES)
+        self.rate_limited = 0
+        self.refused = 0
+
+    def install(self):
+        """Route the bot's API calls through the outbox and start the scheduler"""
+        self._sender = apihelper.CUSTOM_REQUEST_SENDER or _default_sender
+        apihelper.CUSTOM_REQUEST_SENDER = self.send_request
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._schedule_loop, name="outbox", daemon=True)
+            self._thread.start()
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _blocked_for(self, chat_id, method, now):
+        """Get how long a 429 still blocks calls to chat_id (or, without a chat, method)"""
+        if chat_id is not None:
+            bucket = self._chats.get(chat_id)
+            blocked_until = bucket.blocked_until if bucket is not None else 0.0
+        else:
+            blocked_until = self._method_blocks.get(method, 0.0)
+        return blocked_until - now
+
+    def acquire(self, lane, chat_id=None, method=None):
+        """Block until a call in lane (to chat_id, if any) may be sent
+
+        Returns 0, or the seconds left on a 429 block longer than max_wait,
+        in which case the call must not be sent.
+        """
+        now = time.monotonic()
+        waiter = _Waiter(lane, chat_id, method, now)
+        with self._lock:
+            blocked_for = self._blocked_for(chat_id, method, now)
+            if blocked_for > self.max_wait:
+                self.refused += 1
+                return blocked_for
+            heapq.heappush(self._waiting, (lane, next(self._seq), waiter))
+            self._wakeup.notify()
+        waiter.event.wait()
+        if waiter.refused:
+            return waiter.refused
+        waited = time.monotonic() - now
+        with self._lock:
+            self.sent[lane] += 1
+            self.wait_total[lane] += waited
+            self.wait_max[lane] = max(self.wait_max[lane], waited)
+        return 0
+
+    def _grant_ready(self, now):
+        """Grant every waiter that can go now, in lane order; returns the next time to look again"""
+        next_check = None
+        global_at = self._global.ready_at(now)
+        granted = []
+        for entry in sorted(self._waiting):
+            waiter = entry[2]
+            bucket = self._chat_bucket(waiter.chat_id, now) if waiter.chat_id is not None else None
+            if bucket is not None:
+                chat_at = bucket.ready_at(now)
+            else:
+                chat_at = max(now, self._method_blocks.get(waiter.method, 0.0))
+            if global_at > now:
+                # Global limit reached: lower lanes wait behind this one
+                next_check = global_at if next_check is None else min(next_check, global_at)
+                break
+            if chat_at - now > self.max_wait:
+                # Blocked by a 429 since it was queued: let the caller go
+                self.refused += 1
+                waiter.refused = chat_at - now
+                granted.append(entry)
+                waiter.event.set()
+                continue
+            if chat_at > now:
+                # This chat (or method) must wait; later ones may still go
+                next_check = chat_at if next_check is None else min(next_check, chat_at)
+                continue
+            self._global.tokens -= 1
+            if bucket is not None:
+                bucket.tokens -= 1
+            granted.append(entry)
+            waiter.event.set()
+            global_at = self._global.ready_at(now)
+        if granted:
+            granted_ids = {id(entry) for entry in granted}
+            self._waiting = [entry for entry in self._waiting if id(entry) not in granted_ids]
+            heapq.heapify(self._waiting)
+        return next_check
+
+    def _prune_chats(self, now):
+        """Forget buckets of chats that have been idle (and so are full again)"""
+        cutoff = now - self.chat_idle
+        self._chats = {
+            chat_id: bucket for chat_id, bucket in self._chats.items()
+            if bucket.updated > cutoff or bucket.blocked_until > now
+        }
+        self._method_blocks = {
+            method: blocked_until for method, blocked_until in self._method_blocks.items()
+            if blocked_until > now
+        }
+
+    def _schedule_loop(self):
+        last_prune = time.monotonic()
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                if now - last_prune > self.chat_idle:
+                    self._prune_chats(now)
+                    last_prune = now
+                next_check = self._grant_ready(now) if self._waiting else None
+                timeout = None if next_check is None else max(0.001, next_check - now)
+                if timeout is None and not self._waiting:
+                    timeout = self.chat_idle
+                self._wakeup.wait(timeout)
+
+    def _rate_limited(self, chat_id, method, retry_after):
+        """Block a chat (or, without a chat, a method) for retry_after seconds"""
+        with self._lock:
+            self.rate_limited += 1
+            now = time.monotonic()
+            if chat_id is not None:
+                bucket = self._chat_bucket(chat_id, now)
+                bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+            else:
+                self._method_blocks[method] = max(self._method_blocks.get(method, 0.0), now + retry_after)
+            self._wakeup.notify()
+
+    def send_request(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        """telebot request sender that waits for the rate limits before sending"""
+        api_method = url.rsplit('/', 1)[-1]
+        lane = LIMITED_METHODS.get(api_method)
+        if lane is None:
+            return self._sender(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+        override = getattr(_local, 'lane', None)
+        if override is not None and lane != LANE_CALLBACK:
+            lane = override
+        chat_id = (params or {}).get('chat_id')
+
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            blocked_for = self.acquire(lane, chat_id, api_method)
+            if blocked_for:
+                return _RateLimited(max(1, round(blocked_for)))
+            response = self._sender(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+            if response.status_code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                return response
+            try:
+                retry_after = response.json().get('parameters', {}).get('retry_after', 1)
+            except ValueError:
+                retry_after = 1
+            self._rate_limited(chat_id, api_method, retry_after)
+            if retry_after > self.max_wait:
+                # Others to this chat will wait it out; this caller doesn't
+                print(f"[outbox] Rate limited on {api_method} (chat {chat_id}) for {retry_after}s, not retrying")
+                return response
+            print(f"[outbox] Rate limited on {api_method} (chat {chat_id}), retrying in {retry_after}s")
+
+    def stats(self):
+        """Get backpressure metrics per lane"""
+        with self._lock:
+            waiting = [0] * len(LANE_NAMES)
+            oldest = [0.0] * len(LANE_NAMES)
+            now = time.monotonic()
+            for lane, _, waiter in self._waiting:
+                waiting[lane] += 1
+                oldest[lane] = max(oldest[lane], now - waiter.queued_at)
+            return {
+                'rate_limited': self.rate_limited,
+                'refused': self.refused,
+                'blocked_methods': len(self._method_blocks),
+                'tracked_chats': len(self._chats),
+                'lanes': {
+                    name: {
+                        'waiting': waiting[lane],
+                        'oldest_wait_ms': round(oldest[lane] * 1000, 1),
+                        'sent': self.sent[lane],
+                        'avg_wait_ms': round(self.wait_total[lane] / self.sent[lane] * 1000, 1) if self.sent[lane] else 0.0,
+                        'max_wait_ms': round(self.wait_max[lane] * 1000, 1)
+                    }
+                    for lane, name in enumerate(LANE_NAMES)
+                }
+            }
+
+
+def _default_sender(method, url, params=None, files=None, timeout=None, proxies=None):
+    """telebot's own request path, used when no custom sender was installed"""
+    return apihelper._get_req_session().request(
+        method, url, params=params, files=files, timeout=timeout, proxies=proxies
+    )
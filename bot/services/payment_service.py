@@ -1,13 +1,28 @@
 """
 Stripe payment integration service
+
+Creating a checkout session is a Stripe HTTPS call that often takes half
+a second or more, so handlers hand it to a PaymentSessionWorker, which
+makes the call in the background (on a pool, or on the async engine's
+event loop) and reports back through callbacks.
+Stripe's client retries connection errors and 5xx/429 responses itself,
+with the idempotency key of the attempt (order id plus attempt token), so
+its retries get the same session rather than a second. Stripe replays a
+key's outcome for 24 hours, errors included, so a customer's own "Try
+Again" is a new attempt with a new key.
 """
 import stripe
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bot.utils.formatting import get_unit_amount
 
-def create_payment_session(order_data, stripe_secret_key, success_url, cancel_url):
-    """Create a Stripe checkout session for an order"""
-    stripe.api_key = stripe_secret_key
-    
+# Stripe rejects sessions with a metadata value longer than this
+METADATA_VALUE_LIMIT = 500
+
+def _session_params(order_data, success_url, cancel_url, attempt):
+    """Stripe checkout session parameters for an order"""
     # Build line items from order
     line_items = []
     for item, details in order_data['items'].items():
@@ -17,28 +32,200 @@ def create_payment_session(order_data, stripe_secret_key, success_url, cancel_ur
                 'product_data': {
                     'name': item,
                 },
-                'unit_amount': int(details['price'] * 100),  # Convert to cents
+                'unit_amount': get_unit_amount(details),
             },
             'quantity': details['quantity'],
         })
     
-    session = stripe.checkout.Session.create(
+    metadata = {
+        'order_id': order_data['order_id'],
+        'user_id': str(order_data['user_id']),
+        'username': order_data.get('username', 'Unknown'),
+        # Typed by the customer, so cut to fit
+        'customer_name': order_data['name'][:METADATA_VALUE_LIMIT],
+        'address_line1': order_data['address_line1'][:METADATA_VALUE_LIMIT],
+        'city': order_data['city'][:METADATA_VALUE_LIMIT],
+        'postcode': order_data['postcode'][:METADATA_VALUE_LIMIT],
+        'total': str(order_data['total'])
+    }
+    # The webhook reads the order from the order store; the items only ride
+    # along as a fallback for the receipt, and only when they fit
+    items = json.dumps({
+        item: {'quantity': details['quantity'], 'unit_amount': get_unit_amount(details)}
+        for item, details in order_data['items'].items()
+    }, separators=(',', ':'))
+    if len(items) <= METADATA_VALUE_LIMIT:
+        metadata['items'] = items
+    
+    return dict(
+        idempotency_key=f"checkout-{order_data['order_id']}" + (f"-{attempt}" if attempt else ''),
         payment_method_types=['card'],
         line_items=line_items,
         mode='payment',
         success_url=success_url,
         cancel_url=cancel_url,
-        metadata={
-            'order_id': order_data['order_id'],
-            'user_id': str(order_data['user_id']),
-            'username': order_data.get('username', 'Unknown'),
-            'customer_name': order_data['name'],
-            'address_line1': order_data['address_line1'],
-            'city': order_data['city'],
-            'postcode': order_data['postcode'],
-            'items': json.dumps(order_data['items']),
-            'total': str(order_data['total'])
-        }
+        metadata=metadata
     )
+
+def create_payment_session(order_data, stripe_secret_key, success_url, cancel_url, attempt=None):
+    """Create (or, for an attempt that already has one, get) the Stripe checkout session for an order"""
+    stripe.api_key = stripe_secret_key
+    return stripe.checkout.Session.create(**_session_params(order_data, success_url, cancel_url, attempt))
+
+async def create_payment_session_async(order_data, stripe_secret_key, success_url, cancel_url, attempt=None):
+    """create_payment_session for an event loop (Stripe's aiohttp client)"""
+    stripe.api_key = stripe_secret_key
+    return await stripe.checkout.Session.create_async(**_session_params(order_data, success_url, cancel_url, attempt))
+
+class _Attempt:
+    """One session being created and the callbacks waiting for its outcome"""
+    __slots__ = ('key', 'on_ready', 'on_failed', 'done', 'outcome', 'timer')
+    
+    def __init__(self, key, on_ready, on_failed):
+        self.key = key
+        self.on_ready = on_ready
+        self.on_failed = on_failed
+        # The outcome lock keeps on_slow from landing after the outcome
+        self.done = threading.Event()
+        self.outcome = threading.Lock()
+        self.timer = None
+
+class PaymentSessionWorker:
+    """Creates payment sessions in the background, reporting slow ones
+    
+    Sessions are created on a thread pool, or, once use_engine() has been
+    called, on the async engine's event loop for callers that pass
+    create_async; callbacks always run on the pool.
+    """
     
-    return session
+    def __init__(self, workers=4, timeout=15.0, retries=2, name="payments"):
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.name = name
+        self._executor = None
+        self._engine = None
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        # Metrics
+        self.created = 0
+        self.failed = 0
+        self.slow = 0
+    
+    def start(self):
+        """Start the worker pool (once)"""
+        # Retries of transient errors, made by Stripe's client
+        stripe.max_network_retries = self.retries
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+    
+    def use_engine(self, engine):
+        """Run create_async() coroutines on an AsyncEngine's loop (None for the pool only)"""
+        self._engine = engine
+    
+    def submit(self, key, create, on_ready, on_failed, on_slow=None, create_async=None):
+        """Run create() in the background; returns False if key is already in flight
+        
+        on_ready(session) or on_failed(error) is called with the outcome.
+        If there is no outcome after timeout seconds, on_slow() is called
+        once; the outcome still follows. With an engine in use, the
+        coroutine from create_async() is awaited instead of calling create().
+        """
+        with self._lock:
+            if key in self._in_flight:
+                return False
+            self._in_flight.add(key)
+        
+        attempt = _Attempt(key, on_ready, on_failed)
+        if on_slow is not None:
+            attempt.timer = threading.Timer(self.timeout, self._slow, args=(attempt, on_slow))
+            attempt.timer.daemon = True
+            attempt.timer.start()
+        engine = self._engine
+        if create_async is not None and engine is not None:
+            # No pool thread is held while Stripe answers; the outcome is
+            # handed back to the pool, as callbacks may block
+            engine.submit(create_async()).add_done_callback(
+                lambda future: self._executor.submit(self._settle_future, attempt, future)
+            )
+        else:
+            self._executor.submit(self._run, attempt, create)
+        return True
+    
+    def _slow(self, attempt, on_slow):
+        with attempt.outcome:
+            if attempt.done.is_set():
+                return
+            with self._lock:
+                self.slow += 1
+            print(f"[{self.name}] {attempt.key} is taking longer than {self.timeout}s")
+            self._call(on_slow)
+    
+    def _run(self, attempt, create):
+        try:
+            session = create()
+        except Exception as e:
+            self._settle(attempt, error=e)
+        else:
+            self._settle(attempt, session)
+    
+    def _settle_future(self, attempt, future):
+        if future.cancelled():
+            self._settle(attempt, error=RuntimeError("cancelled"))
+        elif future.exception() is not None:
+            self._settle(attempt, error=future.exception())
+        else:
+            self._settle(attempt, future.result())
+    
+    def _settle(self, attempt, session=None, error=None):
+        try:
+            if error is not None:
+                print(f"[{self.name}] {attempt.key} failed: {error}")
+            with self._lock:
+                if error is not None:
+                    self.failed += 1
+                else:
+                    self.created += 1
+            with attempt.outcome:
+                attempt.done.set()
+                if error is not None:
+                    self._call(attempt.on_failed, error)
+                else:
+                    self._call(attempt.on_ready, session)
+        finally:
+            attempt.done.set()
+            if attempt.timer is not None:
+                attempt.timer.cancel()
+            with self._lock:
+                self._in_flight.discard(attempt.key)
+    
+    def join(self, timeout=None):
+        """Wait until no session is in flight; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if not self._in_flight:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+    
+    def _call(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"[{self.name}] ERROR in {getattr(callback, '__name__', callback)}: {e}")
+    
+    def stats(self):
+        """Get counters for monitoring"""
+        with self._lock:
+            return {
+                'in_flight': len(self._in_flight),
+                'created': self.created,
+                'failed': self.failed,
+                'slow': self.slow
+            }
+
+
+payment_sessions = PaymentSessionWorker()
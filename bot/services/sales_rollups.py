@@ -0,0 +1,71 @@
+"""
+Sales rollups per day, product and category
+
+Each order contributes to three kinds of rollup row, all keyed by the
+order's day: the day itself, each product in it and each product
+category. A row counts orders, units and revenue, for all orders created
+and for those paid. The order store keeps these rows up to date as
+orders are inserted and marked paid, so a report over any range of days
+sums at most one row per day and product instead of rescanning orders.
+"""
+from collections import defaultdict
+
+from bot.utils.formatting import get_unit_amount, to_minor_units
+
+KIND_DAY = 'day'
+KIND_PRODUCT = 'product'
+KIND_CATEGORY = 'category'
+
+# Columns of a rollup row
+FIELDS = ('orders', 'units', 'revenue_minor', 'paid_orders', 'paid_units', 'paid_revenue_minor')
+
+UNCATEGORISED = 'Uncategorised'
+
+
+def new_rollups():
+    """Empty rollup deltas: (kind, day, key) -> counters in FIELDS order"""
+    return defaultdict(lambda: [0] * len(FIELDS))
+
+
+def _unit_amount(details):
+    # Orders imported from the old CSV carry quantities only
+    if 'unit_amount' in details or 'price' in details:
+        return get_unit_amount(details)
+    return 0
+
+
+def add_order(rollups, order_data, created=1, paid=0):
+    """Add an order to rollup deltas
+
+    created and paid are +1 to count the order (as created, as paid), -1
+    to take it back out and 0 to leave that side alone.
+    """
+    day = order_data['timestamp'][:10]
+    items = order_data.get('items') or {}
+    units = 0
+    categories = {}
+    for name, details in items.items():
+        quantity = details.get('quantity', 0)
+        revenue = quantity * _unit_amount(details)
+        units += quantity
+        _add(rollups[(KIND_PRODUCT, day, name)], 1, quantity, revenue, created, paid)
+        category = details.get('category') or UNCATEGORISED
+        totals = categories.setdefault(category, [0, 0])
+        totals[0] += quantity
+        totals[1] += revenue
+    for category, (quantity, revenue) in categories.items():
+        _add(rollups[(KIND_CATEGORY, day, category)], 1, quantity, revenue, created, paid)
+
+    total = order_data.get('total_minor')
+    if total is None:
+        total = to_minor_units(round(float(order_data.get('total', 0)), 2))
+    _add(rollups[(KIND_DAY, day, day)], 1, units, total, created, paid)
+
+
+def _add(row, orders, units, revenue, created, paid):
+    row[0] += orders * created
+    row[1] += units * created
+    row[2] += revenue * created
+    row[3] += orders * paid
+    row[4] += units * paid
+    row[5] += revenue * paid
@@ -0,0 +1,124 @@
+"""
+Per-key coalescing of message edits
+
+Rapid clicks each want to refresh the same message (e.g. a customer
+tapping "add" five times on the live cart). EditCoalescer runs at most one
+refresh per key (chat) per window: the first request runs right away,
+requests arriving within the window collapse into one trailing run, and
+only the most recently submitted refresh is kept. Refreshes should read
+the latest state when they run, so the final edit always shows it.
+"""
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class EditCoalescer:
+    """Runs the latest submitted refresh per key, at most once per window"""
+
+    def __init__(self, window=1.0, workers=4, name="coalescer"):
+        self.window = window
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = {}  # key -> latest refresh not yet run
+        self._due = []  # min-heap of (due time, key) for keys in _scheduled
+        self._scheduled = set()
+        self._running = set()
+        self._last_run = {}  # key -> monotonic time its last refresh started
+        self.submitted = 0
+        self.runs = 0
+        self.retries = 0
+        self._thread = None
+
+    def start(self):
+        """Start the scheduling thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def _schedule(self, key, not_before):
+        """Queue key to run once its window allows; caller holds the lock"""
+        due = max(not_before, self._last_run.get(key, float('-inf')) + self.window)
+        self._scheduled.add(key)
+        heapq.heappush(self._due, (due, key))
+        self._wakeup.notify()
+
+    def submit(self, key, refresh):
+        """Request a refresh for key; replaces any refresh still waiting"""
+        with self._lock:
+            self.submitted += 1
+            self._pending[key] = refresh
+            # A running key is rescheduled when it finishes
+            if key not in self._scheduled and key not in self._running:
+                self._schedule(key, time.monotonic())
+
+    def retry(self, key, refresh, delay):
+        """Run a refresh again after delay (e.g. Telegram's retry_after)"""
+        with self._lock:
+            self.retries += 1
+            self._pending.setdefault(key, refresh)
+            self._last_run[key] = time.monotonic() + delay - self.window
+
+    def _loop(self):
+        """Hand due refreshes to the worker pool"""
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                if not self._due:
+                    # Idle: forget windows that have passed
+                    self._last_run = {
+                        key: started for key, started in self._last_run.items()
+                        if started + self.window > now
+                    }
+                    self._wakeup.wait()
+                    continue
+                due, key = self._due[0]
+                if due > now:
+                    self._wakeup.wait(due - now)
+                    continue
+                heapq.heappop(self._due)
+                self._scheduled.discard(key)
+                refresh = self._pending.pop(key, None)
+                if refresh is None:
+                    continue
+                self._running.add(key)
+                self._last_run[key] = now
+                self.runs += 1
+                self._executor.submit(self._run, key, refresh)
+
+    def _run(self, key, refresh):
+        try:
+            refresh()
+        except Exception as e:
+            print(f"[{self.name}] ERROR refreshing {key}: {e}")
+        finally:
+            with self._lock:
+                self._running.discard(key)
+                if key in self._pending and key not in self._scheduled:
+                    self._schedule(key, time.monotonic())
+
+    def join(self, timeout=None):
+        """Wait until no refresh is waiting or running; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if not self._pending and not self._running:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+
+    def stats(self):
+        """Get counters for monitoring"""
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'runs': self.runs,
+                'retries': self.retries,
+                'coalesced': self.submitted + self.retries - self.runs - len(self._pending),
+                'waiting': len(self._pending)
+            }
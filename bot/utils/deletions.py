@@ -0,0 +1,121 @@
+"""
+Deferred, batched deletion of chat messages
+
+Handlers delete messages only to keep the chat tidy (the customer's
+typed checkout answers, an old order menu), so the deletion should not
+hold up the reply the customer is waiting for. DeleteQueue collects the
+message ids per chat and deletes them from a background thread once the
+chat has been quiet for a short delay, sending all of a chat's ids in one
+deleteMessages call (up to 100 per call) instead of one deleteMessage
+call each.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.apihelper import ApiTelegramException
+
+MAX_BATCH = 100  # deleteMessages accepts up to 100 ids per call
+
+
+class DeleteQueue:
+    """Deletes queued messages per chat, in batches, off the handler thread"""
+
+    def __init__(self, delay=1.0, workers=2, name="deletions"):
+        self.delay = delay
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = {}  # chat_id -> [due time, bot, message ids]
+        self._running = 0
+        self._thread = None
+        self.queued = 0
+        self.calls = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the flushing thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def delete(self, bot, chat_id, message_id):
+        """Queue a message for deletion; returns immediately"""
+        with self._lock:
+            self.queued += 1
+            entry = self._pending.pop(chat_id, None)
+            if entry is None:
+                entry = [0.0, bot, []]
+            if message_id not in entry[2]:
+                entry[2].append(message_id)
+            # Re-inserted at the end: the dict stays ordered by due time
+            entry[0] = time.monotonic() + self.delay
+            self._pending[chat_id] = entry
+            self._wakeup.notify()
+
+    def _loop(self):
+        """Hand chats whose delay has passed to the worker pool"""
+        with self._lock:
+            while True:
+                if not self._pending:
+                    self._wakeup.wait()
+                    continue
+                chat_id = next(iter(self._pending))
+                due, bot, message_ids = self._pending[chat_id]
+                now = time.monotonic()
+                if due > now:
+                    self._wakeup.wait(due - now)
+                    continue
+                del self._pending[chat_id]
+                self._running += 1
+                self._executor.submit(self._flush, bot, chat_id, message_ids)
+
+    def _flush(self, bot, chat_id, message_ids):
+        try:
+            for start in range(0, len(message_ids), MAX_BATCH):
+                batch = message_ids[start:start + MAX_BATCH]
+                try:
+                    if len(batch) == 1:
+                        bot.delete_message(chat_id, batch[0])
+                    else:
+                        bot.delete_messages(chat_id, batch)
+                except ApiTelegramException as e:
+                    # Already gone or too old to delete; nothing to retry
+                    with self._lock:
+                        self.failed += 1
+                    print(f"[{self.name}] Could not delete {batch} in chat {chat_id}: {e.description}")
+                except Exception as e:
+                    with self._lock:
+                        self.failed += 1
+                    print(f"[{self.name}] ERROR deleting {batch} in chat {chat_id}: {e}")
+                with self._lock:
+                    self.calls += 1
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def join(self, timeout=None):
+        """Wait until every queued deletion has been sent; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if not self._pending and not self._running:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+
+    def stats(self):
+        """Get counters for monitoring"""
+        with self._lock:
+            return {
+                'queued': self.queued,
+                'api_calls': self.calls,
+                'failed': self.failed,
+                'waiting': sum(len(entry[2]) for entry in self._pending.values())
+            }
+
+
+message_deletions = DeleteQueue()
@@ -0,0 +1,119 @@
+"""
+Per-user ordered update dispatcher
+
+Updates are sharded by the sending user's id onto a fixed pool of worker
+threads. Each shard has its own FIFO queue, so updates from one user are
+always handled in order (keeping the checkout state machine consistent),
+while updates from different users are processed in parallel.
+"""
+import queue
+import threading
+import traceback
+
+from telebot import TeleBot
+
+
+def get_update_user_id(update):
+    """Get the id of the user an update belongs to, if any"""
+    for field in ('message', 'edited_message', 'callback_query',
+                  'inline_query', 'chosen_inline_result',
+                  'shipping_query', 'pre_checkout_query'):
+        event = getattr(update, field, None)
+        if event is not None and getattr(event, 'from_user', None) is not None:
+            return event.from_user.id
+    return None
+
+
+class UpdateDispatcher:
+    """Shards updates by user id onto a bounded pool of ordered workers"""
+
+    def __init__(self, bot, workers=8, queue_size=1000):
+        self.bot = bot
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        self._threads = []
+        self._processed = [0] * self.workers
+        self._started = False
+
+    def start(self):
+        """Start the shard worker threads"""
+        if self._started:
+            return
+        for shard in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker,
+                args=(shard,),
+                name=f"dispatch-{shard}",
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        self._started = True
+
+    def attach(self):
+        """Route the bot's polling loop through this dispatcher"""
+        self.bot.process_new_updates = self.submit_many
+
+    def shard_for(self, update):
+        """Get the shard index an update is routed to"""
+        user_id = get_update_user_id(update)
+        key = user_id if user_id is not None else update.update_id
+        return hash(key) % self.workers
+
+    def submit(self, update, block=True):
+        """Queue a single update; blocks if its shard is full (backpressure)
+
+        With block=False a full shard is reported by returning False instead.
+        """
+        if update.update_id > self.bot.last_update_id:
+            self.bot.last_update_id = update.update_id
+        try:
+            self._queues[self.shard_for(update)].put(update, block=block)
+        except queue.Full:
+            return False
+        return True
+
+    def submit_many(self, updates):
+        """Queue a batch of updates, preserving their order per user"""
+        for update in updates:
+            self.submit(update)
+
+    def _worker(self, shard):
+        """Process updates from one shard queue in order"""
+        updates = self._queues[shard]
+        while True:
+            update = updates.get()
+            try:
+                TeleBot.process_new_updates(self.bot, [update])
+            except Exception as e:
+                print(f"[dispatcher] ERROR processing update {update.update_id}: {e}")
+                traceback.print_exc()
+            finally:
+                self._processed[shard] += 1
+                updates.task_done()
+
+    def queue_depth(self):
+        """Get the total number of updates waiting across all shards"""
+        return sum(q.qsize() for q in self._queues)
+
+    def shard_backlog(self):
+        """Get the number of updates waiting in each shard"""
+        return [q.qsize() for q in self._queues]
+
+    def stats(self):
+        """Get dispatcher metrics for monitoring"""
+        backlog = self.shard_backlog()
+        return {
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'queue_depth': sum(backlog),
+            'max_shard_backlog': max(backlog),
+            'shard_backlog': backlog,
+            'processed': sum(self._processed)
+        }
+
+    def join(self):
+        """Block until every queued update has been processed"""
+        for q in self._queues:
+            q.join()
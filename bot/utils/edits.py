@@ -0,0 +1,72 @@
+"""
+Edits of tracked messages that skip unchanged content
+
+The bot keeps editing a few messages per user (the live cart, the order
+menu and the checkout prompt, whose ids live in the session). Each time
+one is sent or edited, a fingerprint of its text and markup is stored in
+the session; an edit whose fingerprint matches is skipped instead of
+costing a round trip that Telegram answers with "message is not
+modified".
+"""
+import hashlib
+import threading
+
+from telebot.apihelper import ApiTelegramException
+
+from bot.utils.session import get_message_fingerprint, set_message_fingerprint
+
+_stats_lock = threading.Lock()
+_sent_edits = 0
+_skipped_edits = 0
+
+
+def content_fingerprint(text, reply_markup=None):
+    """Hash a message's text and markup"""
+    if reply_markup is not None and not isinstance(reply_markup, str):
+        reply_markup = reply_markup.to_json()
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(text.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update((reply_markup or '').encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _count(sent):
+    global _sent_edits, _skipped_edits
+    with _stats_lock:
+        if sent:
+            _sent_edits += 1
+        else:
+            _skipped_edits += 1
+
+
+def remember_message(user_id, message, text, reply_markup=None):
+    """Record what a just-sent tracked message shows"""
+    set_message_fingerprint(user_id, message.message_id, content_fingerprint(text, reply_markup))
+
+
+def edit_message_text(bot, user_id, text, chat_id, message_id, reply_markup=None):
+    """Edit a message unless it already shows this text and markup
+
+    Returns True if an edit was sent. Errors other than "message is not
+    modified" propagate like bot.edit_message_text's.
+    """
+    fingerprint = content_fingerprint(text, reply_markup)
+    if get_message_fingerprint(user_id, message_id) == fingerprint:
+        _count(False)
+        return False
+
+    try:
+        bot.edit_message_text(text, chat_id, message_id, reply_markup=reply_markup)
+    except ApiTelegramException as e:
+        if 'message is not modified' not in e.description:
+            raise
+    _count(True)
+    set_message_fingerprint(user_id, message_id, fingerprint)
+    return True
+
+
+def edit_stats():
+    """Get counters of sent and skipped edits"""
+    with _stats_lock:
+        return {'sent_edits': _sent_edits, 'skipped_edits': _skipped_edits}
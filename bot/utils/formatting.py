@@ -2,71 +2,165 @@
 Text and message formatting utilities
 """
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 import pytz
 
 UK_TZ = pytz.timezone('Europe/London')
 
+MESSAGE_LIMIT = 4096  # Telegram's maximum message length, in UTF-16 code units
+
+CURRENCY_SYMBOLS = {
+    'GBP': '£',
+    'USD': '$',
+    'EUR': '€'
+}
+
+def to_minor_units(price):
+    """Convert a price like "12.99" (or 12.99) to integer minor units"""
+    try:
+        amount = Decimal(str(price)) * 100
+    except InvalidOperation:
+        raise ValueError(f"Invalid price: {price!r}")
+    if amount != amount.to_integral_value() or amount < 0:
+        raise ValueError(f"Invalid price: {price!r}")
+    return int(amount)
+
+def format_minor(amount_minor, currency='GBP'):
+    """Format an amount in minor units with currency symbol, removing unnecessary decimals"""
+    symbol = CURRENCY_SYMBOLS.get(currency, currency)
+    major, minor = divmod(amount_minor, 100)
+    if minor == 0:
+        return f"{symbol}{major}"
+    return f"{symbol}{major}.{minor:02d}"
+
 def format_price(price, currency='GBP'):
     """Format price with currency symbol, removing unnecessary decimals"""
-    symbols = {
-        'GBP': '£',
-        'USD': '$',
-        'EUR': '€'
-    }
-    symbol = symbols.get(currency, currency)
-    
-    if float(price) == int(float(price)):
-        return f"{symbol}{int(float(price))}"
-    return f"{symbol}{price}"
-
-def format_cart_message(cart, products_flat, currency='GBP'):
-    """Format cart contents into a readable message with items listed individually"""
+    return format_minor(to_minor_units(price), currency)
+
+def get_unit_amount(details):
+    """Get an order item's unit price in minor units
+
+    Orders created before prices were kept in minor units only carry a
+    float 'price'.
+    """
+    if 'unit_amount' in details:
+        return details['unit_amount']
+    return to_minor_units(round(details['price'], 2))
+
+def _text_length(text):
+    """Length of text as Telegram counts it (UTF-16 code units)"""
+    return len(text.encode('utf-16-le')) // 2
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """Split text into chunks Telegram accepts, breaking between lines"""
+    if _text_length(text) <= limit:
+        return [text]
+    
+    chunks = []
+    current = []
+    size = 0
+    for line in text.split("\n"):
+        length = _text_length(line)
+        while length > limit:
+            # A single line too long for a message is cut (limit // 2 code
+            # points is at most limit code units)
+            if current:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            chunks.append(line[:limit // 2])
+            line = line[limit // 2:]
+            length = _text_length(line)
+        if current and size + 1 + length > limit:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        size += length + (1 if current else 0)
+        current.append(line)
+    if current:
+        chunks.append("\n".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def send_long_message(bot, chat_id, text, reply_markup=None, **kwargs):
+    """Send text in as many messages as needed; returns the last one
+
+    The reply markup is attached to the last message.
+    """
+    chunks = split_message(text)
+    for chunk in chunks[:-1]:
+        bot.send_message(chat_id, chunk, **kwargs)
+    return bot.send_message(chat_id, chunks[-1], reply_markup=reply_markup, **kwargs)
+
+def render_items(items, currency='GBP', bullet=''):
+    """Render grouped item lines sorted by unit price; returns (lines, total)
+
+    items is an iterable of (name, quantity, unit_amount) with amounts in
+    minor units. Each item is one line ("name ×N - line total" when N > 1),
+    so the cost depends on the number of distinct items, not on quantities.
+    """
+    lines = []
+    total = 0
+    for name, quantity, unit_amount in sorted(items, key=lambda item: item[2]):
+        amount = unit_amount * quantity
+        total += amount
+        if quantity == 1:
+            lines.append(f"{bullet}{name} - {format_minor(amount, currency)}")
+        else:
+            lines.append(f"{bullet}{name} ×{quantity} - {format_minor(amount, currency)}")
+    return lines, total
+
+def _cart_items(cart, catalog):
+    """Get (items, unavailable names) of a cart for render_items"""
+    available, unavailable = catalog.split_cart(cart)
+    items = [(product.name, quantity, product.price_minor) for product, quantity in available]
+    return items, unavailable
+
+def _order_items(order_data):
+    """Get the items of an order for render_items"""
+    return [
+        (item, details['quantity'], get_unit_amount(details))
+        for item, details in order_data['items'].items()
+    ]
+
+def format_cart_message(cart, catalog, currency='GBP', total_minor=None):
+    """Format cart contents into a readable message sorted by price
+
+    total_minor is the cart's running total (Cart.total_minor) if the
+    caller has one; otherwise the lines are added up.
+    """
     if not cart:
         return "Your cart is empty."
     
     lines = ["📦 Your Cart:\n"]
     
-    items_with_prices = []
-    for item, quantity in cart.items():
-        price = float(products_flat.get(item, 0))
-        for _ in range(quantity):
-            items_with_prices.append((item, price))
+    items, unavailable = _cart_items(cart, catalog)
+    item_lines, total = render_items(items, currency)
+    lines.extend(item_lines)
     
-    # Sort by price ascending
-    items_with_prices.sort(key=lambda x: x[1])
+    for item in unavailable:
+        lines.append(f"{item} - no longer available")
     
-    total = 0.0
-    for item, price in items_with_prices:
-        lines.append(f"{item} - {format_price(price, currency)}")
-        total += price
-    
-    lines.append(f"\nTotal: {format_price(total, currency)}")
+    if total_minor is not None:
+        total = total_minor
+    lines.append(f"\nTotal: {format_minor(total, currency)}")
     return "\n".join(lines)
 
-def format_order_summary_individual(cart, products_flat, customer_info, currency='GBP'):
-    """Format order summary with items listed individually and sorted by price"""
+def format_order_summary_individual(cart, catalog, customer_info, currency='GBP', total_minor=None):
+    """Format order summary with items sorted by price (total_minor as in format_cart_message)"""
     lines = [
         "Order Summary\n",
         "Items:"
     ]
     
-    items_with_prices = []
-    total = 0.0
-    
-    for item, quantity in cart.items():
-        price = float(products_flat.get(item, 0))
-        for _ in range(quantity):
-            items_with_prices.append((item, price))
-        total += price * quantity
+    items, unavailable = _cart_items(cart, catalog)
+    item_lines, total = render_items(items, currency, bullet="• ")
+    lines.extend(item_lines)
     
-    # Sort by price ascending
-    items_with_prices.sort(key=lambda x: x[1])
-    
-    for item, price in items_with_prices:
-        lines.append(f"• {item} - {format_price(price, currency)}")
+    for item in unavailable:
+        lines.append(f"• {item} - no longer available")
     
+    if total_minor is not None:
+        total = total_minor
     lines.extend([
-        f"\nTotal: {format_price(total, currency)}",
+        f"\nTotal: {format_minor(total, currency)}",
         "\nDelivery Address:",
         customer_info['name'],
         customer_info['address_line1'],
@@ -93,24 +187,10 @@ def format_order_summary(order_data, currency='GBP'):
         f"\nItems:"
     ])
     
-    items_with_prices = []
-    total = 0.0
-    
-    for item, details in order_data['items'].items():
-        quantity = details['quantity']
-        price = details['price']
-        subtotal = quantity * price
-        total += subtotal
-        for _ in range(quantity):
-            items_with_prices.append((item, price))
-    
-    # Sort by price ascending
-    items_with_prices.sort(key=lambda x: x[1])
+    item_lines, total = render_items(_order_items(order_data), currency, bullet="• ")
+    lines.extend(item_lines)
     
-    for item, price in items_with_prices:
-        lines.append(f"• {item} - {format_price(price, currency)}")
-    
-    lines.append(f"\nTotal: {format_price(total, currency)}")
+    lines.append(f"\nTotal: {format_minor(total, currency)}")
     
     return "\n".join(lines)
 
@@ -134,29 +214,16 @@ def format_receipt(order_data, currency='GBP'):
     ]
     
     # Parse items - could be dict or string
-    items_with_prices = []
-    total = 0.0
-    
-    if isinstance(order_data['items'], dict):
-        for item, details in order_data['items'].items():
-            quantity = details['quantity']
-            price = details['price']
-            for _ in range(quantity):
-                items_with_prices.append((item, price))
-            total += quantity * price
+    if isinstance(order_data['items'], dict) and order_data['items']:
+        item_lines, total = render_items(_order_items(order_data), currency)
+        lines.extend(item_lines)
     else:
-        # Fallback if items is a string
-        total = order_data.get('total', 0.0)
-    
-    # Sort by price ascending
-    items_with_prices.sort(key=lambda x: x[1])
-    
-    for item, price in items_with_prices:
-        lines.append(f"{item} - {format_price(price, currency)}")
+        # Fallback if items is a string, or were too many for Stripe's metadata
+        total = to_minor_units(round(float(order_data.get('total', 0)), 2))
     
     lines.extend([
         "",
-        f"Total Paid: {format_price(total, currency)}",
+        f"Total Paid: {format_minor(total, currency)}",
         "",
         "Delivery Address:",
         order_data['name'],
@@ -166,3 +233,52 @@ def format_receipt(order_data, currency='GBP'):
     ])
     
     return "\n".join(lines)
+
+def format_order_history(orders, currency='GBP'):
+    """Format a customer's recent orders, newest first"""
+    if not orders:
+        return "You haven't placed any orders yet."
+    
+    lines = ["Your orders:"]
+    for order_data in orders:
+        total = order_data.get('total_minor')
+        if total is None:
+            total = to_minor_units(round(float(order_data.get('total', 0)), 2))
+        lines.append(
+            f"\n{order_data['order_id']}\n"
+            f"{order_data['timestamp'][:16]} - "
+            f"{format_minor(total, order_data.get('currency', currency))} - "
+            f"{order_data.get('payment_status', 'pending')}"
+        )
+    
+    return "\n".join(lines)
+
+def format_sales_report(report, title, currency='GBP', include_days=False):
+    """Format summed sales rollups (OrderStore.sales_report) for admins"""
+    days = report['days']
+    if not days:
+        return f"{title}\n\nNo orders."
+    
+    def amounts(entry):
+        return (f"{format_minor(entry['revenue_minor'], currency)} "
+                f"({format_minor(entry['paid_revenue_minor'], currency)} paid)")
+    
+    totals = {field: sum(day[field] for day in days) for field in days[0] if field != 'key'}
+    lines = [
+        title,
+        "",
+        f"Orders: {totals['orders']} ({totals['paid_orders']} paid)",
+        f"Revenue: {amounts(totals)}"
+    ]
+    
+    for heading, section in (("By category:", 'categories'), ("By product:", 'products')):
+        lines.extend(["", heading])
+        for entry in report[section]:
+            lines.append(f"{entry['key']} - {entry['units']} units - {amounts(entry)}")
+    
+    if include_days:
+        lines.extend(["", "By day:"])
+        for entry in days:
+            lines.append(f"{entry['key']} - {entry['orders']} orders - {amounts(entry)}")
+    
+    return "\n".join(lines)
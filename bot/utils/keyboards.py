@@ -0,0 +1,124 @@
+"""
+Prebuilt inline keyboards, cached in serialized form
+
+telebot passes a reply_markup string straight through to the Bot API, so
+keyboards are built and JSON-encoded once and handlers send the cached
+string. Static keyboards are encoded at import; the category menu and
+each page of a category's product list are encoded on first use per
+catalog version and dropped as soon as a reloaded catalog is seen.
+"""
+import threading
+
+from telebot import types
+
+DEFAULT_PAGE_SIZE = 10
+# callback_data of the "page x/y" button, which does nothing when pressed
+PAGE_INDICATOR_CALLBACK = 'page_indicator'
+
+
+def _inline(*rows):
+    """Serialize an inline keyboard given rows of (text, callback_data)"""
+    markup = types.InlineKeyboardMarkup()
+    for row in rows:
+        markup.row(*(types.InlineKeyboardButton(text, callback_data=data) for text, data in row))
+    return markup.to_json()
+
+
+def _reply(*labels):
+    """Serialize a resized reply keyboard with one button per row"""
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    for label in labels:
+        markup.row(types.KeyboardButton(label))
+    return markup.to_json()
+
+
+MAIN_MENU = _reply("🛍️ Browse Products", "📦 View Cart")
+CART_ACTIONS = _inline(
+    [("🪓 Clear Cart", "clear_cart")],
+    [("🏁 Checkout", "checkout")]
+)
+CONTINUE_SHOPPING = _inline([("📦 Continue Shopping", "continue_shopping")])
+BACK_TO_NAME = _inline([("⬅️ Back", "back_to_name")])
+BACK_TO_ADDRESS = _inline([("⬅️ Back", "back_to_address")])
+BACK_TO_CITY = _inline([("⬅️ Back", "back_to_city")])
+ORDER_CONFIRMATION = _inline(
+    [("✏️ Edit Address", "edit_address")],
+    [("🏁 Confirm & Pay", "confirm_order")]
+)
+# callback_data prefix of the button that retries a failed payment session
+RETRY_PAYMENT_CALLBACK_PREFIX = 'retry_payment:'
+
+
+def pay_now_keyboard(url):
+    """Serialize the button linking to an order's checkout page"""
+    markup = types.InlineKeyboardMarkup()
+    markup.row(types.InlineKeyboardButton("💳 Pay Now", url=url))
+    return markup.to_json()
+
+
+def retry_payment_keyboard(order_id):
+    """Serialize the button that retries creating an order's payment session"""
+    return _inline([("🔄 Try Again", f"{RETRY_PAYMENT_CALLBACK_PREFIX}{order_id}")])
+
+
+class _CatalogKeyboards:
+    """Serialized keyboards for one catalog version"""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.version = catalog.version
+        self.categories = _inline(*(
+            [(f"📦 {category}", catalog.category_callback(category))]
+            for category in catalog.categories
+        ))
+        self.products = {}
+
+    def products_keyboard(self, category, page, page_size):
+        catalog = self.catalog
+        # Clamp before caching so out-of-range pages share one entry
+        page = min(max(page, 0), catalog.page_count(category, page_size) - 1)
+        key = (category, page, page_size)
+        keyboard = self.products.get(key)
+        if keyboard is None:
+            items, page, page_count = catalog.category_page(category, page, page_size)
+            rows = [
+                [(f"{product.name} - {product.price_label}", catalog.product_callback(product))]
+                for product in items
+            ]
+            if page_count > 1:
+                navigation = []
+                if page > 0:
+                    navigation.append(("⬅️ Prev", catalog.category_callback(category, page - 1)))
+                navigation.append((f"{page + 1}/{page_count}", PAGE_INDICATOR_CALLBACK))
+                if page < page_count - 1:
+                    navigation.append(("Next ➡️", catalog.category_callback(category, page + 1)))
+                rows.append(navigation)
+            rows.append([("⬅️ Back to Categories", "back_to_categories")])
+            keyboard = self.products[key] = _inline(*rows)
+        return keyboard
+
+
+_keyboards = None
+_keyboards_lock = threading.Lock()
+
+
+def _for_catalog(catalog):
+    """Get the keyboard cache for catalog, replacing one for an older version"""
+    global _keyboards
+    keyboards = _keyboards
+    if keyboards is None or keyboards.version != catalog.version:
+        with _keyboards_lock:
+            keyboards = _keyboards
+            if keyboards is None or keyboards.version != catalog.version:
+                keyboards = _keyboards = _CatalogKeyboards(catalog)
+    return keyboards
+
+
+def categories_keyboard(catalog):
+    """Get the serialized category menu for catalog"""
+    return _for_catalog(catalog).categories
+
+
+def products_keyboard(catalog, category, page=0, page_size=DEFAULT_PAGE_SIZE):
+    """Get one page of a category's product list, with page navigation and a back button"""
+    return _for_catalog(catalog).products_keyboard(category, page, page_size)
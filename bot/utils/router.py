@@ -0,0 +1,130 @@
+"""
+Indexed update router
+
+Instead of registering one telebot handler per route (which telebot tests
+one predicate at a time for every update), handlers are registered here by
+exact callback data, by callback data prefix, by exact message text or by
+the user's current checkout state. The router installs a single catch-all
+handler per update type and resolves each update with dictionary lookups,
+a prefix-trie walk and at most one state read, so dispatch cost does not
+grow with the number of routes. A callback no route matches (e.g. a button
+from an older version of the bot) is still answered, so the client stops
+showing its spinner.
+"""
+from bot.utils.session import get_user_state
+
+_HANDLER = object()  # Trie node key holding the handler for that prefix
+
+EXPIRED_BUTTON_TEXT = "This button has expired, please use the menu again"
+
+
+class PrefixTrie:
+    """Character trie mapping string prefixes to values"""
+
+    def __init__(self):
+        self._root = {}
+
+    def insert(self, prefix, value):
+        """Map a prefix to a value"""
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[_HANDLER] = value
+
+    def longest_match(self, text):
+        """Get the value of the longest registered prefix of text, or None"""
+        node = self._root
+        match = node.get(_HANDLER)
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            match = node.get(_HANDLER, match)
+        return match
+
+
+class Router:
+    """Routes callbacks and text messages to handlers in O(1)/O(prefix)"""
+
+    def __init__(self, state_getter=get_user_state):
+        self._state_getter = state_getter
+        self._callbacks = {}
+        self._callback_prefixes = PrefixTrie()
+        self._texts = {}
+        self._states = {}
+        self._callback_fallback = None
+
+    def callback(self, data):
+        """Register a callback handler for an exact callback_data value"""
+        def decorator(handler):
+            self._callbacks[data] = handler
+            return handler
+        return decorator
+
+    def callback_prefix(self, prefix):
+        """Register a callback handler for callback_data starting with prefix"""
+        def decorator(handler):
+            self._callback_prefixes.insert(prefix, handler)
+            return handler
+        return decorator
+
+    def callback_fallback(self, handler):
+        """Register the handler for callbacks no other route matches"""
+        self._callback_fallback = handler
+        return handler
+
+    def text(self, value):
+        """Register a message handler for an exact message text"""
+        def decorator(handler):
+            self._texts[value] = handler
+            return handler
+        return decorator
+
+    def state(self, state):
+        """Register a message handler for users in a given state"""
+        def decorator(handler):
+            self._states[state] = handler
+            return handler
+        return decorator
+
+    def resolve_callback(self, data):
+        """Get the handler for callback data, or None"""
+        handler = self._callbacks.get(data)
+        if handler is None and data:
+            handler = self._callback_prefixes.longest_match(data)
+        return handler
+
+    def resolve_message(self, message):
+        """Get the handler for a text message, or None
+
+        Exact text matches (reply keyboard buttons) win over state handlers,
+        matching the order the handlers used to be registered in.
+        """
+        handler = self._texts.get(message.text)
+        if handler is None and self._states:
+            handler = self._states.get(self._state_getter(message.from_user.id))
+        return handler
+
+    def dispatch_callback(self, call):
+        """Run the handler routed for a callback query"""
+        handler = self.resolve_callback(call.data) or self._callback_fallback
+        if handler is not None:
+            handler(call)
+
+    def dispatch_message(self, message):
+        """Run the handler routed for a text message"""
+        handler = self.resolve_message(message)
+        if handler is not None:
+            handler(message)
+
+    def install(self, bot):
+        """Register the router's catch-all handlers on the bot
+
+        Call after command handlers are registered so /commands keep priority.
+        Unless a fallback was registered, unmatched callbacks are answered
+        with EXPIRED_BUTTON_TEXT.
+        """
+        if self._callback_fallback is None:
+            self._callback_fallback = lambda call: bot.answer_callback_query(call.id, EXPIRED_BUTTON_TEXT)
+        bot.callback_query_handler(func=lambda call: True)(self.dispatch_callback)
+        bot.message_handler(func=lambda message: True, content_types=['text'])(self.dispatch_message)
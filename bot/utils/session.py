@@ -1,111 +1,499 @@
 """
 Session management and timeout handling
 """
+import heapq
+import json
+import sqlite3
 import time
 import threading
+from contextlib import contextmanager
 
-# Global session storage
-user_sessions = {}
-user_carts = {}
-user_states = {}
-user_cart_messages = {}
-user_order_messages = {}
-user_checkout_messages = {}
+from bot.cart import Cart
 
 SESSION_TIMEOUT = 900  # 15 minutes in seconds
+SESSION_CLEANUP_INTERVAL = 60  # Seconds between expiry sweeps
+LOCK_STRIPES = 64  # Number of locks user ids are striped over
+
+
+class UserSession:
+    """Everything the bot keeps about one user, in a single compact record"""
+    __slots__ = (
+        'user_id', 'last_activity', 'active', 'state', 'cart',
+        'cart_message_id', 'order_message_id', 'checkout_message_id',
+        'checkout_data', 'message_fingerprints'
+    )
+
+    def __init__(self, user_id, last_activity=None):
+        self.user_id = user_id
+        self.last_activity = time.time() if last_activity is None else last_activity
+        self.active = False
+        self.state = None
+        self.cart = Cart()
+        self.cart_message_id = None
+        self.order_message_id = None
+        self.checkout_message_id = None
+        self.checkout_data = None
+        # str(message_id) -> fingerprint of what a tracked message shows
+        self.message_fingerprints = None
+
+    def to_dict(self):
+        """Serialize the session to plain JSON-compatible values"""
+        data = {slot: getattr(self, slot) for slot in self.__slots__}
+        data['cart'] = self.cart.to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a session from to_dict() output"""
+        session = cls(data['user_id'], data['last_activity'])
+        for slot in cls.__slots__:
+            if slot in data:
+                setattr(session, slot, data[slot])
+        session.cart = Cart.from_dict(session.cart or {})
+        return session
+
+
+class SessionStore:
+    """Interface for session storage backends
+
+    Every store guards sessions with striped locks: a user id hashes to one
+    of a fixed set of locks, so operations on users in different stripes
+    never contend. Read-modify-write sequences on a session must run under
+    lock(user_id).
+    """
+
+    def __init__(self, lock_stripes=LOCK_STRIPES):
+        self._stripes = [threading.RLock() for _ in range(lock_stripes)]
+
+    def lock(self, user_id):
+        """Get the lock guarding a user's session"""
+        return self._stripes[hash(user_id) % len(self._stripes)]
+
+    def get(self, user_id):
+        """Get a user's session, or None"""
+        raise NotImplementedError
+
+    def get_or_create(self, user_id):
+        """Get a user's session, creating an empty one if needed"""
+        raise NotImplementedError
+
+    def save(self, session):
+        """Persist changes made to a session returned by this store"""
+        raise NotImplementedError
+
+    def touch(self, user_id, now):
+        """Bump a user's last activity time, if they have a session"""
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        """Remove a user's session"""
+        raise NotImplementedError
+
+    def expire(self, cutoff):
+        """Remove sessions idle since before cutoff and return their user ids"""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions held in this process's memory
+
+    Expiry uses a min-heap of (last_activity, user_id) with lazy
+    invalidation: activity bumps only update the record, and a heap entry
+    that comes due for a session which has since been active is pushed
+    back with its new time. A sweep therefore only touches entries that
+    are actually due, not the whole population.
+
+    Changed user ids are also recorded in a dirty set so a snapshotter
+    can persist just the sessions that changed since its last pass.
+    """
+
+    def __init__(self, lock_stripes=LOCK_STRIPES):
+        super().__init__(lock_stripes)
+        self._sessions = {}
+        self._expiry_heap = []
+        self._scheduled = {}  # user_id -> last_activity of its live heap entry
+        # Guards the heap and _scheduled; always taken after a stripe lock
+        self._expiry_lock = threading.Lock()
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+
+    def _schedule(self, session):
+        """Make sure a session has an entry in the expiry heap"""
+        with self._expiry_lock:
+            if session.user_id not in self._scheduled:
+                self._scheduled[session.user_id] = session.last_activity
+                heapq.heappush(self._expiry_heap, (session.last_activity, session.user_id))
+
+    def _mark_dirty(self, user_id):
+        """Record that a user's session changed since the last snapshot"""
+        with self._dirty_lock:
+            self._dirty.add(user_id)
+
+    def get(self, user_id):
+        return self._sessions.get(user_id)
+
+    def get_or_create(self, user_id):
+        session = self._sessions.get(user_id)
+        if session is None:
+            with self.lock(user_id):
+                session = self._sessions.get(user_id)
+                if session is None:
+                    session = self._sessions[user_id] = UserSession(user_id)
+                    self._schedule(session)
+                    self._mark_dirty(user_id)
+        return session
+
+    def save(self, session):
+        # Records are mutated in place
+        with self.lock(session.user_id):
+            self._sessions[session.user_id] = session
+            self._schedule(session)
+            self._mark_dirty(session.user_id)
+
+    def touch(self, user_id, now):
+        session = self._sessions.get(user_id)
+        if session is not None:
+            session.last_activity = now
+            self._mark_dirty(user_id)
+
+    def delete(self, user_id):
+        with self.lock(user_id):
+            self._sessions.pop(user_id, None)
+            self._mark_dirty(user_id)
+            # Any heap entry left behind is discarded when it comes due
+            with self._expiry_lock:
+                self._scheduled.pop(user_id, None)
+
+    def expire(self, cutoff):
+        # Pop due entries first, then settle each one under its user's
+        # stripe lock so handler threads are never blocked by the sweep
+        due = []
+        with self._expiry_lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] < cutoff:
+                scheduled_at, user_id = heapq.heappop(heap)
+                if self._scheduled.get(user_id) == scheduled_at:
+                    due.append((scheduled_at, user_id))
+                # Otherwise a stale entry for a deleted or rescheduled session
+
+        expired = []
+        for scheduled_at, user_id in due:
+            with self.lock(user_id):
+                session = self._sessions.get(user_id)
+                with self._expiry_lock:
+                    if self._scheduled.get(user_id) != scheduled_at:
+                        continue  # Recreated or rescheduled meanwhile
+                    if session is None or session.last_activity < cutoff:
+                        del self._scheduled[user_id]
+                    else:
+                        # Active since this entry was pushed; reschedule at its real time
+                        self._scheduled[user_id] = session.last_activity
+                        heapq.heappush(self._expiry_heap, (session.last_activity, user_id))
+                        continue
+                if session is not None:
+                    del self._sessions[user_id]
+                    self._mark_dirty(user_id)
+                    expired.append(user_id)
+        return expired
+
+    def load(self, sessions):
+        """Bulk-insert sessions at startup, building the expiry heap in one go"""
+        for session in sessions:
+            self._sessions[session.user_id] = session
+            self._scheduled[session.user_id] = session.last_activity
+        self._expiry_heap = [(last_activity, user_id) for user_id, last_activity in self._scheduled.items()]
+        heapq.heapify(self._expiry_heap)
+
+    def drain_dirty(self):
+        """Get and reset the ids of users whose sessions changed or were removed"""
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def user_ids(self):
+        """Get a snapshot of the ids of all stored users"""
+        return list(self._sessions)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite database (WAL mode), shareable between processes"""
+
+    def __init__(self, path='sessions.db', lock_stripes=LOCK_STRIPES):
+        super().__init__(lock_stripes)
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " user_id INTEGER PRIMARY KEY,"
+            " last_activity REAL NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_last_activity"
+            " ON sessions (last_activity)"
+        )
+
+    def _conn(self):
+        """Get this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def lock(self, user_id):
+        """Hold a user's stripe lock and a write transaction
+
+        The transaction makes the locked section atomic across processes
+        sharing the database too. Nested locks join the outer transaction.
+        """
+        with super().lock(user_id):
+            conn = self._conn()
+            if conn.in_transaction:
+                yield
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def get(self, user_id):
+        row = self._conn().execute(
+            "SELECT last_activity, data FROM sessions WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[1])
+        data['last_activity'] = row[0]
+        return UserSession.from_dict(data)
+
+    def get_or_create(self, user_id):
+        session = self.get(user_id)
+        if session is None:
+            with self.lock(user_id):
+                session = self.get(user_id)
+                if session is None:
+                    session = UserSession(user_id)
+                    self.save(session)
+        return session
+
+    def save(self, session):
+        data = session.to_dict()
+        last_activity = data.pop('last_activity')
+        self._conn().execute(
+            "INSERT OR REPLACE INTO sessions (user_id, last_activity, data)"
+            " VALUES (?, ?, ?)",
+            (session.user_id, last_activity, json.dumps(data))
+        )
+
+    def touch(self, user_id, now):
+        self._conn().execute(
+            "UPDATE sessions SET last_activity = ? WHERE user_id = ?",
+            (now, user_id)
+        )
+
+    def delete(self, user_id):
+        self._conn().execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def expire(self, cutoff):
+        # Range delete on the last_activity index: cost follows expirations
+        rows = self._conn().execute(
+            "DELETE FROM sessions WHERE last_activity < ? RETURNING user_id",
+            (cutoff,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+# Global session storage
+_store = MemorySessionStore()
+
+def create_session_store(config):
+    """Build the session store selected in the config"""
+    if config.session_store == 'sqlite':
+        return SQLiteSessionStore(config.session_db_path)
+    return MemorySessionStore()
+
+def configure_session_store(store):
+    """Replace the global session store"""
+    global _store
+    _store = store
+
+def get_session_store():
+    """Get the global session store"""
+    return _store
 
 def get_or_create_session(user_id):
     """Get or create a session for a user"""
-    if user_id not in user_sessions:
-        user_sessions[user_id] = {
-            'last_activity': time.time(),
-            'active': True
-        }
-    else:
-        user_sessions[user_id]['last_activity'] = time.time()
-    return user_sessions[user_id]
+    with _store.lock(user_id):
+        session = _store.get_or_create(user_id)
+        session.active = True
+        session.last_activity = time.time()
+        _store.save(session)
+    return session
 
 def update_session_activity(user_id):
     """Update the last activity time for a user"""
-    if user_id in user_sessions:
-        user_sessions[user_id]['last_activity'] = time.time()
+    _store.touch(user_id, time.time())
 
 def clear_user_session(user_id):
     """Clear all session data for a user"""
-    if user_id in user_sessions:
-        del user_sessions[user_id]
-    if user_id in user_carts:
-        del user_carts[user_id]
-    if user_id in user_states:
-        del user_states[user_id]
-    # Clear the stored cart message ID
-    if user_id in user_cart_messages:
-        del user_cart_messages[user_id]
-    if user_id in user_order_messages:
-        del user_order_messages[user_id]
-    if user_id in user_checkout_messages:
-        del user_checkout_messages[user_id]
+    _store.delete(user_id)
 
 def is_session_expired(user_id):
     """Check if a user's session has expired"""
-    if user_id not in user_sessions:
+    session = _store.get(user_id)
+    if session is None or not session.active:
         return True
-    
-    last_activity = user_sessions[user_id]['last_activity']
-    return (time.time() - last_activity) > SESSION_TIMEOUT
+
+    return (time.time() - session.last_activity) > SESSION_TIMEOUT
 
 def session_cleanup_thread():
     """Background thread to clean up expired sessions"""
     while True:
-        time.sleep(60)  # Check every minute
-        
-        expired_users = []
-        for user_id, session in list(user_sessions.items()):
-            if is_session_expired(user_id):
-                expired_users.append(user_id)
-        
-        for user_id in expired_users:
-            clear_user_session(user_id)
+        time.sleep(SESSION_CLEANUP_INTERVAL)
+        _store.expire(time.time() - SESSION_TIMEOUT)
+
+def _update_session(user_id, **fields):
+    """Set fields on a user's session and save it"""
+    with _store.lock(user_id):
+        session = _store.get_or_create(user_id)
+        for name, value in fields.items():
+            setattr(session, name, value)
+        _store.save(session)
+    return session
+
+def _clear_session_field(user_id, name):
+    """Reset one field of a user's session, if they have one"""
+    with _store.lock(user_id):
+        session = _store.get(user_id)
+        if session is not None:
+            setattr(session, name, None)
+            _store.save(session)
+
+def _get_session_field(user_id, name):
+    """Read one field of a user's session, None if there is no session"""
+    session = _store.get(user_id)
+    return getattr(session, name) if session is not None else None
 
 def get_user_state(user_id):
     """Get the current state of a user"""
-    return user_states.get(user_id, None)
+    return _get_session_field(user_id, 'state')
 
 def set_user_state(user_id, state):
     """Set the state for a user"""
-    user_states[user_id] = state
-    update_session_activity(user_id)
+    _update_session(user_id, state=state, last_activity=time.time())
 
 def clear_user_state(user_id):
     """Clear the state for a user"""
-    if user_id in user_states:
-        del user_states[user_id]
+    _clear_session_field(user_id, 'state')
 
 def set_cart_message(user_id, message_id):
     """Store the message ID of the user's live cart"""
-    user_cart_messages[user_id] = message_id
+    _update_session(user_id, cart_message_id=message_id)
 
 def get_cart_message(user_id):
     """Get the message ID of the user's live cart"""
-    return user_cart_messages.get(user_id, None)
+    return _get_session_field(user_id, 'cart_message_id')
 
 def clear_cart_message(user_id):
     """Clear the stored cart message ID"""
-    if user_id in user_cart_messages:
-        del user_cart_messages[user_id]
+    _clear_session_field(user_id, 'cart_message_id')
 
 def set_order_message(user_id, message_id):
     """Store the message ID of the user's order message"""
-    user_order_messages[user_id] = message_id
+    _update_session(user_id, order_message_id=message_id)
 
 def get_order_message(user_id):
     """Get the message ID of the user's order message"""
-    return user_order_messages.get(user_id, None)
+    return _get_session_field(user_id, 'order_message_id')
 
 def set_checkout_message(user_id, message_id):
     """Store the message ID of the user's checkout message"""
-    user_checkout_messages[user_id] = message_id
+    _update_session(user_id, checkout_message_id=message_id)
 
 def get_checkout_message(user_id):
     """Get the message ID of the user's checkout message"""
-    return user_checkout_messages.get(user_id, None)
+    return _get_session_field(user_id, 'checkout_message_id')
+
+def start_checkout(user_id):
+    """Start collecting delivery details for a user"""
+    _update_session(user_id, checkout_data={})
+
+def set_checkout_field(user_id, field, value):
+    """Store one delivery detail collected during checkout"""
+    with _store.lock(user_id):
+        session = _store.get_or_create(user_id)
+        if session.checkout_data is None:
+            session.checkout_data = {}
+        session.checkout_data[field] = value
+        _store.save(session)
+
+def get_checkout_data(user_id):
+    """Get the delivery details collected so far, or None"""
+    return _get_session_field(user_id, 'checkout_data')
+
+def clear_checkout_data(user_id):
+    """Discard the delivery details collected during checkout"""
+    _clear_session_field(user_id, 'checkout_data')
+
+def take_checkout_data(user_id):
+    """Get and clear the delivery details in one step; None if already taken"""
+    with _store.lock(user_id):
+        session = _store.get(user_id)
+        if session is None or session.checkout_data is None:
+            return None
+        checkout_data, session.checkout_data = session.checkout_data, None
+        _store.save(session)
+    return checkout_data
+
+def restore_checkout_data(user_id, checkout_data):
+    """Undo take_checkout_data, unless a new checkout has started since"""
+    with _store.lock(user_id):
+        session = _store.get_or_create(user_id)
+        if session.checkout_data is None:
+            session.checkout_data = checkout_data
+            _store.save(session)
+
+def _tracked_message_ids(session):
+    """Get the ids of the messages the bot keeps editing for a session"""
+    return {session.cart_message_id, session.order_message_id, session.checkout_message_id} - {None}
+
+def get_message_fingerprint(user_id, message_id):
+    """Get the fingerprint of what a tracked message currently shows, or None"""
+    fingerprints = _get_session_field(user_id, 'message_fingerprints')
+    return fingerprints.get(str(message_id)) if fingerprints else None
+
+def set_message_fingerprint(user_id, message_id, fingerprint):
+    """Remember what a tracked message shows; ignored for untracked messages"""
+    with _store.lock(user_id):
+        session = _store.get(user_id)
+        if session is None:
+            return
+        tracked = _tracked_message_ids(session)
+        if message_id not in tracked:
+            return
+        # Keep entries for the currently tracked messages only
+        fingerprints = {
+            key: value for key, value in (session.message_fingerprints or {}).items()
+            if int(key) in tracked
+        }
+        fingerprints[str(message_id)] = fingerprint
+        session.message_fingerprints = fingerprints
+        _store.save(session)
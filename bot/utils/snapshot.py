@@ -0,0 +1,154 @@
+"""
+Warm-restart snapshots of in-memory sessions
+
+Sessions in a MemorySessionStore are persisted to an append-only binary
+log of pickled records: every pass appends the current record of each
+session that changed since the previous pass, or a tombstone for sessions
+that were removed. When the log grows well past the number of live
+sessions it is compacted into a fresh full snapshot and atomically
+swapped in.
+
+Each session is serialized under its own stripe lock and all file I/O
+happens outside the locks, so handler threads never wait on a snapshot.
+On startup the log is replayed (last record per user wins) to restore
+sessions, carts and checkout progress.
+"""
+import os
+import pickle
+import threading
+import time
+
+from bot.utils.session import SESSION_TIMEOUT, UserSession
+
+FIELDS = UserSession.__slots__
+
+
+class SessionSnapshotter:
+    """Periodically persists a MemorySessionStore to a local log file"""
+
+    def __init__(self, store, path, interval=5, compact_ratio=2.0, min_compact_entries=10000):
+        self.store = store
+        self.path = path
+        self.interval = interval
+        self.compact_ratio = compact_ratio
+        self.min_compact_entries = min_compact_entries
+        self._log = None
+        self._log_entries = 0
+
+    def _serialize(self, user_id):
+        """Get the log record for a user's current session, None if it is gone"""
+        with self.store.lock(user_id):
+            session = self.store.get(user_id)
+            if session is None:
+                return None
+            data = session.to_dict()
+            values = tuple(data[field] for field in FIELDS)
+            return pickle.dumps((user_id, values), protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _header():
+        # Field names are stored so older snapshots restore after a field change
+        return pickle.dumps(('fields', FIELDS), protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore(self):
+        """Load sessions from the snapshot log; returns the number restored"""
+        if not os.path.exists(self.path):
+            return 0
+
+        records = {}
+        entries = 0
+        fields = FIELDS
+        with open(self.path, 'r+b') as f:
+            while True:
+                valid_end = f.tell()
+                try:
+                    key, values = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception:
+                    # Torn final write from a crash: keep everything before it
+                    # and cut it off so new records aren't appended after it
+                    f.truncate(valid_end)
+                    break
+                entries += 1
+                if key == 'fields':
+                    fields = values
+                elif values is None:
+                    records.pop(key, None)
+                else:
+                    records[key] = values
+
+        cutoff = time.time() - SESSION_TIMEOUT
+        sessions = []
+        for values in records.values():
+            data = dict(zip(fields, values))
+            if data['last_activity'] >= cutoff:
+                sessions.append(UserSession.from_dict(data))
+
+        self.store.load(sessions)
+        self._log_entries = entries
+        return len(sessions)
+
+    def snapshot(self):
+        """Append every session changed since the last pass to the log"""
+        dirty = self.store.drain_dirty()
+        if not dirty:
+            return 0
+
+        records = []
+        for user_id in dirty:
+            record = self._serialize(user_id)
+            if record is None:
+                record = pickle.dumps((user_id, None), protocol=pickle.HIGHEST_PROTOCOL)
+            records.append(record)
+
+        if self._log is None:
+            self._log = open(self.path, 'ab')
+            if self._log.tell() == 0:
+                self._log.write(self._header())
+        self._log.write(b"".join(records))
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._log_entries += len(records)
+
+        threshold = max(self.min_compact_entries, len(self.store) * self.compact_ratio)
+        if self._log_entries > threshold:
+            self.compact()
+        return len(records)
+
+    def compact(self):
+        """Replace the log with a snapshot of only the live sessions"""
+        # Anything changing from here on is dirty again and lands in the new log
+        self.store.drain_dirty()
+        tmp_path = f"{self.path}.tmp"
+        count = 0
+        with open(tmp_path, 'wb') as f:
+            f.write(self._header())
+            for user_id in self.store.user_ids():
+                record = self._serialize(user_id)
+                if record is not None:
+                    f.write(record)
+                    count += 1
+            f.flush()
+            os.fsync(f.fileno())
+
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        os.replace(tmp_path, self.path)
+        self._log_entries = count
+
+    def run(self):
+        """Snapshot loop for a background thread"""
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.snapshot()
+            except Exception as e:
+                print(f"[snapshot] ERROR writing session snapshot: {e}")
+
+    def start(self):
+        """Start snapshotting in a daemon thread"""
+        thread = threading.Thread(target=self.run, name="session-snapshot", daemon=True)
+        thread.start()
+        return thread
@@ -8,8 +8,22 @@ from bot.config import Config
 from bot.handlers.commands import register_command_handlers
 from bot.handlers.cart import register_cart_handlers
 from bot.handlers.checkout import register_checkout_handlers
-from bot.utils.session import session_cleanup_thread
+from bot.utils.session import (
+    session_cleanup_thread, create_session_store, configure_session_store,
+    MemorySessionStore
+)
+from bot.utils.snapshot import SessionSnapshotter
+from bot.utils.dispatcher import UpdateDispatcher
+from bot.utils.router import Router
+from bot.utils.deletions import message_deletions
+from bot.services.outbox import Outbox
+from bot.services.payment_service import payment_sessions
+from bot.services.http_client import configure_http_clients
+from bot.services.order_service import (
+    create_order_journal, configure_order_journal, create_order_store, configure_order_store
+)
 from webhooks.app import create_flask_app
+from webhooks.telegram_handler import get_telegram_webhook_path
 import telebot
 import threading
 
@@ -22,20 +36,109 @@ def main():
     print(f"[DEBUG] Token length: {len(config.telegram_token) if config.telegram_token else 0}")
     print(f"[DEBUG] Has colon: {':' in config.telegram_token if config.telegram_token else False}")
     
-    # Initialize bot
+    # Keep-alive connection pools for Telegram, Stripe and Mailgun
+    configure_http_clients(config)
+    
+    # Created orders are group-committed to the order journal, and each
+    # commit is indexed in the order store
+    order_journal = create_order_journal(config)
+    order_store = create_order_store(config)
+    if order_store is not None:
+        caught_up = order_store.catch_up()
+        if caught_up:
+            print(f"Indexed {caught_up} orders from {config.order_journal_path}")
+        order_journal.add_listener(order_store.apply_commit)
+        configure_order_store(order_store)
+    order_journal.start()
+    configure_order_journal(order_journal)
+    
+    # Session storage shared by all handlers
+    session_store = create_session_store(config)
+    configure_session_store(session_store)
+    
+    # Restore in-memory sessions from the last run and keep snapshotting them
+    if isinstance(session_store, MemorySessionStore) and config.session_snapshot_path:
+        snapshotter = SessionSnapshotter(
+            session_store,
+            config.session_snapshot_path,
+            interval=config.session_snapshot_interval
+        )
+        restored = snapshotter.restore()
+        print(f"Restored {restored} sessions from {config.session_snapshot_path}")
+        snapshotter.start()
+    
+    # Initialize bot. Handlers run on the dispatcher's workers, so telebot's
+    # own thread pool stays disabled.
     bot = telebot.TeleBot(config.telegram_token, threaded=False)
     
-    # Register all handlers
-    register_command_handlers(bot, config)
-    register_cart_handlers(bot, config)
-    register_checkout_handlers(bot, config)
+    # Register all handlers. Callbacks and plain text messages are resolved
+    # by the router; only /commands are matched by telebot itself.
+    router = Router()
+    register_command_handlers(bot, config, router)
+    register_cart_handlers(bot, config, router)
+    register_checkout_handlers(bot, config, router)
+    router.install(bot)
+    
+    # Tidy-up deletions are batched per chat and sent off the handler threads
+    message_deletions.delay = config.delete_batch_delay
+    message_deletions.start()
+    
+    # Shard updates by user onto the dispatcher's worker pool
+    dispatcher = UpdateDispatcher(
+        bot,
+        workers=config.dispatch_workers,
+        queue_size=config.dispatch_queue_size
+    )
+    dispatcher.start()
+    dispatcher.attach()
+    
+    engine = None
+    if config.bot_engine == 'async':
+        from bot.async_engine import AsyncEngine
+        engine = AsyncEngine(bot, dispatcher, connection_limit=config.async_connection_limit)
+        engine.start()
+        # Stripe sessions are created on the engine's loop too
+        payment_sessions.use_engine(engine)
+    
+    # Rate-limit outbound API calls (installed after the engine so it wraps
+    # the engine's request sender)
+    outbox = None
+    if config.outbox_global_rate > 0:
+        outbox = Outbox(
+            global_rate=config.outbox_global_rate,
+            chat_rate=config.outbox_chat_rate,
+            chat_burst=config.outbox_chat_burst,
+            max_wait=config.outbox_max_wait
+        )
+        outbox.install()
+    
+    # Watch config.json for catalog changes
+    if config.config_reload_interval > 0:
+        config.start_catalog_watcher()
     
     # Start session cleanup thread
     cleanup_thread = threading.Thread(target=session_cleanup_thread, daemon=True)
     cleanup_thread.start()
     
+    flask_app = create_flask_app(bot, config, dispatcher, outbox, engine)
+    
+    if config.telegram_mode == 'webhook':
+        if not config.telegram_webhook_secret or not config.public_url:
+            raise RuntimeError("Webhook mode needs TELEGRAM_WEBHOOK_SECRET and PUBLIC_URL")
+        
+        # Telegram pushes updates to the Flask app; no polling loop needed
+        webhook_url = f"{config.public_url}{get_telegram_webhook_path(config)}"
+        bot.remove_webhook()
+        bot.set_webhook(url=webhook_url, secret_token=config.telegram_webhook_secret)
+        
+        print(f"Bot started successfully (webhook mode)")
+        print(f"Flask webhook server running on {config.flask_host}:{config.flask_port}")
+        print(f"Dispatching updates on {dispatcher.workers} workers ({config.bot_engine} engine)")
+        
+        flask_app.run(host=config.flask_host, port=config.flask_port, debug=False)
+        return
+    
     # Start Flask webhook server in separate thread
-    flask_app = create_flask_app(bot, config)
     flask_thread = threading.Thread(
         target=lambda: flask_app.run(
             host=config.flask_host,
@@ -48,9 +151,14 @@ def main():
     
     print(f"Bot started successfully")
     print(f"Flask webhook server running on {config.flask_host}:{config.flask_port}")
+    print(f"Dispatching updates on {dispatcher.workers} workers ({config.bot_engine} engine)")
     
     # Start polling
-    bot.infinity_polling()
+    if engine is not None:
+        engine.run_polling()
+    else:
+        bot.remove_webhook()
+        bot.infinity_polling()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,68 @@
+"""
+Benchmark: callback_data size and click resolution for large catalogs
+
+Builds a synthetic catalog of emoji-named products and compares the old
+"prod_<name>" callback_data (prefix slice plus name lookup) with the
+compact "p:<version>:<id>" encoding, including how many products would
+exceed Telegram's 64-byte callback_data limit and how fast stale buttons
+are rejected.
+
+Usage:
+    python scripts/bench_callbacks.py [--products 50000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.catalog import Catalog
+
+CALLBACK_DATA_LIMIT = 64
+
+
+def build_products(count, categories=100):
+    products = {}
+    for i in range(count):
+        category = f"🍕 Category {i % categories}"
+        name = f"🍕 Stone-baked Margherita with Buffalo Mozzarella No. {i}"
+        products.setdefault(category, {})[name] = f"{i % 50 + 1}.99"
+    return products
+
+
+def timed(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return (time.perf_counter() - start) / len(items) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--products', type=int, default=50000)
+    args = parser.parse_args()
+
+    catalog = Catalog(build_products(args.products))
+    stale = Catalog(build_products(args.products + 1))
+    products = list(catalog.products.values())
+
+    legacy = [f"prod_{product.name}" for product in products]
+    compact = [catalog.product_callback(product) for product in products]
+    old_buttons = [stale.product_callback(product) for product in stale.products.values()]
+
+    for name, data in (('prod_<name>', legacy), ('p:<ver>:<id>', compact)):
+        sizes = [len(d.encode('utf-8')) for d in data]
+        too_long = sum(size > CALLBACK_DATA_LIMIT for size in sizes)
+        print(f"{name:>13}: max {max(sizes)} bytes, {too_long} of {len(data)} over the limit")
+
+    lookup = catalog.products.get
+    print(f"{'name lookup':>13}: {timed(lambda d: lookup(d[5:]), legacy):.2f} us/click")
+    print(f"{'id decode':>13}: {timed(catalog.decode_product, compact):.2f} us/click")
+    print(f"{'stale reject':>13}: {timed(catalog.decode_product, old_buttons):.2f} us/click")
+    assert all(catalog.decode_product(d) is p for d, p in zip(compact, products))
+    assert all(catalog.decode_product(d) is None for d in old_buttons)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark: click-to-render cost for carts of 1 to 1,000 distinct lines
+
+Simulates a product click the way handle_product_selection handles one:
+add a unit, read the item count and total, then render the cart message.
+The plain dict cart walks every line for the count and again for the
+total; the Cart keeps both as running aggregates. The catalog is swapped
+for a re-priced one halfway through to include re-pricing.
+
+Usage:
+    python scripts/bench_cart_render.py [--clicks 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.cart import Cart
+from bot.catalog import Catalog
+from bot.utils.formatting import format_cart_message
+
+SIZES = (1, 10, 100, 1000)
+
+
+def build_catalog(lines, price):
+    return Catalog({'Bench': {f"Product {i}": price for i in range(lines)}})
+
+
+def dict_aggregates(cart, catalog):
+    count = sum(cart.values())
+    total = sum(catalog.price_minor(name) * quantity for name, quantity in cart.items())
+    return count, total
+
+
+def cart_aggregates(cart, catalog):
+    return cart.count, cart.total_minor(catalog)
+
+
+def dict_add(cart, name):
+    cart[name] = cart.get(name, 0) + 1
+
+
+def click(cart, add, aggregates, catalogs, clicks, render):
+    names = list(catalogs[0].products)
+    start = time.perf_counter()
+    for i in range(clicks):
+        catalog = catalogs[i * 2 // clicks]
+        add(cart, names[i % len(names)])
+        count, total = aggregates(cart, catalog)
+        if render:
+            # As the handlers do: the total shown is the one just read
+            format_cart_message(cart, catalog, catalog.currency, total)
+    return (time.perf_counter() - start) / clicks * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clicks', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'lines':>6} {'dict agg':>10} {'Cart agg':>10} {'dict click':>12} {'Cart click':>12}  (us)")
+    for size in SIZES:
+        catalogs = (build_catalog(size, '1.99'), build_catalog(size, '2.49'))
+        lines = {name: 1 for name in catalogs[0].products}
+        results = []
+        for render in (False, True):
+            results.append(click(dict(lines), dict_add, dict_aggregates, catalogs, args.clicks, render))
+            results.append(click(Cart(lines), Cart.add, cart_aggregates, catalogs, args.clicks, render))
+        print(f"{size:>6} {results[0]:>10.2f} {results[1]:>10.2f} {results[2]:>12.1f} {results[3]:>12.1f}")
+
+        check = Cart(lines)
+        check.add(next(iter(lines)))
+        assert cart_aggregates(check, catalogs[1]) == dict_aggregates(check.to_dict(), catalogs[1])
+
+
+if __name__ == "__main__":
+    main()
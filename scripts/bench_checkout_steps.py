@@ -0,0 +1,101 @@
+"""
+Benchmark: checkout step handler latency, inline vs batched deletions
+
+Starts a local fake Bot API with a fixed response latency, registers the
+real handlers and walks each simulated customer through the checkout
+address flow (name, street, city, postcode). Inline mode deletes each
+typed answer inside the handler, as the bot used to; batched mode goes
+through the DeleteQueue. Reports handler latency per checkout step and
+the delete API calls made.
+
+Usage:
+    python scripts/bench_checkout_steps.py [--users 20] [--latency 0.05]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telebot
+
+import bot.handlers.checkout as checkout_handlers
+from bot.config import Config
+from bot.handlers.commands import register_command_handlers
+from bot.handlers.cart import register_cart_handlers, live_cart_edits
+from bot.handlers.checkout import register_checkout_handlers
+from bot.utils.deletions import DeleteQueue
+from bot.utils.router import Router
+from scripts.fake_telegram import FakeBotAPI, Updates, start_fake_api
+
+
+class InlineDeletes:
+    """Deletes as the handlers used to: one blocking call per message"""
+
+    def delete(self, bot, chat_id, message_id):
+        try:
+            bot.delete_message(chat_id, message_id)
+        except Exception:
+            pass
+
+    def join(self, timeout=None):
+        return True
+
+
+STEPS = ('name', 'street', 'city', 'postcode')
+
+
+def run(config, deletions, users):
+    """Walk every user through checkout; returns handler seconds per step"""
+    bot = telebot.TeleBot('123:bench', threaded=False)
+    router = Router()
+    register_command_handlers(bot, config, router)
+    register_cart_handlers(bot, config, router)
+    register_checkout_handlers(bot, config, router)
+    router.install(bot)
+    checkout_handlers.message_deletions = deletions
+
+    catalog = config.catalog
+    product = catalog.products_in_category(catalog.categories[0])[0]
+    timings = {step: [] for step in STEPS}
+    for user_id in range(1, users + 1):
+        updates = Updates(user_id)
+        bot.process_new_updates([updates.callback(catalog.product_callback(product))])
+        bot.process_new_updates([updates.callback('checkout')])
+        for step, answer in zip(STEPS, ('A Customer', '1 High Street', 'London', 'n1 1aa')):
+            update = updates.text(answer)
+            start = time.perf_counter()
+            bot.process_new_updates([update])
+            timings[step].append(time.perf_counter() - start)
+    live_cart_edits.join(timeout=10)
+    deletions.join(timeout=10)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help="Fake API latency in seconds")
+    args = parser.parse_args()
+
+    FakeBotAPI.latency = args.latency
+    server = start_fake_api()
+    config = Config()
+
+    batched = DeleteQueue(delay=0.2)
+    batched.start()
+    for name, deletions in (('inline', InlineDeletes()), ('batched', batched)):
+        FakeBotAPI.reset()
+        timings = run(config, deletions, args.users)
+        steps = " | ".join(
+            f"{step} {sorted(values)[len(values) // 2] * 1000:.0f}ms" for step, values in timings.items()
+        )
+        print(f"{name:>8}: p50 {steps} | deleteMessage {FakeBotAPI.calls.get('deleteMessage', 0)}, "
+              f"deleteMessages {FakeBotAPI.calls.get('deleteMessages', 0)}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark: live cart edits under click bursts, direct vs coalesced
+
+Each simulated chat taps "add" in bursts (several clicks a few tens of
+milliseconds apart). Direct mode edits the cart message on every click,
+as the bot used to; coalesced mode goes through EditCoalescer. Reports
+the edits sent and checks every chat's final message shows its last
+cart state.
+
+Usage:
+    python scripts/bench_coalescer.py [--chats 200] [--clicks 10] [--gap 0.03]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils.coalescer import EditCoalescer
+
+
+class FakeChats:
+    """Cart counters and the message each chat currently shows"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.carts = {}
+        self.shown = {}
+        self.edits = 0
+
+    def click(self, chat_id):
+        with self.lock:
+            self.carts[chat_id] = self.carts.get(chat_id, 0) + 1
+
+    def edit(self, chat_id):
+        with self.lock:
+            self.edits += 1
+            self.shown[chat_id] = self.carts[chat_id]
+
+
+def run(chats, clicks, gap, coalescer):
+    fake = FakeChats()
+
+    def user(chat_id):
+        for _ in range(clicks):
+            fake.click(chat_id)
+            if coalescer is None:
+                fake.edit(chat_id)
+            else:
+                coalescer.submit(chat_id, lambda: fake.edit(chat_id))
+            time.sleep(gap)
+
+    threads = [threading.Thread(target=user, args=(chat_id,)) for chat_id in range(chats)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if coalescer is not None:
+        coalescer.join()
+    elapsed = time.perf_counter() - start
+    stale = sum(fake.shown.get(chat_id) != fake.carts[chat_id] for chat_id in range(chats))
+    return fake.edits, stale, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--clicks', type=int, default=10)
+    parser.add_argument('--gap', type=float, default=0.03, help="Seconds between clicks")
+    parser.add_argument('--window', type=float, default=1.0)
+    args = parser.parse_args()
+
+    coalescer = EditCoalescer(window=args.window, name="bench")
+    coalescer.start()
+    for name, mode in (('direct', None), ('coalesced', coalescer)):
+        edits, stale, elapsed = run(args.chats, args.clicks, args.gap, mode)
+        print(f"{name:>9}: {edits} edits for {args.chats * args.clicks} clicks "
+              f"({edits / args.chats:.1f} per chat), {stale} chats showing a stale cart, "
+              f"settled in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Benchmark: confirm_order handler latency, blocking vs background Stripe sessions
+
+Starts a local stand-in for the Bot API and Stripe (Stripe answering
+after a slower, fixed delay), registers the real handlers and walks each
+simulated customer through checkout up to "Confirm & Pay", then has them
+all confirm back to back. Blocking mode creates the checkout session
+inside the handler, as the bot used to; background mode goes through the
+PaymentSessionWorker's pool (--workers threads), and async mode has it
+create sessions on the async engine's event loop, which then also
+carries the Bot API calls. Every customer taps Confirm twice.
+
+Reports the handler latency of confirm_order and the time from Confirm
+to the Pay Now button, and checks every customer ends up with a Pay Now
+button, that the second tap created no second order and that each
+payment attempt used one idempotency key. The stand-in replays a key's
+first response, as Stripe does; with --fail-first that is a 500 for each
+order's first attempt, so the client's retries fail too and the customer
+has to tap Try Again, which must get a fresh key and a session.
+
+Usage:
+    python scripts/bench_confirm_order.py [--users 20] [--workers 4] [--latency 0.05] [--stripe-latency 0.5]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stripe
+import telebot
+
+import bot.handlers.checkout as checkout_handlers
+from bot.async_engine import AsyncEngine
+from bot.config import Config
+from bot.handlers.commands import register_command_handlers
+from bot.handlers.cart import register_cart_handlers, live_cart_edits
+from bot.handlers.checkout import register_checkout_handlers
+from bot.services.cart_service import get_cart
+from bot.services.http_client import configure_http_clients
+from bot.services.order_journal import OrderJournal
+from bot.services.order_service import configure_order_journal, configure_order_store
+from bot.services.payment_service import payment_sessions
+from bot.utils.deletions import message_deletions
+from bot.utils.keyboards import RETRY_PAYMENT_CALLBACK_PREFIX
+from bot.utils.router import Router
+from scripts.fake_telegram import FakeBotAPI, Updates, start_fake_api
+
+
+class StandInAPI(FakeBotAPI):
+    """The fake Bot API plus Stripe checkout sessions, answered after a slower delay"""
+    stripe_latency = 0.5
+    fail_first = False
+
+    @classmethod
+    def reset(cls):
+        super().reset()
+        cls.keys = {}
+        cls.responses = {}
+        cls.pay_now = {}
+        cls.retry = {}
+
+    def answer(self, path, query, body):
+        if not path.startswith('/v1/checkout/sessions'):
+            return super().answer(path, query, body)
+
+        time.sleep(self.stripe_latency)
+        key = self.headers.get('Idempotency-Key')
+        order_id = key.rsplit('-', 1)[0] if key else None
+        with StandInAPI.lock:
+            StandInAPI.keys[key] = StandInAPI.keys.get(key, 0) + 1
+            if key not in StandInAPI.responses:
+                first_attempt = not any(other.startswith(order_id + '-') for other in StandInAPI.responses)
+                if self.fail_first and first_attempt:
+                    response = (500, {'error': {'type': 'api_error', 'message': 'Stand-in failure'}})
+                else:
+                    response = (200, {'id': 'cs_test_1', 'object': 'checkout.session',
+                                      'url': 'https://checkout.stripe.com/c/pay/cs_test_1'})
+                StandInAPI.responses[key] = response
+            status, payload = StandInAPI.responses[key]
+        self.send_json(payload, status)
+
+    def on_call(self, method, params):
+        if method == 'editMessageText':
+            chat_id = int(params['chat_id'][0])
+            markup = params.get('reply_markup', [''])[0]
+            if 'checkout.stripe.com' in markup:
+                StandInAPI.pay_now.setdefault(chat_id, time.perf_counter())
+            retry = re.search(re.escape(RETRY_PAYMENT_CALLBACK_PREFIX) + r'[\w-]+', markup)
+            if retry:
+                StandInAPI.retry[chat_id] = retry.group(0)
+
+
+class BlockingPayments:
+    """Creates sessions as the handler used to: inside the handler call"""
+
+    def submit(self, key, create, on_ready, on_failed, on_slow=None, create_async=None):
+        try:
+            session = create()
+        except Exception as e:
+            on_failed(e)
+        else:
+            on_ready(session)
+        return True
+
+    def join(self, timeout=None):
+        return True
+
+
+def run(config, payments, users):
+    """Check every user out; returns confirm_order handler seconds and Confirm to Pay Now seconds per user"""
+    bot = telebot.TeleBot('123:bench', threaded=False)
+    router = Router()
+    checkout_handlers.payment_sessions = payment_sessions
+    register_command_handlers(bot, config, router)
+    register_cart_handlers(bot, config, router)
+    register_checkout_handlers(bot, config, router)
+    router.install(bot)
+    checkout_handlers.payment_sessions = payments
+
+    catalog = config.catalog
+    product = catalog.products_in_category(catalog.categories[0])[0]
+    timings = []
+    confirmed = {}
+    customers = {}
+    for user_id in range(1, users + 1):
+        updates = customers[user_id] = Updates(user_id, username='bench')
+        bot.process_new_updates([updates.callback(catalog.product_callback(product))])
+        bot.process_new_updates([updates.callback('checkout')])
+        for answer in ('A Customer', '1 High Street', 'London', 'n1 1aa'):
+            bot.process_new_updates([updates.text(answer)])
+    # Everyone confirms at once, as after a promotion goes out
+    for user_id, updates in customers.items():
+        update = updates.callback('confirm_order')
+        start = confirmed[user_id] = time.perf_counter()
+        bot.process_new_updates([update])
+        timings.append(time.perf_counter() - start)
+        assert not get_cart(user_id), "the cart outlived its order"
+        # An impatient second tap must not order again
+        bot.process_new_updates([updates.callback('confirm_order')])
+    payments.join(timeout=60)
+    # Customers whose payment failed tap Try Again
+    for user_id, data in sorted(StandInAPI.retry.items()):
+        bot.process_new_updates([customers[user_id].callback(data)])
+    payments.join(timeout=60)
+    live_cart_edits.join(timeout=10)
+    message_deletions.join(timeout=10)
+    waits = [StandInAPI.pay_now[user_id] - start for user_id, start in confirmed.items()
+             if user_id in StandInAPI.pay_now]
+    return timings, waits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=4, help="Payment pool threads")
+    parser.add_argument('--latency', type=float, default=0.05, help="Bot API latency in seconds")
+    parser.add_argument('--stripe-latency', type=float, default=0.5, help="Stripe latency in seconds")
+    parser.add_argument('--fail-first', action='store_true', help="Fail each order's first Stripe request")
+    args = parser.parse_args()
+
+    StandInAPI.latency = args.latency
+    StandInAPI.stripe_latency = args.stripe_latency
+    StandInAPI.fail_first = args.fail_first
+    server = start_fake_api(StandInAPI)
+    stripe.api_base = f"http://127.0.0.1:{server.server_port}"
+
+    config = Config()
+    config.stripe_secret_key = 'sk_test_bench'
+    config.payment_workers = args.workers
+    configure_http_clients(config)
+    message_deletions.start()
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout, stdout = devnull, sys.stdout
+        try:
+            for name, payments in (('blocking', BlockingPayments()), ('background', payment_sessions),
+                                   ('async', payment_sessions)):
+                engine = None
+                if name == 'async':
+                    engine = AsyncEngine(None, None)
+                    engine.start()
+                    payment_sessions.use_engine(engine)
+                journal = OrderJournal(os.devnull, durable=False)
+                journal.start()
+                configure_order_journal(journal)
+                configure_order_store(None)
+                StandInAPI.reset()
+                timings, waits = map(sorted, run(config, payments, args.users))
+                if engine is not None:
+                    payment_sessions.use_engine(None)
+                    engine.run(stripe.default_http_client.close_async())
+                    engine.stop()
+                stripe_requests = sum(StandInAPI.keys.values())
+                orders = {key.rsplit('-', 1)[0] for key in StandInAPI.keys if key}
+                print(f"{name:>10}: confirm_order p50 {timings[len(timings) // 2] * 1000:.0f}ms "
+                      f"max {timings[-1] * 1000:.0f}ms | Pay Now shown to {len(StandInAPI.pay_now)}/{args.users}, "
+                      f"after p50 {waits[len(waits) // 2] * 1000:.0f}ms max {waits[-1] * 1000:.0f}ms | "
+                      f"{len(orders)} orders, {stripe_requests} Stripe requests, "
+                      f"{len(StandInAPI.keys)} idempotency keys", file=stdout)
+                assert len(StandInAPI.pay_now) == args.users, "a customer never got a Pay Now button"
+                assert len(orders) == args.users, "a second tap on Confirm created another order"
+                attempts = 2 if args.fail_first else 1
+                assert None not in StandInAPI.keys and len(StandInAPI.keys) == attempts * args.users
+        finally:
+            sys.stdout = stdout
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Compare the sync and async engines on the same update stream
+
+Starts a local fake Bot API server with a fixed response latency, points
+telebot at it, registers the real handlers and has each engine poll the
+same update stream from it (TeleBot's polling loop for sync, the
+engine's run_polling for async) into the dispatcher, reporting the time
+taken to drain it. Also checks that every user's updates were handled in
+the order they were sent, and that both engines send parameters the way
+telebot's requests sender does: in the query string, with an empty body.
+
+Usage (from the repository root):
+    python scripts/bench_engines.py [--updates recorded.jsonl] [--users 200]
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telebot
+from telebot import apihelper
+
+from bot.config import Config
+from bot.handlers.commands import register_command_handlers
+from bot.handlers.cart import register_cart_handlers, live_cart_edits
+from bot.handlers.checkout import register_checkout_handlers
+from bot.utils.deletions import message_deletions
+from bot.utils.dispatcher import UpdateDispatcher
+from bot.utils.router import Router
+from bot.async_engine import AsyncEngine
+from scripts.fake_telegram import FakeBotAPI, Updates, start_fake_api
+
+
+def synthetic_updates(config, users):
+    """Build a browse-and-add-to-cart stream for a number of users"""
+    updates = []
+    ids = itertools.count(1)
+    catalog = config.catalog
+    category = catalog.categories[0]
+    product = catalog.products_in_category(category)[0]
+    for user_id in range(1, users + 1):
+        user = Updates(user_id, ids)
+        updates.append(user.text_json('/start'))
+        updates.append(user.text_json('🛍️ Browse Products'))
+        updates.append(user.callback_json(catalog.category_callback(category)))
+        for _ in range(3):
+            updates.append(user.callback_json(catalog.product_callback(product)))
+        updates.append(user.text_json('📦 View Cart'))
+    return updates
+
+
+def run_engine(engine_name, raw_updates, config, workers, queue_size):
+    """Drain the update stream with one engine and return elapsed seconds"""
+    bot = telebot.TeleBot('123:bench', threaded=False)
+    router = Router()
+    register_command_handlers(bot, config, router)
+    register_cart_handlers(bot, config, router)
+    register_checkout_handlers(bot, config, router)
+    router.install(bot)
+    message_deletions.start()
+
+    # Record the order each user's updates reach the handlers in
+    handled = {}
+
+    @bot.middleware_handler()
+    def record_order(bot_instance, update):
+        event = update.message or update.callback_query
+        handled.setdefault(event.from_user.id, []).append(update.update_id)
+
+    dispatcher = UpdateDispatcher(bot, workers=workers, queue_size=queue_size)
+    dispatcher.start()
+
+    engine = None
+    if engine_name == 'async':
+        engine = AsyncEngine(bot, dispatcher)
+        engine.start()
+        poll, stop_polling = engine.run_polling, engine.stop_polling
+    else:
+        dispatcher.attach()
+        poll = lambda: bot.polling(non_stop=True, interval=0, timeout=1)
+        stop_polling = bot.stop_polling
+
+    FakeBotAPI.updates = raw_updates
+    start = time.perf_counter()
+    poller = threading.Thread(target=poll, daemon=True)
+    poller.start()
+    while dispatcher.stats()['processed'] < len(raw_updates):
+        assert poller.is_alive(), f"{engine_name} polling stopped early"
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    stop_polling()
+    poller.join(timeout=10)
+    # Let coalesced live cart edits and batched deletions land before the
+    # fake API goes away
+    live_cart_edits.join(timeout=10)
+    message_deletions.join(timeout=10)
+
+    if engine is not None:
+        engine.stop()
+    out_of_order = sum(1 for ids in handled.values() if ids != sorted(ids))
+    return elapsed, out_of_order
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--updates', help="Recorded updates (JSON lines); synthetic if omitted")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--queue-size', type=int, default=100,
+                        help="Dispatcher shard capacity; polling waits while a shard is full")
+    parser.add_argument('--latency', type=float, default=0.05, help="Fake API latency in seconds")
+    args = parser.parse_args()
+
+    config = Config()
+    if args.updates:
+        with open(args.updates, 'r', encoding='utf-8') as f:
+            raw_updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        raw_updates = synthetic_updates(config, args.users)
+
+    FakeBotAPI.latency = args.latency
+    server = start_fake_api()
+    apihelper.ENABLE_MIDDLEWARE = True
+
+    for engine_name in ('sync', 'async'):
+        FakeBotAPI.reset()
+        elapsed, out_of_order = run_engine(engine_name, [dict(u) for u in raw_updates], config,
+                                           args.workers, args.queue_size)
+        print(f"{engine_name:>5}: {len(raw_updates)} updates in {elapsed:.2f}s "
+              f"({len(raw_updates) / elapsed:.0f} updates/s), {FakeBotAPI.requests} requests")
+        assert not out_of_order, f"{out_of_order} users had updates handled out of order"
+        assert not FakeBotAPI.misplaced, f"{FakeBotAPI.misplaced} requests without their parameters in the query string"
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
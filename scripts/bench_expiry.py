@@ -0,0 +1,65 @@
+"""
+Benchmark: session expiry sweep cost at 1M sessions
+
+Fills a MemorySessionStore with sessions whose activity times are spread
+over the timeout window, so only a small fraction is due at each sweep,
+then times one heap-based sweep against the previous full-scan sweep.
+
+Usage:
+    python scripts/bench_expiry.py [--sessions 1000000] [--due 0.01]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils.session import MemorySessionStore, SESSION_TIMEOUT, UserSession
+
+
+def populate(sessions, due_fraction, now):
+    store = MemorySessionStore()
+    due = int(sessions * due_fraction)
+    for user_id in range(sessions):
+        if user_id < due:
+            last_activity = now - SESSION_TIMEOUT - random.random() * 60
+        else:
+            last_activity = now - random.random() * (SESSION_TIMEOUT - 60)
+        store.save(UserSession(user_id, last_activity))
+    return store
+
+
+def full_scan_sweep(store, cutoff):
+    """The previous cleanup: copy and check every session"""
+    expired = [
+        user_id for user_id, session in list(store._sessions.items())
+        if session.last_activity < cutoff
+    ]
+    for user_id in expired:
+        store.delete(user_id)
+    return expired
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=1000000)
+    parser.add_argument('--due', type=float, default=0.01)
+    args = parser.parse_args()
+
+    now = time.time()
+    cutoff = now - SESSION_TIMEOUT
+    random.seed(1)
+
+    for name, sweep in (('full scan', full_scan_sweep),
+                        ('expiry heap', lambda store, cutoff: store.expire(cutoff))):
+        store = populate(args.sessions, args.due, now)
+        start = time.perf_counter()
+        expired = sweep(store, cutoff)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>11}: expired {len(expired)} of {args.sessions} in {elapsed * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
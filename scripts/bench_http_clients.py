@@ -0,0 +1,166 @@
+"""
+Benchmark: checkout session creation and receipt delivery, default vs pooled HTTP clients
+
+A local stand-in server plays the Stripe, Mailgun and Telegram APIs. It
+speaks HTTP/1.1 keep-alive and delays every new connection by
+--connect-delay seconds to stand in for the TCP and TLS handshakes a real
+connection to those APIs costs. Checkout sessions are created from a
+small pool of long-lived worker threads, like the update dispatcher;
+receipts (Telegram message plus Mailgun email) are each delivered from a
+fresh thread, like Flask's per-request threads for the Stripe webhook.
+
+Usage:
+    python scripts/bench_http_clients.py [--calls 200] [--connect-delay 0.02]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+import stripe
+import telebot
+from telebot import apihelper
+
+from bot.config import Config
+from bot.services import http_client
+from bot.services.email_service import send_payment_confirmation_email
+from bot.services.payment_service import create_payment_session
+
+
+class StandInAPI(BaseHTTPRequestHandler):
+    """Stripe, Mailgun and Telegram endpoints with a per-connection setup cost"""
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, Nagle plus
+    # delayed ACKs add ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+    connect_delay = 0.0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        with StandInAPI.lock:
+            StandInAPI.connections += 1
+        time.sleep(self.connect_delay)
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        path = self.path.split('?', 1)[0]
+        if path.startswith('/v1/checkout/sessions'):
+            payload = {'id': 'cs_test_1', 'object': 'checkout.session',
+                       'url': 'https://checkout.stripe.com/c/pay/cs_test_1'}
+        elif path.endswith('/messages'):
+            payload = {'id': '<1@mailgun>', 'message': 'Queued. Thank you.'}
+        else:
+            payload = {'ok': True, 'result': {
+                'message_id': 1, 'date': 0, 'text': 'receipt',
+                'chat': {'id': 1, 'type': 'private'}
+            }}
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+class OneShotSession:
+    """Mailgun client as it was: requests.post, a new connection per call"""
+    post = staticmethod(requests.post)
+
+
+ORDER = {
+    'order_id': 'ORD1', 'user_id': 1, 'username': 'bench', 'name': 'A',
+    'address_line1': 'B', 'city': 'C', 'postcode': 'D', 'currency': 'GBP',
+    'items': {'10 Pack': {'quantity': 2, 'unit_amount': 500}}, 'total': 10.0
+}
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return (samples[len(samples) // 2] * 1000,
+            samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000)
+
+
+def run(config, bot, calls):
+    """Time checkout sessions on a worker pool and receipts on fresh threads"""
+    def checkout():
+        start = time.perf_counter()
+        create_payment_session(ORDER, 'sk_test_bench', 'http://x/success', 'http://x/cancel')
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        checkout_times = list(pool.map(lambda _: checkout(), range(calls)))
+
+    receipt_times = []
+
+    def receipt():
+        start = time.perf_counter()
+        bot.send_message(1, "receipt")
+        with contextlib.redirect_stdout(io.StringIO()):
+            send_payment_confirmation_email(ORDER, config)
+        receipt_times.append(time.perf_counter() - start)
+
+    for _ in range(calls):
+        thread = threading.Thread(target=receipt)
+        thread.start()
+        thread.join()
+    return percentiles(checkout_times), percentiles(receipt_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--connect-delay', type=float, default=0.02,
+                        help="Seconds added to every new connection (handshake stand-in)")
+    args = parser.parse_args()
+
+    StandInAPI.connect_delay = args.connect_delay
+    ThreadingHTTPServer.request_queue_size = 256
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    config = Config()
+    config.mailgun_api_key = 'key-bench'
+    config.mailgun_domain = 'mg.example.com'
+    config.mailgun_api_base = base
+    stripe.api_base = base
+    apihelper.API_URL = base + "/bot{0}/{1}"
+    bot = telebot.TeleBot('123:bench', threaded=False)
+
+    # Default clients: telebot's per-thread sessions, Stripe's own client,
+    # a fresh connection per Mailgun call
+    http_client._sessions['mailgun'] = OneShotSession()
+    results = []
+    for name in ('default', 'pooled'):
+        if name == 'pooled':
+            http_client.configure_http_clients(config)
+        StandInAPI.connections = 0
+        (checkout_p50, checkout_p99), (receipt_p50, receipt_p99) = run(config, bot, args.calls)
+        results.append(f"{name:>8}: checkout p50 {checkout_p50:5.1f}ms p99 {checkout_p99:5.1f}ms | "
+                       f"receipt p50 {receipt_p50:5.1f}ms p99 {receipt_p99:5.1f}ms | "
+                       f"{StandInAPI.connections} connections opened")
+    print("\n".join(results))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
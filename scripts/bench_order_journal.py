@@ -0,0 +1,107 @@
+"""
+Benchmark: orders/second at 1, 10 and 100 concurrent confirmers
+
+Each confirmer thread records orders back to back. 'csv' appends every
+order the way save_order_to_csv did: check the file exists, open it,
+write one row and close it, without fsync; 'csv-fsync' also fsyncs each
+order, the price of per-order durability. 'journal' goes through
+OrderJournal, waiting for each order's fsync; 'journal-async' does not
+wait. Every run checks that all orders were written as whole records.
+
+Usage:
+    python scripts/bench_order_journal.py [--orders 2000] [--confirmers 1 10 100]
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.services.order_journal import OrderJournal, read_journal
+from bot.services.order_service import CSV_FIELDS, order_csv_row, generate_order_id
+
+
+def order(user_id):
+    return {
+        'order_id': generate_order_id(), 'timestamp': '2024-05-01 12:00:00', 'user_id': user_id,
+        'name': 'A Customer', 'address_line1': '1 High Street', 'city': 'London', 'postcode': 'N1 1AA',
+        'items': {'10 Pack': {'quantity': 2, 'unit_amount': 500}, 'No. 1': {'quantity': 1, 'unit_amount': 250}},
+        'total': 12.5, 'total_minor': 1250, 'currency': 'GBP', 'payment_status': 'pending'
+    }
+
+
+def save_order_to_csv(path, order_data, fsync=False):
+    """Per-order append, as order_service used to do it"""
+    file_exists = os.path.isfile(path)
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        if not file_exists:
+            writer.writeheader()
+        writer.writerow(order_csv_row(order_data))
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def run(mode, path, confirmers, total):
+    """Record total orders from confirmers threads; returns (orders/second, commit note)"""
+    per_thread = total // confirmers
+    journal = None
+    if mode in ('csv', 'csv-fsync'):
+        record = lambda data: save_order_to_csv(path, data, fsync=(mode == 'csv-fsync'))
+    else:
+        journal = OrderJournal(path, durable=(mode == 'journal'))
+        journal.start()
+        record = journal.append
+
+    barrier = threading.Barrier(confirmers + 1)
+
+    def confirmer(user_id):
+        barrier.wait()
+        for _ in range(per_thread):
+            record(order(user_id))
+
+    threads = [threading.Thread(target=confirmer, args=(i,)) for i in range(confirmers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    if journal is not None:
+        journal.flush()
+    elapsed = time.perf_counter() - start
+
+    if journal is None:
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        written = sum(1 for row in rows if row['payment_status'] == 'pending')
+    else:
+        written = sum(1 for _ in read_journal(path))
+    assert written == per_thread * confirmers, f"{mode}: {written} of {per_thread * confirmers} orders intact"
+    commits = f", {journal.stats()['avg_commit']} orders/commit" if journal is not None else ""
+    return per_thread * confirmers / elapsed, commits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--confirmers', type=int, nargs='+', default=[1, 10, 100])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for confirmers in args.confirmers:
+            results = []
+            for mode in ('csv', 'csv-fsync', 'journal', 'journal-async'):
+                path = os.path.join(directory, f"{mode}-{confirmers}")
+                rate, commits = run(mode, path, confirmers, args.orders)
+                results.append(f"{mode} {rate:,.0f}/s{commits}")
+            print(f"{confirmers:>3} confirmers: " + " | ".join(results))
+
+
+if __name__ == "__main__":
+    main()
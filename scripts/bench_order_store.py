@@ -0,0 +1,121 @@
+"""
+Benchmark: order lookups and payment updates at 1M orders, CSV scan vs order store
+
+Builds an orders CSV and an order store with the same synthetic orders
+(spread over a year and many customers), then times what the Stripe
+webhook and /myorders need: finding an order by id, marking it paid and
+listing a customer's latest orders. The CSV can only answer by scanning
+the whole file. Also checks the store's queries use its indexes.
+
+Usage:
+    python scripts/bench_order_store.py [--orders 1000000] [--users 50000]
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.services.order_service import CSV_FIELDS, order_csv_row
+from bot.services.order_store import OrderStore, STATUS_PAID
+
+PRODUCTS = [('10 Pack', 500), ('No. 1', 250), ('Gift Box', 1500), ('Sampler', 900)]
+
+
+def synthetic_orders(count, users):
+    """Yield orders in time order over a year"""
+    rng = random.Random(1)
+    start = time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1))
+    step = 365 * 86400 / count
+    for i in range(count):
+        items = {}
+        total = 0
+        for name, price in rng.sample(PRODUCTS, rng.randint(1, 3)):
+            quantity = rng.randint(1, 4)
+            items[name] = {'quantity': quantity, 'unit_amount': price}
+            total += price * quantity
+        yield {
+            'order_id': f"ORD{i:010d}",
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start + i * step)),
+            'user_id': rng.randint(1, users),
+            'name': 'A Customer', 'address_line1': '1 High Street', 'city': 'London', 'postcode': 'N1 1AA',
+            'items': items, 'total': total / 100, 'total_minor': total, 'currency': 'GBP',
+            'payment_status': 'pending'
+        }
+
+
+def timed(fn, samples):
+    """Average seconds per call of fn over samples"""
+    start = time.perf_counter()
+    for sample in samples:
+        fn(sample)
+    return (time.perf_counter() - start) / len(samples)
+
+
+def scan_csv(path, order_id):
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if row['order_id'] == order_id:
+                return row
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--samples', type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(2)
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'orders.csv')
+        store = OrderStore(os.path.join(directory, 'orders.db'))
+
+        start = time.perf_counter()
+        batch = []
+        with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            for order_data in synthetic_orders(args.orders, args.users):
+                writer.writerow(order_csv_row(order_data))
+                batch.append(order_data)
+                if len(batch) == 50000:
+                    store.add_many(batch)
+                    batch = []
+        if batch:
+            store.add_many(batch)
+        elapsed = time.perf_counter() - start
+        print(f"loaded {store.count():,} orders into CSV and store in {elapsed:.1f}s "
+              f"({args.orders / elapsed:,.0f} orders/s)")
+
+        ids = [f"ORD{rng.randrange(args.orders):010d}" for _ in range(args.samples)]
+        users = [rng.randint(1, args.users) for _ in range(args.samples)]
+
+        scan = timed(lambda order_id: scan_csv(csv_path, order_id), ids[:3])
+        print(f"    csv: find order by id {scan * 1000:,.0f}ms (full scan; /myorders needs the same)")
+
+        get = timed(store.get, ids)
+        paid = timed(lambda order_id: store.set_status(order_id, STATUS_PAID), ids)
+        mine = timed(lambda user_id: store.orders_for_user(user_id, limit=10), users)
+        print(f"  store: get {get * 1e6:.0f}us | mark paid {paid * 1e6:.0f}us | "
+              f"latest 10 orders of a user {mine * 1e6:.0f}us")
+        assert store.get(ids[0])['payment_status'] == STATUS_PAID
+
+        conn = store._conn()
+        for query, params in (
+            ("SELECT data, status FROM orders WHERE order_id = ?", (ids[0],)),
+            ("SELECT data, status FROM orders WHERE user_id = ? ORDER BY timestamp DESC LIMIT 10", (users[0],)),
+            ("SELECT COUNT(*) FROM orders WHERE status = ?", (STATUS_PAID,)),
+        ):
+            plan = " ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params))
+            assert 'SEARCH' in plan, f"full scan: {plan}"
+            print(f"  plan: {plan}")
+
+
+if __name__ == "__main__":
+    main()
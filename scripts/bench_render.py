@@ -0,0 +1,62 @@
+"""
+Benchmark: cart rendering time vs quantity
+
+Renders a three-line cart whose quantities grow from 1 to 10,000 units
+with the previous per-unit expansion (one sorted tuple and one output
+line per unit) and with the grouped renderer, and reports how many
+Telegram messages each result needs.
+
+Usage:
+    python scripts/bench_render.py [--repeat 50]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.catalog import Catalog
+from bot.utils.formatting import format_cart_message, format_minor, split_message
+
+QUANTITIES = (1, 10, 100, 1000, 10000)
+
+
+def per_unit_cart_message(cart, catalog, currency='GBP'):
+    lines = ["📦 Your Cart:\n"]
+    items_with_prices = []
+    total = 0
+    for product, quantity in catalog.split_cart(cart)[0]:
+        for _ in range(quantity):
+            items_with_prices.append((product.name, product.price_minor, product.price_label))
+        total += product.price_minor * quantity
+    items_with_prices.sort(key=lambda x: x[1])
+    for item, price, label in items_with_prices:
+        lines.append(f"{item} - {label}")
+    lines.append(f"\nTotal: {format_minor(total, currency)}")
+    return "\n".join(lines)
+
+
+def timed(render, cart, catalog, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        text = render(cart, catalog)
+    return (time.perf_counter() - start) / repeat * 1e6, len(split_message(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    catalog = Catalog({'Packs': {'10 Pack': '5', '20 Pack': '10', 'No. 1': '2.50'}})
+    print(f"{'units':>6} {'per-unit us':>12} {'msgs':>5} {'grouped us':>11} {'msgs':>5}")
+    for quantity in QUANTITIES:
+        cart = {name: quantity for name in catalog.products}
+        legacy_us, legacy_msgs = timed(per_unit_cart_message, cart, catalog, args.repeat)
+        grouped_us, grouped_msgs = timed(format_cart_message, cart, catalog, args.repeat)
+        print(f"{quantity:>6} {legacy_us:>12.1f} {legacy_msgs:>5} {grouped_us:>11.1f} {grouped_msgs:>5}")
+
+
+if __name__ == "__main__":
+    main()
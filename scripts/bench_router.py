@@ -0,0 +1,57 @@
+"""
+Microbenchmark: callback dispatch time vs number of registered routes
+
+Compares the indexed Router against a linear scan of lambda predicates
+(how telebot matches handlers registered with func=...), resolving the
+last-registered route so the linear scan sees its worst case.
+
+Usage:
+    python scripts/bench_router.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils.router import Router
+
+
+def build(routes):
+    """Build a router and the equivalent predicate list with `routes` routes"""
+    router = Router(state_getter=lambda user_id: None)
+    predicates = []
+    handler = lambda call: None
+
+    for i in range(routes // 2):
+        key = f"action_{i}"
+        router.callback(key)(handler)
+        predicates.append((lambda data, key=key: data == key, handler))
+    for i in range(routes - routes // 2):
+        prefix = f"p{i}_"
+        router.callback_prefix(prefix)(handler)
+        predicates.append((lambda data, prefix=prefix: data.startswith(prefix), handler))
+
+    probe = f"p{routes - routes // 2 - 1}_some_product"
+    return router, predicates, probe
+
+
+def linear_resolve(predicates, data):
+    for test, handler in predicates:
+        if test(data):
+            return handler
+    return None
+
+
+def main():
+    print(f"{'routes':>7} {'router (us)':>12} {'linear (us)':>12}")
+    for routes in (10, 50, 100, 500, 1000, 5000):
+        router, predicates, probe = build(routes)
+        number = 20000
+        indexed = timeit.timeit(lambda: router.resolve_callback(probe), number=number)
+        linear = timeit.timeit(lambda: linear_resolve(predicates, probe), number=number // 10) * 10
+        print(f"{routes:>7} {indexed / number * 1e6:>12.2f} {linear / number * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark: memory per session for 100k simulated users
+
+Compares the previous layout (one user spread across six module-level
+dicts plus checkout_data) with one UserSession record per user in the
+MemorySessionStore. Each simulated user has a session, a two-line cart,
+a checkout state and the three tracked message ids.
+
+Usage:
+    python scripts/bench_sessions.py [--users 100000]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.cart import Cart
+from bot.utils.session import MemorySessionStore
+
+
+def legacy_layout(users):
+    user_sessions, user_carts, user_states = {}, {}, {}
+    user_cart_messages, user_order_messages, user_checkout_messages = {}, {}, {}
+    checkout_data = {}
+    now = time.time()
+    for user_id in range(users):
+        user_sessions[user_id] = {'last_activity': now, 'active': True}
+        user_carts[user_id] = {'10 Pack': 2, 'No. 1': 1}
+        user_states[user_id] = 'awaiting_city'
+        user_cart_messages[user_id] = user_id
+        user_order_messages[user_id] = user_id
+        user_checkout_messages[user_id] = user_id
+        checkout_data[user_id] = {'name': 'A', 'address_line1': 'B'}
+    return (user_sessions, user_carts, user_states, user_cart_messages,
+            user_order_messages, user_checkout_messages, checkout_data)
+
+
+def record_layout(users):
+    store = MemorySessionStore()
+    for user_id in range(users):
+        session = store.get_or_create(user_id)
+        session.active = True
+        session.cart = Cart({'10 Pack': 2, 'No. 1': 1})
+        session.state = 'awaiting_city'
+        session.cart_message_id = user_id
+        session.order_message_id = user_id
+        session.checkout_message_id = user_id
+        session.checkout_data = {'name': 'A', 'address_line1': 'B'}
+    return store
+
+
+def measure(build, users):
+    tracemalloc.start()
+    start = time.perf_counter()
+    data = build(users)
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=100000)
+    args = parser.parse_args()
+
+    for name, build in (('six dicts', legacy_layout), ('UserSession', record_layout)):
+        size, elapsed = measure(build, args.users)
+        print(f"{name:>12}: {size / args.users:7.0f} bytes/session, "
+              f"{size / 2**20:6.1f} MiB total, built in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Check catalog hot reloads: reload latency and no updates dropped mid-reload
+
+Copies config.json to a temporary directory and first times reloads on
+their own: how long reload_catalog() takes to parse, compile and swap in
+a changed catalog, and how long the watcher takes to notice an edit.
+Then starts a local fake Bot API, registers the real handlers and pushes
+a stream of browse and add-to-cart callbacks through the dispatcher while
+config.json is rewritten over and over (prices changed, a product added
+and removed). Every update must be processed without an error and every
+add-to-cart callback answered exactly once, either adding the item or
+(for a button built from an older catalog) saying the menu is out of
+date; the carts must hold exactly the items reported added.
+
+Usage:
+    python scripts/check_catalog_reload.py [--users 200] [--reloads 50]
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telebot
+from telebot import ExceptionHandler
+
+from bot.config import Config
+from bot.handlers.commands import register_command_handlers
+from bot.handlers.cart import register_cart_handlers, live_cart_edits
+from bot.handlers.checkout import register_checkout_handlers
+from bot.services.cart_service import get_cart
+from bot.utils.deletions import message_deletions
+from bot.utils.dispatcher import UpdateDispatcher
+from bot.utils.router import Router
+from scripts.fake_telegram import FakeBotAPI, Updates, start_fake_api
+
+
+class CountErrors(ExceptionHandler):
+    """Counts handler exceptions instead of letting telebot raise them"""
+
+    def __init__(self):
+        self.errors = []
+
+    def handle(self, exception):
+        self.errors.append(exception)
+        return True
+
+
+def write_config(path, config_data):
+    """Replace config.json the way an editor or deploy would: write and rename"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(config_data, f)
+    os.replace(temp_path, path)
+
+
+def edited(config_data, round_number):
+    """A copy of config_data with prices changed and a product added or removed"""
+    config_data = json.loads(json.dumps(config_data))
+    products = config_data['products']
+    for category in products.values():
+        for name, price in category.items():
+            category[name] = f"{float(price) + (round_number % 3) / 100:.2f}"
+    first_category = next(iter(products.values()))
+    if round_number % 2:
+        first_category['Limited Edition'] = '9.99'
+    return config_data
+
+
+def time_reloads(config, original, reloads):
+    """Time reload_catalog() and the watcher's detection of an edit"""
+    swaps = []
+    for round_number in range(reloads):
+        write_config(config.path, edited(original, round_number + 1))
+        start = time.perf_counter()
+        assert config.reload_catalog(), "an edited config.json was not swapped in"
+        swaps.append(time.perf_counter() - start)
+
+    config.config_reload_interval = 0.01
+    config.start_catalog_watcher()
+    noticed = []
+    for round_number in range(reloads // 5):
+        version = config.catalog.version
+        write_config(config.path, edited(original, round_number))
+        start = time.perf_counter()
+        while config.catalog.version == version:
+            time.sleep(0.0005)
+        noticed.append(time.perf_counter() - start)
+
+    swaps.sort()
+    noticed.sort()
+    return (f"reload_catalog(): p50 {swaps[len(swaps) // 2] * 1000:.2f}ms max {swaps[-1] * 1000:.2f}ms | "
+            f"edit to swap with a {config.config_reload_interval * 1000:.0f}ms watcher: "
+            f"p50 {noticed[len(noticed) // 2] * 1000:.1f}ms max {noticed[-1] * 1000:.1f}ms")
+
+
+def check_updates_during_reloads(config, original, users, reloads):
+    """Push callbacks through the dispatcher while config.json keeps changing"""
+    errors = CountErrors()
+    bot = telebot.TeleBot('123:check', threaded=False, exception_handler=errors)
+    router = Router()
+    register_command_handlers(bot, config, router)
+    register_cart_handlers(bot, config, router)
+    register_checkout_handlers(bot, config, router)
+    router.install(bot)
+    message_deletions.start()
+
+    # Buttons are built from the catalog current when each update is sent,
+    # so a reload before it is processed makes it stale
+    def build(user, kind):
+        catalog = config.catalog
+        category = catalog.categories[0]
+        if kind == 'category':
+            return user.callback(catalog.category_callback(category))
+        product = catalog.products_in_category(category)[0]
+        return user.callback(catalog.product_callback(product))
+
+    plan = []
+    for user_id in range(1, users + 1):
+        user = Updates(user_id, first_name='Check')
+        plan.append((user, 'category'))
+        plan.extend((user, 'product') for _ in range(5))
+    adds = []
+
+    dispatcher = UpdateDispatcher(bot, workers=8, queue_size=len(plan))
+    dispatcher.start()
+
+    done = threading.Event()
+    reloaded = []
+
+    def keep_editing():
+        round_number = 0
+        while not done.is_set() and round_number < reloads:
+            round_number += 1
+            version = config.catalog.version
+            write_config(config.path, edited(original, round_number))
+            while config.catalog.version == version and not done.is_set():
+                time.sleep(0.001)
+            reloaded.append(round_number)
+            time.sleep(0.05)
+
+    editor = threading.Thread(target=keep_editing, daemon=True)
+    editor.start()
+    start = time.perf_counter()
+    for user, kind in plan:
+        update = build(user, kind)
+        if kind == 'product':
+            adds.append(update.callback_query.id)
+        dispatcher.submit(update)
+        time.sleep(0.0005)
+    dispatcher.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    editor.join()
+    live_cart_edits.join(timeout=10)
+    message_deletions.join(timeout=10)
+
+    processed = dispatcher.stats()['processed']
+    unanswered = [query_id for query_id in adds if len(FakeBotAPI.answers.get(query_id, [])) != 1]
+    reported = sum(FakeBotAPI.answers[query_id][0].startswith('Added') for query_id in adds
+                   if query_id not in unanswered)
+    in_carts = sum(get_cart(user_id).count for user_id in range(1, users + 1))
+    summary = (f"{len(plan)} updates in {elapsed:.1f}s across {len(reloaded)} reloads: "
+               f"{processed} processed, {len(errors.errors)} handler errors, "
+               f"{len(unanswered)} add-to-cart callbacks not answered exactly once, "
+               f"{reported} added and {len(adds) - reported} out of date, {in_carts} items in carts")
+    assert processed == len(plan), "updates were dropped"
+    assert not errors.errors, f"handlers failed: {errors.errors[:3]}"
+    assert not unanswered, f"callbacks not answered exactly once: {unanswered[:10]}"
+    assert in_carts == reported, "carts disagree with the items reported added"
+    assert reloaded, "no reload happened while updates were flowing"
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--reloads', type=int, default=50)
+    args = parser.parse_args()
+
+    FakeBotAPI.latency = 0
+    server = start_fake_api()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'config.json')
+        shutil.copy(args.config, path)
+        with open(path, 'r', encoding='utf-8') as f:
+            original = json.load(f)
+
+        # Handlers and reloads log every step; only the results are printed
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            config = Config(path)
+            timings = time_reloads(config, original, args.reloads)
+            updates = check_updates_during_reloads(config, original, args.users, args.reloads)
+            # Park the watcher before its directory goes away
+            config.config_reload_interval = 3600
+            time.sleep(0.05)
+        print(timings)
+        print(updates)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Check order ids stay unique and ordered across threads and processes
+
+Generates ids from several threads in each of several processes (forked
+and freshly spawned), then checks that no id repeats, that every
+thread's ids increase strictly, and that every id carries the (UTC)
+second it was created in. Then restarts the generator over and over, one
+fresh interpreter after another as a crashing or redeployed bot would,
+and checks those ids - which restart their sequence at 0, mostly within
+the same second - are unique too. Also reports generation throughput.
+
+Usage:
+    python scripts/check_order_ids.py [--processes 4] [--threads 4] [--ids 125000] [--restarts 20]
+"""
+import argparse
+import calendar
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.services.order_service import generate_order_id
+
+
+def generate(threads, count):
+    """Generate count ids on each of threads threads; returns (per-thread ids, seconds)"""
+    results = [None] * threads
+    barrier = threading.Barrier(threads + 1)
+
+    def work(index):
+        barrier.wait()
+        results[index] = [generate_order_id() for _ in range(count)]
+
+    workers = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return results, time.perf_counter() - start
+
+
+def process_main(args):
+    threads, count = args
+    results, _ = generate(threads, count)
+    return results
+
+
+def restarts(count, ids):
+    """Run count fresh interpreters one after another; returns the ids each generated"""
+    runs = []
+    for _ in range(count):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--emit', str(ids)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        runs.append(output.split())
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--ids', type=int, default=125000, help="Ids per thread")
+    parser.add_argument('--restarts', type=int, default=20)
+    parser.add_argument('--emit', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.emit is not None:
+        # One restart: print ids from a fresh process and exit
+        print('\n'.join(generate_order_id() for _ in range(args.emit)))
+        return
+
+    started = int(time.time())
+    results, elapsed = generate(1, args.ids)
+    print(f"single thread: {args.ids / elapsed:,.0f} ids/s")
+    results, elapsed = generate(args.threads, args.ids)
+    print(f"{args.threads} threads: {args.threads * args.ids / elapsed:,.0f} ids/s")
+
+    # Forked children inherit the parent's generator state and must not
+    # repeat its ids; spawned children start from a fresh import
+    sequences = list(results)
+    half = max(1, args.processes // 2)
+    for method, processes in (('fork', half), ('spawn', args.processes - half)):
+        if processes <= 0 or method not in multiprocessing.get_all_start_methods():
+            continue
+        with multiprocessing.get_context(method).Pool(processes) as pool:
+            for process_results in pool.map(process_main, [(args.threads, args.ids)] * processes):
+                sequences.extend(process_results)
+    sequences.append([generate_order_id() for _ in range(1000)])
+    finished = int(time.time())
+
+    total = sum(len(ids) for ids in sequences)
+    unique = set()
+    for ids in sequences:
+        assert all(a < b for a, b in zip(ids, ids[1:])), "ids within a thread must increase"
+        unique.update(ids)
+    assert len(unique) == total, f"{total - len(unique)} duplicate ids"
+
+    ordered = sorted(unique)
+    for order_id in (ordered[0], ordered[-1]):
+        second = calendar.timegm(time.strptime(order_id[3:17], '%Y%m%d%H%M%S'))
+        assert started <= second <= finished, f"{order_id} is outside the run"
+    print(f"{total:,} ids from {len(sequences)} threads in {args.processes + 1} processes: "
+          f"all unique, per-thread increasing, stamped with their creation time")
+    print(f"e.g. {ordered[0]} .. {ordered[-1]}")
+
+    runs = restarts(args.restarts, 1000)
+    restarted = [order_id for ids in runs for order_id in ids]
+    nodes = {ids[0].split('-')[1] for ids in runs}
+    seconds = {order_id[3:17] for order_id in restarted}
+    assert len(nodes) == len(runs), "a restart reused an earlier node"
+    assert len(set(restarted) | unique) == len(restarted) + len(unique), \
+        f"{len(restarted) + len(unique) - len(set(restarted) | unique)} duplicate ids across restarts"
+    print(f"{len(restarted):,} ids from {len(runs)} restarts within {len(seconds)} seconds: "
+          f"all unique, {len(nodes)} distinct nodes")
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
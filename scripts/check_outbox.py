@@ -0,0 +1,233 @@
+"""
+Check the outbound queue against a fake Bot API that enforces rate limits
+
+The fake API applies Telegram-like limits (a global and a per-chat token
+bucket) and answers anything over them with 429 and a retry_after. A
+burst of messages to many chats plus callback answers is sent once
+straight through telebot and once through the Outbox, reporting 429s
+surfaced to callers, delivery, and per-lane waits. It then checks that a
+forced 429 is retried after retry_after rather than raised, that a 429 on
+a call without a chat holds back only that method, and that a long
+retry_after is handed back to the caller instead of parking its thread.
+
+Usage:
+    python scripts/check_outbox.py [--chats 20] [--messages 5] [--callbacks 20]
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telebot
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException
+
+from bot.services.outbox import Outbox, TokenBucket
+
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+
+
+class LimitedBotAPI(BaseHTTPRequestHandler):
+    """Fake Bot API enforcing global and per-chat limits"""
+    lock = threading.Lock()
+    global_bucket = None
+    chat_buckets = {}
+    delivered = {}
+    forced_429 = {}  # chat_id (or method, for calls without one) -> retry_after
+    too_many = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        path, _, query = self.path.partition('?')
+        method = path.rsplit('/', 1)[-1]
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        params = {k: v[0] for k, v in parse_qs(query or body).items()}
+        chat_id = params.get('chat_id')
+        cls = LimitedBotAPI
+
+        with cls.lock:
+            now = time.monotonic()
+            wait = 0.0
+            forced_key = chat_id if chat_id is not None else method
+            if forced_key in cls.forced_429:
+                wait = cls.forced_429.pop(forced_key)
+            buckets = [cls.global_bucket]
+            if chat_id is not None:
+                if chat_id not in cls.chat_buckets:
+                    cls.chat_buckets[chat_id] = TokenBucket(CHAT_RATE, CHAT_BURST, now)
+                buckets.append(cls.chat_buckets[chat_id])
+            for bucket in buckets:
+                wait = max(wait, bucket.ready_at(now) - now)
+            if wait > 0:
+                cls.too_many += 1
+                retry_after = math.ceil(wait)
+                self._reply({'ok': False, 'error_code': 429,
+                             'description': f"Too Many Requests: retry after {retry_after}",
+                             'parameters': {'retry_after': retry_after}}, status=429)
+                return
+            for bucket in buckets:
+                bucket.tokens -= 1
+            cls.delivered[method] = cls.delivered.get(method, 0) + 1
+
+        if method == 'sendMessage':
+            self._reply({'ok': True, 'result': {
+                'message_id': 1, 'date': 0, 'text': params.get('text', ''),
+                'chat': {'id': int(chat_id), 'type': 'private'}
+            }})
+        else:
+            self._reply({'ok': True, 'result': True})
+
+    do_GET = _handle
+    do_POST = _handle
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            # A couple of tokens of slack: calls granted together by the outbox
+            # can reach the server a little out of step with its bucket
+            cls.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE + 2, time.monotonic())
+            cls.chat_buckets = {}
+            cls.delivered = {}
+            cls.forced_429 = {}
+            cls.too_many = 0
+
+
+def run_burst(bot, chats, messages, callbacks):
+    """Send messages to every chat plus callback answers; returns (errors, lane waits)"""
+    errors = []
+    waits = {'message': [], 'callback': []}
+    lock = threading.Lock()
+
+    def call(kind, fn):
+        start = time.perf_counter()
+        try:
+            fn()
+        except ApiTelegramException as e:
+            with lock:
+                errors.append(e.error_code)
+            return
+        with lock:
+            waits[kind].append(time.perf_counter() - start)
+
+    threads = []
+    for chat_id in range(1, chats + 1):
+        for i in range(messages):
+            threads.append(threading.Thread(
+                target=call, args=('message', lambda c=chat_id, i=i: bot.send_message(c, f"message {i}"))
+            ))
+    for i in range(callbacks):
+        threads.append(threading.Thread(
+            target=call, args=('callback', lambda i=i: bot.answer_callback_query(str(i)))
+        ))
+    # Messages first so callback answers arrive behind a full queue
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors, waits
+
+
+def describe(name, errors, waits):
+    delivered = LimitedBotAPI.delivered
+    parts = [f"{name:>8}: {len(errors)} errors raised ({LimitedBotAPI.too_many} 429s from the API)",
+             f"{delivered.get('sendMessage', 0)} messages and "
+             f"{delivered.get('answerCallbackQuery', 0)} callback answers delivered"]
+    for kind, values in waits.items():
+        if values:
+            values = sorted(values)
+            parts.append(f"{kind} p50 {values[len(values) // 2] * 1000:.0f}ms")
+    print(", ".join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--chats', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=5)
+    parser.add_argument('--callbacks', type=int, default=20)
+    args = parser.parse_args()
+
+    ThreadingHTTPServer.request_queue_size = 512
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LimitedBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    apihelper.API_URL = f"http://127.0.0.1:{server.server_port}/bot{{0}}/{{1}}"
+    bot = telebot.TeleBot('123:check', threaded=False)
+    total = args.chats * args.messages
+
+    LimitedBotAPI.reset()
+    errors, waits = run_burst(bot, args.chats, args.messages, args.callbacks)
+    describe('direct', errors, waits)
+
+    outbox = Outbox(global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST)
+    outbox.install()
+    LimitedBotAPI.reset()
+    errors, waits = run_burst(bot, args.chats, args.messages, args.callbacks)
+    describe('outbox', errors, waits)
+    assert not errors, f"outbox surfaced errors: {errors}"
+    assert LimitedBotAPI.delivered.get('sendMessage') == total
+    assert LimitedBotAPI.delivered.get('answerCallbackQuery') == args.callbacks
+    assert max(waits['callback']) < sorted(waits['message'])[len(waits['message']) // 2], \
+        "callback answers should not wait behind queued messages"
+
+    # A 429 with retry_after is retried after the wait, not raised
+    LimitedBotAPI.forced_429['999'] = 2.0
+    start = time.perf_counter()
+    bot.send_message(999, "after retry")
+    elapsed = time.perf_counter() - start
+    assert 2.0 <= elapsed < 4.0, f"retry took {elapsed:.2f}s"
+    print(f"forced 429: delivered after retry_after in {elapsed:.2f}s")
+
+    # A 429 on answerCallbackQuery blocks callback answers, not messages
+    LimitedBotAPI.forced_429['answerCallbackQuery'] = 2.0
+    answered = threading.Thread(target=bot.answer_callback_query, args=('blocked',))
+    answered.start()
+    time.sleep(0.2)
+    start = time.perf_counter()
+    bot.send_message(997, "not held back")
+    elapsed = time.perf_counter() - start
+    answered.join()
+    assert elapsed < 0.5, f"a message waited {elapsed:.2f}s behind a callback answer's 429"
+    print(f"callback 429: messages to other chats still sent in {elapsed * 1000:.0f}ms")
+
+    # A long retry_after comes back to the caller at once, and later calls
+    # to that chat fail fast until it passes; other chats are unaffected
+    LimitedBotAPI.forced_429['998'] = 30.0
+    for attempt in range(2):
+        start = time.perf_counter()
+        try:
+            bot.send_message(998, "rate limited")
+            raise AssertionError("a 30s retry_after was waited out")
+        except ApiTelegramException as e:
+            assert e.error_code == 429, e
+        elapsed = time.perf_counter() - start
+        assert elapsed < 0.5, f"caller parked for {elapsed:.2f}s"
+    start = time.perf_counter()
+    bot.send_message(996, "other chat")
+    assert time.perf_counter() - start < 0.5
+    print(f"long 429: returned to the caller in {elapsed * 1000:.0f}ms, other chats unaffected")
+    print(f"outbox stats: {json.dumps(outbox.stats()['lanes'])}")
+    print("OK")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
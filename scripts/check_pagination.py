@@ -0,0 +1,92 @@
+"""
+Check and benchmark paginated product keyboards for a 10,000-item category
+
+Walks every page of a 10,000-product category through the Next buttons
+the way a user would, checking that each product appears exactly once, in
+catalog order, that callback_data stays within Telegram's limits and that
+out-of-range pages clamp to the last one. Then compares the time to build
+one page against building a single keyboard with the whole category.
+
+Usage:
+    python scripts/check_pagination.py [--items 10000] [--page-size 10]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.catalog import Catalog
+from bot.utils import keyboards
+
+CALLBACK_DATA_LIMIT = 64
+
+
+def build_catalog(items):
+    return Catalog({
+        '🍕 Pizza': {f"🍕 Pizza No. {i}": f"{i % 20 + 5}.99" for i in range(items)},
+        'Sides': {'Fries': '2.50'}
+    })
+
+
+def buttons(keyboard):
+    return [button for row in json.loads(keyboard)['inline_keyboard'] for button in row]
+
+
+def walk_pages(catalog, category, page_size):
+    """Follow Next buttons from page 0; returns (product buttons, pages seen)"""
+    seen = []
+    pages = 0
+    data = catalog.category_callback(category)
+    while data is not None:
+        decoded_category, page = catalog.decode_category(data)
+        assert decoded_category == category
+        page_buttons = buttons(keyboards.products_keyboard(catalog, category, page, page_size))
+        pages += 1
+        data = None
+        for button in page_buttons:
+            assert len(button['callback_data'].encode('utf-8')) <= CALLBACK_DATA_LIMIT
+            product = catalog.decode_product(button['callback_data'])
+            if product is not None:
+                seen.append(product)
+            elif button['text'].startswith('Next'):
+                data = button['callback_data']
+    return seen, pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--page-size', type=int, default=10)
+    args = parser.parse_args()
+
+    catalog = build_catalog(args.items)
+    category = catalog.categories[0]
+
+    start = time.perf_counter()
+    seen, pages = walk_pages(catalog, category, args.page_size)
+    walk_ms = (time.perf_counter() - start) * 1000
+    assert seen == catalog.products_in_category(category), "pages skip, repeat or reorder products"
+    assert pages == catalog.page_count(category, args.page_size)
+    last = keyboards.products_keyboard(catalog, category, pages - 1, args.page_size)
+    assert keyboards.products_keyboard(catalog, category, pages + 50, args.page_size) is last
+    # A one-page category gets no navigation row
+    assert len(buttons(keyboards.products_keyboard(catalog, 'Sides', 0, args.page_size))) == 2
+    print(f"OK: {len(seen)} products on {pages} pages, walked in {walk_ms:.0f}ms")
+
+    repeat = 20
+    start = time.perf_counter()
+    for i in range(repeat):
+        items, _, _ = catalog.category_page(category, i * 37 % pages, args.page_size)
+        keyboards._inline(*([(p.name, catalog.product_callback(p))] for p in items))
+    page_us = (time.perf_counter() - start) / repeat * 1e6
+    start = time.perf_counter()
+    keyboards._inline(*([(p.name, catalog.product_callback(p))] for p in catalog.products_in_category(category)))
+    full_us = (time.perf_counter() - start) * 1e6
+    print(f"one page: {page_us:.0f}us to build, whole category in one keyboard: {full_us:.0f}us")
+
+
+if __name__ == "__main__":
+    main()
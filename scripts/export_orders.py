@@ -0,0 +1,54 @@
+"""
+Export orders to the orders CSV layout
+
+Streams orders one at a time, so memory use stays flat however many
+there are, and writes the columns orders.csv has always had. Orders come
+from the order store (with their current payment status, optionally
+filtered by day and status) or, with --journal, straight from the order
+journal.
+
+Usage:
+    python scripts/export_orders.py [--db orders.db] [--since 2024-01-01] [--until 2024-12-31]
+                                    [--status paid] [--out orders.csv]
+    python scripts/export_orders.py --journal orders.jsonl [--out orders.csv]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.services.order_journal import read_journal
+from bot.services.order_store import OrderStore
+from bot.services.order_service import ORDERS_FILE, export_orders_csv
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--db', default=os.getenv('ORDER_DB_PATH', 'orders.db'))
+    parser.add_argument('--journal', help="Export this order journal instead of the store")
+    parser.add_argument('--since', help="First day (YYYY-MM-DD)")
+    parser.add_argument('--until', help="Last day (YYYY-MM-DD)")
+    parser.add_argument('--status', help="Only orders with this payment status")
+    parser.add_argument('--out', default=ORDERS_FILE, help="CSV file to write ('-' for stdout)")
+    args = parser.parse_args()
+
+    if args.journal:
+        source = args.journal
+        orders = read_journal(args.journal)
+    else:
+        if not os.path.exists(args.db):
+            parser.error(f"{args.db} does not exist")
+        source = args.db
+        orders = OrderStore(args.db).iter_orders(args.since, args.until, args.status)
+
+    if args.out == '-':
+        count = export_orders_csv(orders, sys.stdout)
+    else:
+        with open(args.out, 'w', newline='', encoding='utf-8') as f:
+            count = export_orders_csv(orders, f)
+    print(f"Exported {count} orders from {source}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
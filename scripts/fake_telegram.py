@@ -0,0 +1,162 @@
+"""
+Fake Bot API server and update builder shared by the scripts
+
+FakeBotAPI answers every Bot API method after a fixed delay (latency),
+counting calls per method and recording callback answers per query id;
+getUpdates serves FakeBotAPI.updates from the requested offset, so a bot
+can poll it. Subclass it and override answer() to serve other paths (a
+Stripe stand-in, say) or on_call() to record more of each call.
+start_fake_api() serves a handler on a free local port and points telebot,
+sync and async, at it. Updates builds the updates one simulated user
+sends.
+"""
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from telebot import apihelper, asyncio_helper, types
+
+
+class FakeBotAPI(BaseHTTPRequestHandler):
+    """Answers every Bot API method after a fixed delay, recording the calls"""
+    latency = 0.05
+    updates = []
+    lock = threading.Lock()
+
+    @classmethod
+    def reset(cls):
+        cls.message_id = 0
+        cls.calls = {}
+        cls.answers = {}
+        cls.requests = 0
+        cls.misplaced = 0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        path, _, query = self.path.partition('?')
+        self.answer(path, query, body)
+
+    do_GET = do_POST
+
+    def answer(self, path, query, body):
+        method = path.rsplit('/', 1)[-1]
+        if method == 'getUpdates':
+            return self._get_updates(query, body)
+        if method == 'deleteWebhook':
+            return self.reply(True)
+        if method == 'getMe':
+            return self.reply({'id': 123, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'})
+
+        cls = type(self)
+        params = parse_qs(query)
+        with cls.lock:
+            cls.requests += 1
+            # telebot's requests sender puts parameters in the query string
+            if body or not query:
+                cls.misplaced += 1
+            cls.calls[method] = cls.calls.get(method, 0) + 1
+            cls.message_id += 1
+            message_id = cls.message_id
+            if method == 'answerCallbackQuery':
+                cls.answers.setdefault(params['callback_query_id'][0], []).append(params.get('text', [''])[0])
+            self.on_call(method, params)
+        time.sleep(self.latency)
+
+        if method in ('sendMessage', 'editMessageText'):
+            result = {'message_id': message_id, 'date': 0,
+                      'chat': {'id': 1, 'type': 'private'}, 'text': ''}
+        else:
+            result = True
+        self.reply(result)
+
+    def on_call(self, method, params):
+        """Called under the lock for every method answered; params as from parse_qs"""
+
+    def _get_updates(self, query, body):
+        # TeleBot sends the offset in the query string, AsyncTeleBot in a
+        # form body
+        params = parse_qs(query) or parse_qs(body.decode())
+        offset = int(params.get('offset', ['0'])[0])
+        time.sleep(self.latency)
+        try:
+            self.reply([update for update in self.updates if update['update_id'] >= offset][:100])
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Polling was stopped while this request was in flight
+
+    def reply(self, result):
+        """Send a successful Bot API response"""
+        self.send_json({'ok': True, 'result': result})
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+FakeBotAPI.reset()
+
+
+class FakeAPIServer(ThreadingHTTPServer):
+    # A deep accept backlog: dropped connects retry after 1s and skew timings
+    request_queue_size = 256
+
+
+def start_fake_api(handler=FakeBotAPI):
+    """Serve handler on a free local port and point telebot at it; returns the server"""
+    server = FakeAPIServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_port}/bot{{0}}/{{1}}"
+    apihelper.API_URL = api_url
+    asyncio_helper.API_URL = api_url
+    return server
+
+
+class Updates:
+    """Builds updates for one simulated user
+
+    Update, message and callback query ids come from ids, a range of the
+    user's own by default; give every user the same itertools.count() to
+    number one stream across users.
+    """
+
+    def __init__(self, user_id, ids=None, first_name='Bench', username=None):
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': first_name}
+        if username:
+            self.user['username'] = username
+        self.chat = {'id': user_id, 'type': 'private'}
+        self.ids = ids if ids is not None else itertools.count(user_id * 1000 + 1)
+
+    def _message(self, message_id, text=None):
+        message = {'message_id': message_id, 'date': 0, 'chat': self.chat, 'from': self.user}
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return message
+
+    def text_json(self, text):
+        update_id = next(self.ids)
+        return {'update_id': update_id, 'message': self._message(update_id, text)}
+
+    def callback_json(self, data):
+        update_id = next(self.ids)
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'from': self.user, 'chat_instance': '1',
+            'message': self._message(update_id), 'data': data
+        }}
+
+    def text(self, text):
+        return types.Update.de_json(self.text_json(text))
+
+    def callback(self, data):
+        return types.Update.de_json(self.callback_json(data))
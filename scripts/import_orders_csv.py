@@ -0,0 +1,84 @@
+"""
+Import an existing orders.csv into the order store
+
+One-shot migration for orders written before the order journal and store
+existed. Rows are streamed and inserted in batches; orders already in the
+store are left as they are, so running it twice is harmless. The CSV has
+no user ids or unit prices, so imported orders don't show up in
+/myorders and their items carry quantities only.
+
+Usage:
+    python scripts/import_orders_csv.py [orders.csv] [--db orders.db] [--currency GBP]
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.services.order_service import ORDERS_FILE
+from bot.services.order_store import OrderStore, STATUS_PENDING
+from bot.utils.formatting import to_minor_units
+
+BATCH_SIZE = 10000
+
+
+def parse_items(items_str):
+    """Parse the CSV items column ("10 Pack x2; No. 1 x1")"""
+    items = {}
+    for part in items_str.split('; '):
+        name, _, quantity = part.rpartition(' x')
+        if name and quantity.isdigit():
+            items[name] = {'quantity': int(quantity)}
+    return items
+
+
+def csv_orders(path, currency):
+    """Yield order records for the rows of an orders CSV"""
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            total = float(row['total'] or 0)
+            yield {
+                'order_id': row['order_id'],
+                'timestamp': row['timestamp'],
+                'user_id': None,
+                'name': row['name'],
+                'address_line1': row['address_line1'],
+                'city': row['city'],
+                'postcode': row['postcode'],
+                'items': parse_items(row['items']),
+                'total': total,
+                'total_minor': to_minor_units(round(total, 2)),
+                'currency': currency,
+                'payment_status': row.get('payment_status') or STATUS_PENDING
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('csv', nargs='?', default=ORDERS_FILE)
+    parser.add_argument('--db', default=os.getenv('ORDER_DB_PATH', 'orders.db'))
+    parser.add_argument('--currency', default='GBP')
+    args = parser.parse_args()
+
+    store = OrderStore(args.db)
+    start = time.perf_counter()
+    read = inserted = 0
+    batch = []
+    for order_data in csv_orders(args.csv, args.currency):
+        batch.append(order_data)
+        if len(batch) == BATCH_SIZE:
+            inserted += store.add_many(batch)
+            read += len(batch)
+            batch = []
+    if batch:
+        inserted += store.add_many(batch)
+        read += len(batch)
+    print(f"Imported {inserted} of {read} orders from {args.csv} into {args.db} "
+          f"in {time.perf_counter() - start:.1f}s ({read - inserted} already present)")
+
+
+if __name__ == "__main__":
+    main()
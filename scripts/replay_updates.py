@@ -0,0 +1,65 @@
+"""
+Replay recorded Telegram updates against the bot's webhook endpoint
+
+Acts as a local stand-in for Telegram when testing webhook mode: each
+update (one JSON object per line, or a JSON array) is POSTed to the
+secret path with the secret token header, exactly as Telegram would.
+
+Usage:
+    python scripts/replay_updates.py updates.jsonl \
+        --url http://localhost:5000 --secret <TELEGRAM_WEBHOOK_SECRET>
+"""
+import argparse
+import json
+import time
+import requests
+
+
+def load_updates(path):
+    """Load recorded updates from a JSON array or JSON lines file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read().strip()
+    if content.startswith('['):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def replay(updates, url, secret):
+    """POST every update to the webhook and return per-request latencies"""
+    endpoint = f"{url.rstrip('/')}/telegram/{secret}"
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret}
+    latencies = []
+    failures = 0
+
+    with requests.Session() as session:
+        for update in updates:
+            start = time.perf_counter()
+            response = session.post(endpoint, json=update, headers=headers, timeout=10)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                failures += 1
+                print(f"update {update.get('update_id')}: HTTP {response.status_code}")
+
+    return latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('updates', help="File with recorded update JSON")
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--secret', required=True)
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates)
+    latencies, failures = replay(updates, args.url, args.secret)
+
+    if latencies:
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        print(f"Sent {len(latencies)} updates, {failures} failed, "
+              f"ack p50={p50:.1f}ms p99={p99:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Sales report from the order store's daily, product and category rollups
+
+The rollups are kept up to date as orders are written, so a report over
+any range of days reads a few hundred rows, not every order. --rebuild
+recomputes them from the orders first (in one streaming pass).
+
+Usage:
+    python scripts/sales_report.py [--db orders.db] [--since 2024-01-01] [--until 2024-12-31] [--days] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.services.order_store import OrderStore
+from bot.utils.formatting import format_sales_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--db', default=os.getenv('ORDER_DB_PATH', 'orders.db'))
+    parser.add_argument('--since', help="First day (YYYY-MM-DD)")
+    parser.add_argument('--until', help="Last day (YYYY-MM-DD)")
+    parser.add_argument('--days', action='store_true', help="Include a line per day")
+    parser.add_argument('--currency', default='GBP')
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    parser.add_argument('--rebuild', action='store_true', help="Recompute the rollups from the orders first")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+    store = OrderStore(args.db)
+    if args.rebuild:
+        start = time.perf_counter()
+        store.rebuild_rollups()
+        print(f"Rebuilt rollups in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    start = time.perf_counter()
+    report = store.sales_report(args.since, args.until)
+    elapsed = time.perf_counter() - start
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        title = f"Sales {args.since or 'start'} to {args.until or 'today'}"
+        print(format_sales_report(report, title, args.currency, include_days=args.days))
+    print(f"Report built in {elapsed * 1000:.1f}ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Contention stress check for the striped session/cart store
+
+Many threads hammer an overlapping set of users with add_to_cart,
+update_cart_quantity and clear_cart while the expiry sweep runs, then the
+final carts are checked against the exact number of adds made per user.
+
+Usage:
+    python scripts/stress_carts.py [--store memory|sqlite] [--threads 32]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils import session as session_module
+from bot.utils.session import MemorySessionStore, SQLiteSessionStore
+from bot.services.cart_service import add_to_cart, update_cart_quantity, get_cart
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--store', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--ops', type=int, default=2000, help="Operations per thread")
+    args = parser.parse_args()
+
+    if args.store == 'sqlite':
+        path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+        session_module.configure_session_store(SQLiteSessionStore(path))
+    else:
+        session_module.configure_session_store(MemorySessionStore())
+    store = session_module.get_session_store()
+
+    expected = {user_id: 0 for user_id in range(args.users)}
+    expected_lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        added = {}
+        for _ in range(args.ops):
+            user_id = rng.randrange(args.users)
+            add_to_cart(user_id, 'counted', 1)
+            added[user_id] = added.get(user_id, 0) + 1
+            # Uncounted churn on a second line in the same carts
+            update_cart_quantity(user_id, 'churn', rng.randrange(3))
+        with expected_lock:
+            for user_id, count in added.items():
+                expected[user_id] += count
+
+    def sweeper():
+        # Nothing is idle, so the sweep must never drop a live cart
+        while not stop.is_set():
+            store.expire(time.time() - 3600)
+
+    sweep_thread = threading.Thread(target=sweeper)
+    sweep_thread.start()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    sweep_thread.join()
+
+    lost = {
+        user_id: count - get_cart(user_id).get('counted', 0)
+        for user_id, count in expected.items()
+        if get_cart(user_id).get('counted', 0) != count
+    }
+    total_ops = args.threads * args.ops * 2
+    print(f"{args.store}: {total_ops} cart operations on {args.users} users "
+          f"from {args.threads} threads in {elapsed:.2f}s")
+    if lost:
+        print(f"FAILED: carts disagree with adds made: {lost}")
+        sys.exit(1)
+    print("OK: every add accounted for")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,63 @@
 """
 Flask app for webhook endpoints
 """
-from flask import Flask
+import hmac
 
-def create_flask_app(bot, config):
+from flask import Flask, jsonify, request
+
+from bot.utils.edits import edit_stats
+from bot.utils.deletions import message_deletions
+from bot.services.order_service import get_order_journal
+from bot.services.payment_service import payment_sessions
+
+STATS_TOKEN_HEADER = 'X-Stats-Token'
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+def stats_allowed(config):
+    """Whether the current request may read /stats: from localhost or with the stats token"""
+    # A reverse proxy on the same host connects from localhost too, but
+    # says who it's forwarding for
+    if request.remote_addr in LOCAL_ADDRESSES and 'X-Forwarded-For' not in request.headers:
+        return True
+    token = request.headers.get(STATS_TOKEN_HEADER, '')
+    return bool(config.stats_token) and hmac.compare_digest(token, config.stats_token)
+
+def create_flask_app(bot, config, dispatcher=None, outbox=None, engine=None):
     """Create and configure Flask app"""
     app = Flask(__name__)
     
     # Import and register webhook handlers
     from webhooks.stripe_handler import register_stripe_webhook
-    register_stripe_webhook(app, bot, config)
+    register_stripe_webhook(app, bot, config, engine)
+    
+    if config.telegram_mode == 'webhook' and dispatcher is not None:
+        from webhooks.telegram_handler import register_telegram_webhook
+        register_telegram_webhook(app, dispatcher, config)
     
     # Health check endpoint
     @app.route('/')
     def health_check():
         return "Bot is running", 200
     
+    @app.route('/stats')
+    def stats():
+        # The app faces the internet in webhook mode
+        if not stats_allowed(config):
+            return 'Forbidden', 403
+        stats = {
+            'edits': edit_stats(),
+            'deletions': message_deletions.stats(),
+            'orders': get_order_journal().stats(),
+            'payments': payment_sessions.stats()
+        }
+        if dispatcher is not None:
+            stats['dispatcher'] = dispatcher.stats()
+        if outbox is not None:
+            stats['outbox'] = outbox.stats()
+        if engine is not None:
+            stats['engine'] = engine.stats()
+        return jsonify(stats), 200
+    
     @app.route('/success')
     def payment_success():
         return """
@@ -4,11 +4,14 @@ Stripe webhook event handler
 from flask import request
 import stripe
 import json
-from bot.services.email_service import send_payment_confirmation_email
-from bot.utils.formatting import format_receipt
+from bot.services.email_service import send_payment_confirmation_email, send_payment_confirmation_email_async
+from bot.services.order_service import get_order_store
+from bot.services.order_store import STATUS_PAID
+from bot.utils.formatting import format_receipt, send_long_message
+from bot.services.outbox import outbound_lane, LANE_RECEIPT
 
-def register_stripe_webhook(app, bot, config):
-    """Register Stripe webhook endpoint"""
+def register_stripe_webhook(app, bot, config, engine=None):
+    """Register Stripe webhook endpoint (emails go out on engine's loop, if given)"""
     
     @app.route('/webhook', methods=['POST'])
     def stripe_webhook():
@@ -33,13 +36,13 @@ def register_stripe_webhook(app, bot, config):
         if event['type'] == 'checkout.session.completed':
             print(f"[v0] Processing checkout.session.completed event")
             session = event['data']['object']
-            handle_successful_payment(session, bot, config)
+            handle_successful_payment(session, bot, config, engine)
         else:
             print(f"[v0] Unhandled event type: {event['type']}")
         
         return 'Success', 200
 
-def handle_successful_payment(session, bot, config):
+def handle_successful_payment(session, bot, config, engine=None):
     """Handle successful payment event"""
     print(f"[v0] handle_successful_payment called")
     metadata = session.get('metadata', {})
@@ -62,27 +65,52 @@ def handle_successful_payment(session, bot, config):
     try:
         user_id = int(user_id)
         
-        items_dict = json.loads(items_json) if items_json else {}
+        # Mark the order paid. Stripe can deliver an event more than once,
+        # so an order that is already paid isn't confirmed again.
+        store = get_order_store()
+        stored_order = None
+        if store is not None:
+            previous_status = store.set_status(order_id, STATUS_PAID)
+            if previous_status == STATUS_PAID:
+                print(f"[v0] Order {order_id} is already paid, ignoring repeated event")
+                return
+            if previous_status is not None:
+                stored_order = store.get(order_id)
+                print(f"[v0] Order {order_id} marked paid (was {previous_status})")
+            else:
+                print(f"[v0] WARNING: Order {order_id} not found in the order store")
         
-        order_data = {
-            'order_id': order_id,
-            'username': username,
-            'name': customer_name,
-            'address_line1': address_line1,
-            'city': city,
-            'postcode': postcode,
-            'items': items_dict,
-            'total': float(total),
-            'currency': config.currency
-        }
+        if stored_order is not None:
+            order_data = dict(stored_order, username=username)
+        else:
+            # Orders the store doesn't know are rebuilt from the metadata
+            items_dict = json.loads(items_json) if items_json else {}
+            
+            order_data = {
+                'order_id': order_id,
+                'username': username,
+                'name': customer_name,
+                'address_line1': address_line1,
+                'city': city,
+                'postcode': postcode,
+                'items': items_dict,
+                'total': float(total),
+                'currency': config.currency
+            }
         
         print(f"[v0] Sending receipt to Telegram user {user_id}")
         receipt_text = format_receipt(order_data, config.currency)
-        bot.send_message(user_id, receipt_text)
+        # Receipts go ahead of ordinary messages in the outbound queue
+        with outbound_lane(LANE_RECEIPT):
+            send_long_message(bot, user_id, receipt_text)
         print(f"[v0] Receipt sent to Telegram")
         
         print(f"[v0] Sending email notification")
-        send_payment_confirmation_email(order_data, config)
+        if engine is not None:
+            # Sent on the event loop; Stripe gets its answer without waiting for Mailgun
+            engine.submit(send_payment_confirmation_email_async(order_data, config, engine.session))
+        else:
+            send_payment_confirmation_email(order_data, config)
         
         print(f"[v0] Payment confirmed for order {order_id}")
         
@@ -0,0 +1,37 @@
+"""
+Telegram webhook update handler
+"""
+import hmac
+from flask import request
+from telebot import types
+
+TELEGRAM_SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+def get_telegram_webhook_path(config):
+    """Get the secret URL path Telegram pushes updates to"""
+    return f"/telegram/{config.telegram_webhook_secret}"
+
+def register_telegram_webhook(app, dispatcher, config):
+    """Register the Telegram update endpoint on the Flask app"""
+
+    @app.route(get_telegram_webhook_path(config), methods=['POST'])
+    def telegram_webhook():
+        secret = request.headers.get(TELEGRAM_SECRET_HEADER, '')
+        if not hmac.compare_digest(secret, config.telegram_webhook_secret):
+            return 'Forbidden', 403
+
+        try:
+            update = types.Update.de_json(request.get_data(as_text=True))
+        except ValueError as e:
+            print(f"[telegram] Invalid update payload: {e}")
+            return 'Invalid payload', 400
+
+        if update is None:
+            return 'Invalid payload', 400
+
+        # Acknowledge straight away; handlers run on the dispatcher's workers.
+        # A full shard asks Telegram to redeliver later instead of blocking.
+        if not dispatcher.submit(update, block=False):
+            return 'Busy', 503
+
+        return '', 200